@@ -6,33 +6,40 @@
 
 import json
 import logging
+import os
+import sys
+from contextlib import nullcontext
 from datetime import datetime, timedelta
 import pytz
-from decimal import Decimal
 from typing import Dict, List, Optional
 
-from tinkoff.invest import Client, RequestError
-from tinkoff.invest.schemas import MoneyValue, Quotation
+from tinkoff.invest import Client
+from tinkoff.invest.schemas import OperationType
+
+# Общий код бота (portfolio_telegram_bot) — рядом со скриптом, при запуске из любого каталога
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from portfolio_telegram_bot.src.instrument_catalog import InstrumentCatalog
+from portfolio_telegram_bot.src.operations_ledger import OperationsLedger
+from portfolio_telegram_bot.src.order_book_pricing import PRICING_POLICIES, OrderBookPricer
+from portfolio_telegram_bot.src.portfolio_valuation import PortfolioValuator
+from portfolio_telegram_bot.src.rate_limiter import RateLimiter, ThrottledServices
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Локальный справочник инструментов (общий для всех запусков скрипта)
+INSTRUMENT_CATALOG_PATH = "instruments_catalog.json"
 
-def quotation_to_decimal(quotation: Quotation) -> Decimal:
-    """Конвертация Quotation в Decimal для точных вычислений"""
-    return Decimal(str(quotation.units)) + Decimal(str(quotation.nano)) / Decimal(
-        "1000000000"
-    )
-
-
-def money_value_to_decimal(money: MoneyValue) -> Decimal:
-    """Конвертация MoneyValue в Decimal"""
-    return Decimal(str(money.units)) + Decimal(str(money.nano)) / Decimal("1000000000")
+# Локальный журнал операций (догружается инкрементально)
+OPERATIONS_LEDGER_PATH = "operations_ledger.sqlite3"
 
 
 def get_portfolio_data(
-    token: str, account_id: Optional[str] = None, debug: bool = False, include_operations: bool = True
+    token: str, account_id: Optional[str] = None, debug: bool = False, include_operations: bool = True,
+    catalog: Optional[InstrumentCatalog] = None, pricing_policy: str = "bid", order_book_depth: int = 20,
+    max_workers: int = 8
 ) -> Dict:
     """
     Получение данных портфеля с улучшенными расчетами
@@ -41,12 +48,20 @@ def get_portfolio_data(
         token: Токен доступа к API
         account_id: ID счета (если None, берется первый доступный)
         debug: Включить отладочную информацию
+        catalog: Справочник инструментов (если None, используется файловый по умолчанию)
+        pricing_policy: Метод оценки позиций: last, bid, mid или liquidation
+        order_book_depth: Глубина стакана для метода liquidation
+        max_workers: Максимум одновременных запросов стаканов
 
     Returns:
         Словарь с данными портфеля в формате JSON
     """
-
-    with Client(token) as client:
+    with Client(token) as raw_client:
+        # Все запросы идут через лимиты по сервисам API (и загрузка справочника тоже)
+        client = ThrottledServices(raw_client, RateLimiter())
+        own_catalog = catalog is None
+        if own_catalog:
+            catalog = InstrumentCatalog(lambda: nullcontext(client), INSTRUMENT_CATALOG_PATH)
         try:
             # Получение списка счетов
             accounts_response = client.users.get_accounts()
@@ -81,295 +96,101 @@ def get_portfolio_data(
                         f"Инструмент: {pos.instrument_type}, FIGI: {pos.figi}, Количество: {pos.quantity.units}"
                     )
 
-            # Получение курсов валют
-            currency_rates = {"RUB": Decimal("1")}
-            try:
-                # USD/RUB
-                usd_response = client.market_data.get_last_prices(figi=["BBG0013HGFT4"])
-                if usd_response.last_prices:
-                    currency_rates["USD"] = quotation_to_decimal(
-                        usd_response.last_prices[0].price
-                    )
-
-                # EUR/RUB
-                eur_response = client.market_data.get_last_prices(figi=["BBG0013HJJ31"])
-                if eur_response.last_prices:
-                    currency_rates["EUR"] = quotation_to_decimal(
-                        eur_response.last_prices[0].price
-                    )
+            # Общий расчет стоимости (тот же, что в боте): цены и курсы одним
+            # пакетным запросом, стаканы параллельно
+            pricer = OrderBookPricer(pricing_policy, depth=order_book_depth, max_workers=max_workers)
+            valuator = PortfolioValuator(lambda: nullcontext(client), catalog, pricer=pricer)
+            valuation = valuator.value(
+                {account_id: positions}, client,
+                account_names={account_id: selected_account.name},
+                stop_orders={account_id: valuator.get_stop_orders(account_id, client)},
+            )
+            portfolio_data = valuation.portfolio_data(account_id)
+            portfolio_data["debug_info"] = None
 
-                if debug:
-                    print(f"Курсы валют: {currency_rates}")
-            except RequestError as e:
-                logger.warning(f"Не удалось получить курсы валют: {e}")
-
-            # Получение информации об инструментах
-            instruments_info = {}
-            figis_for_prices = []
-
-            for position in positions:
-                figi = position.figi
-                instrument_type = position.instrument_type
-
-                # Обрабатываем все типы инструментов
-                if instrument_type in ["share", "bond", "etf"]:
-                    figis_for_prices.append(figi)
-
-                    try:
-                        if instrument_type == "share":
-                            instrument_response = client.instruments.share_by(
-                                id_type=1, id=figi
-                            )
-                        elif instrument_type == "bond":
-                            instrument_response = client.instruments.bond_by(
-                                id_type=1, id=figi
-                            )
-                        elif instrument_type == "etf":
-                            instrument_response = client.instruments.etf_by(
-                                id_type=1, id=figi
-                            )
-
-                        instruments_info[figi] = {
-                            "ticker": instrument_response.instrument.ticker,
-                            "name": instrument_response.instrument.name,
-                            "currency": instrument_response.instrument.currency,
-                            "type": instrument_type,
-                        }
-                    except RequestError as e:
-                        logger.warning(
-                            f"Не удалось получить информацию об инструменте {figi}: {e}"
-                        )
-                        instruments_info[figi] = {
-                            "ticker": f"UNKNOWN_{figi[:8]}",
-                            "name": "Unknown instrument",
-                            "currency": "RUB",
-                            "type": instrument_type,
-                        }
-
-            # Получение текущих цен с разными методами
-            current_prices = {}
-            orderbook_prices = {}
-
-            if figis_for_prices:
-                try:
-                    # Последние цены
-                    prices_response = client.market_data.get_last_prices(
-                        figi=figis_for_prices
-                    )
-                    for price in prices_response.last_prices:
-                        current_prices[price.figi] = quotation_to_decimal(price.price)
-
-                    # Стаканы (для более точных цен)
-                    for figi in figis_for_prices[
-                        :5
-                    ]:  # Ограничиваем количество запросов
-                        try:
-                            orderbook_response = client.market_data.get_order_book(
-                                figi=figi, depth=1
-                            )
-                            if orderbook_response.bids:
-                                bid_price = quotation_to_decimal(
-                                    orderbook_response.bids[0].price
-                                )
-                                orderbook_prices[figi] = bid_price
-                        except:
-                            pass
-
-                except RequestError as e:
-                    logger.warning(f"Не удалось получить текущие цены: {e}")
-
-            # Получение стоп-заявок
-            stop_orders = {}
-            try:
-                stop_orders_response = client.stop_orders.get_stop_orders(
-                    account_id=account_id
-                )
-                for order in stop_orders_response.stop_orders:
-                    if order.direction.name == "STOP_ORDER_DIRECTION_SELL":
-                        stop_orders[order.figi] = quotation_to_decimal(order.stop_price)
-            except RequestError as e:
-                logger.warning(f"Не удалось получить стоп-заявки: {e}")
-
-            # Формирование результата
-            portfolio_data = {
-                "date": datetime.now().isoformat(),
-                "account_id": account_id,
-                "account_name": selected_account.name,
-                "currency_rates": {k: float(v) for k, v in currency_rates.items()},
-                "positions": [],
-                "summary": {},
-                "debug_info": {} if debug else None,
-            }
-
-            total_value_rub = Decimal("0")
-            total_pnl_rub = Decimal("0")
-            cash_balances = {}
-
-            # Обработка всех позиций
-            for position in positions:
-                figi = position.figi
-                instrument_type = position.instrument_type
-                quantity = quotation_to_decimal(position.quantity)
-
-                if debug:
+            if debug:
+                print(f"Курсы валют: {portfolio_data['currency_rates']}")
+                for position in portfolio_data["positions"]:
                     print(
-                        f"\nОбработка позиции: {figi}, тип: {instrument_type}, количество: {quantity}"
-                    )
-
-                if instrument_type == "currency":
-                    # Валютные позиции
-                    if figi == "RUB000UTSTOM":
-                        cash_balances["RUB"] = quantity
-                    elif figi == "USD000UTSTOM":
-                        cash_balances["USD"] = quantity
-                    elif figi == "EUR000UTSTOM":
-                        cash_balances["EUR"] = quantity
-                    continue
-
-                if quantity <= 0:
-                    continue
-
-                if instrument_type in ["share", "bond", "etf"]:
-                    instrument_info = instruments_info.get(figi, {})
-                    ticker = instrument_info.get("ticker", "UNKNOWN")
-                    currency = instrument_info.get("currency", "RUB")
-
-                    # Средняя цена покупки
-                    avg_price = money_value_to_decimal(position.average_position_price)
-
-                    # Текущая цена (пробуем разные источники)
-                    current_price = orderbook_prices.get(figi) or current_prices.get(
-                        figi, Decimal("0")
-                    )
-
-                    # Конвертация в рубли
-                    rate = currency_rates.get(currency, Decimal("1"))
-                    avg_price_rub = avg_price * rate if currency != "RUB" else avg_price
-                    current_price_rub = (
-                        current_price * rate if currency != "RUB" else current_price
+                        f"  Тикер: {position['ticker']}, Цена: {position['current_price']} {position['currency']}, "
+                        f"P&L: {position['pnl']:.2f} RUB"
                     )
-
-                    total_position_value = current_price_rub * quantity
-                    position_pnl = total_position_value - (avg_price_rub * quantity)
-
-                    total_value_rub += total_position_value
-                    total_pnl_rub += position_pnl
-
-                    stop_loss = stop_orders.get(figi)
-
-                    position_data = {
-                        "ticker": ticker,
-                        "figi": figi,
-                        "instrument_type": instrument_type,
-                        "currency": currency,
-                        "shares": float(quantity),
-                        "cost_basis": float(avg_price),
-                        "cost_basis_rub": float(avg_price_rub),
-                        "stop_loss": float(stop_loss) if stop_loss else None,
-                        "current_price": float(current_price),
-                        "current_price_rub": float(current_price_rub),
-                        "total_value": float(total_position_value),
-                        "pnl": float(position_pnl)
-                    }
-
-                    if debug:
-                        print(
-                            f"  Тикер: {ticker}, Цена: {current_price} {currency}, P&L: {position_pnl:.2f} RUB"
-                        )
-
-                    portfolio_data["positions"].append(position_data)
-
-            # Подсчет общего баланса наличных в рублях
-            total_cash_rub = Decimal("0")
-            for curr, amount in cash_balances.items():
-                rate = currency_rates.get(curr, Decimal("1"))
-                total_cash_rub += amount * rate
-
-            total_equity = total_value_rub + total_cash_rub
-
-            # Итоговая информация
-            portfolio_data["summary"] = {
-                "total_positions_value": float(total_value_rub),
-                "total_pnl": float(total_pnl_rub),
-                "cash_balance_rub": float(total_cash_rub),
-                "cash_balances": {k: float(v) for k, v in cash_balances.items()},
-                "total_equity": float(total_equity),
-                "positions_count": len(portfolio_data["positions"]),
-            }
-
-            if debug:
                 portfolio_data["debug_info"] = {
                     "raw_positions_count": len(positions),
                     "processed_positions": len(portfolio_data["positions"]),
-                    "price_sources": {
-                        "last_prices": len(current_prices),
-                        "orderbook_prices": len(orderbook_prices),
-                    },
+                    "price_sources": {"pricing_policy": pricing_policy},
                 }
 
             return portfolio_data
         except:
             pass
+        finally:
+            if own_catalog:
+                catalog.close()
+
+def get_portfolio_operations(
+    client: Client, account_id: str, days_back: int = 365, catalog: Optional[InstrumentCatalog] = None,
+    ledger: Optional[OperationsLedger] = None
+) -> List[Dict]:
+    """Получение операций по портфелю за указанный период
+
+    Операции берутся из локального журнала, который догружает с сервера
+    только новые записи с момента прошлого запуска.
+    """
+    own_catalog, own_ledger = catalog is None, ledger is None
+    if own_catalog:
+        catalog = InstrumentCatalog(lambda: nullcontext(client), INSTRUMENT_CATALOG_PATH)
+    if own_ledger:
+        ledger = OperationsLedger(OPERATIONS_LEDGER_PATH)
 
-def get_portfolio_operations(client: Client, account_id: str, days_back: int = 365) -> List[Dict]:
-    """Получение операций по портфелю за указанный период"""
     try:
-        # Период для запроса операций
-        to_date = datetime.now(pytz.UTC)
-        from_date = to_date - timedelta(days=days_back)
-        
-        operations_response = client.operations.get_operations(
-            account_id=account_id,
-            from_=from_date,
-            to=to_date
+        ledger.sync(client, account_id)
+
+        # Период для выборки из журнала
+        from_date = datetime.now(pytz.UTC) - timedelta(days=days_back)
+        ledger_operations = ledger.get_operations(
+            account_id,
+            since=from_date,
+            operation_types=[OperationType.OPERATION_TYPE_BUY, OperationType.OPERATION_TYPE_SELL]
         )
-        
+
         operations = []
-        for op in operations_response.operations:
-            # Фильтруем только операции покупки/продажи
-            if op.operation_type.name in ['OPERATION_TYPE_BUY', 'OPERATION_TYPE_SELL']:
-                # Получаем информацию об инструменте
+        for op in ledger_operations:
+            # Получаем информацию об инструменте
+            instrument_name = "Unknown"
+            try:
+                if op["figi"]:
+                    instrument = catalog.lookup(op["figi"], op["instrument_type"], client)
+                    instrument_name = instrument["ticker"] if instrument else f"FIGI_{op['figi'][:8]}"
+            except Exception:
                 instrument_name = "Unknown"
-                try:
-                    if op.figi:
-                        # Пробуем получить информацию об инструменте
-                        try:
-                            instrument_response = client.instruments.share_by(id_type=1, id=op.figi)
-                            instrument_name = instrument_response.instrument.ticker
-                        except RequestError:
-                            try:
-                                instrument_response = client.instruments.bond_by(id_type=1, id=op.figi)
-                                instrument_name = instrument_response.instrument.ticker
-                            except RequestError:
-                                try:
-                                    instrument_response = client.instruments.etf_by(id_type=1, id=op.figi)
-                                    instrument_name = instrument_response.instrument.ticker
-                                except RequestError:
-                                    instrument_name = f"FIGI_{op.figi[:8]}"
-                except Exception:
-                    instrument_name = "Unknown"
-                
-                operation_data = {
-                    "date": op.date.strftime("%Y-%m-%d %H:%M:%S"),
-                    "type": "Покупка" if op.operation_type.name == 'OPERATION_TYPE_BUY' else "Продажа",
-                    "instrument": instrument_name,
-                    "figi": op.figi,
-                    "quantity": int(op.quantity),
-                    "price": float(money_value_to_decimal(op.price)) if op.price else 0,
-                    "payment": float(money_value_to_decimal(op.payment)) if op.payment else 0,
-                    "currency": op.currency,
-                    "commission": float(money_value_to_decimal(op.commission)) if op.commission else 0
-                }
-                operations.append(operation_data)
-        
-        # Сортируем по дате (новые сначала)
-        operations.sort(key=lambda x: x["date"], reverse=True)
+
+            operation_data = {
+                "date": op["date"].strftime("%Y-%m-%d %H:%M:%S"),
+                "type": "Покупка" if op["operation_type"] == OperationType.OPERATION_TYPE_BUY else "Продажа",
+                "instrument": instrument_name,
+                "figi": op["figi"],
+                "quantity": int(op["quantity"]),
+                "price": float(op["price"]),
+                "payment": float(op["payment"]),
+                "currency": op["currency"],
+                "commission": float(op["commission"])
+            }
+            operations.append(operation_data)
+
+        # Журнал отдает операции по дате (новые сначала)
         return operations
-        
+
     except Exception as e:
         logger.error(f"Ошибка получения операций: {e}")
         return []
 
+    finally:
+        if own_catalog:
+            catalog.close()
+        if own_ledger:
+            ledger.close()
+
 
 def calculate_total_portfolio_profit(portfolio_data: Dict, operations: List[Dict]) -> Dict:
     """Расчет общей прибыли портфеля на основе операций"""
@@ -672,10 +493,18 @@ def main():
     # Выбор формата отчета
     save_json = input("Сохранить также JSON файл для отладки? (y/n): ").strip().lower() == "y"
 
+    # Метод оценки позиций
+    pricing_policy = input(f"Метод оценки позиций ({'/'.join(PRICING_POLICIES)}) [bid]: ").strip().lower() or "bid"
+    if pricing_policy not in PRICING_POLICIES:
+        print(f"Неизвестный метод оценки: {pricing_policy}")
+        return
+
     try:
         # Получение данных портфеля
         print("Получение данных портфеля...")
-        portfolio_data = get_portfolio_data(token, debug=debug_mode, include_operations=include_operations)
+        portfolio_data = get_portfolio_data(
+            token, debug=debug_mode, include_operations=include_operations, pricing_policy=pricing_policy
+        )
 
         # Сохранение текстового отчета
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
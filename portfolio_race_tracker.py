@@ -8,8 +8,9 @@ import json
 import logging
 import csv
 import os
+import sys
+from contextlib import nullcontext
 from datetime import datetime, date
-from decimal import Decimal
 from typing import Dict, List, Optional
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
@@ -17,147 +18,67 @@ from matplotlib.ticker import FuncFormatter
 import seaborn as sns
 
 from tinkoff.invest import Client, RequestError
-from tinkoff.invest.schemas import MoneyValue, Quotation
+
+# Общий код бота (portfolio_telegram_bot) — рядом со скриптом, при запуске из любого каталога
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from portfolio_telegram_bot.src.instrument_catalog import InstrumentCatalog
+from portfolio_telegram_bot.src.portfolio_valuation import PortfolioValuator
+from portfolio_telegram_bot.src.price_table import PriceFetchPlanner, PriceTable
+from portfolio_telegram_bot.src.rate_limiter import RateLimiter, ThrottledServices
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Локальный справочник инструментов (общий для всех запусков скрипта)
+INSTRUMENT_CATALOG_PATH = "instruments_catalog.json"
+
 # Настройка графиков
 plt.style.use('seaborn-v0_8')
 sns.set_palette("husl")
 
 
-def quotation_to_decimal(quotation: Quotation) -> Decimal:
-    """Конвертация Quotation в Decimal для точных вычислений"""
-    return Decimal(str(quotation.units)) + Decimal(str(quotation.nano)) / Decimal("1000000000")
-
-
-def money_value_to_decimal(money: MoneyValue) -> Decimal:
-    """Конвертация MoneyValue в Decimal"""
-    return Decimal(str(money.units)) + Decimal(str(money.nano)) / Decimal("1000000000")
-
-
-def get_moex_index_price(client: Client) -> float:
+def get_moex_index_price(client: Client, price_table: Optional[PriceTable] = None) -> float:
     """Получение текущего значения индекса MOEX"""
     try:
-        # FIGI для индекса MOEX
-        moex_figi = "BBG004730ZJ9"
-        response = client.market_data.get_last_prices(figi=[moex_figi])
+        if price_table is None:
+            price_table = PriceFetchPlanner().add_benchmark().fetch(client)
         
-        if response.last_prices:
-            return float(quotation_to_decimal(response.last_prices[0].price))
-        else:
+        moex_price = price_table.moex_index()
+        if moex_price is None:
             logger.warning("Не удалось получить цену индекса MOEX")
-            return None
+        return moex_price
     except RequestError as e:
         logger.error(f"Ошибка получения индекса MOEX: {e}")
         return None
 
 
-def get_portfolio_value(client: Client, account_id: str) -> Dict:
-    """Получение общей стоимости портфеля"""
+def get_portfolio_value(client: Client, account_id: str, catalog: Optional[InstrumentCatalog] = None,
+                        price_table: Optional[PriceTable] = None, positions: Optional[List] = None) -> Dict:
+    """Получение общей стоимости портфеля
+
+    Если переданы позиции и общая таблица цен (все счета + валюты),
+    дополнительных запросов цен не выполняется.
+    """
+    own_catalog = catalog is None
+    if own_catalog:
+        catalog = InstrumentCatalog(lambda: nullcontext(client), INSTRUMENT_CATALOG_PATH)
+
     try:
-        portfolio_response = client.operations.get_portfolio(account_id=account_id)
-        positions = portfolio_response.positions
-        
-        # Получение курсов валют
-        currency_rates = {"RUB": Decimal("1")}
-        try:
-            usd_response = client.market_data.get_last_prices(figi=["BBG0013HGFT4"])
-            if usd_response.last_prices:
-                currency_rates["USD"] = quotation_to_decimal(usd_response.last_prices[0].price)
-            
-            eur_response = client.market_data.get_last_prices(figi=["BBG0013HJJ31"])
-            if eur_response.last_prices:
-                currency_rates["EUR"] = quotation_to_decimal(eur_response.last_prices[0].price)
-        except RequestError:
-            pass
-        
-        # Получение цен для всех инструментов
-        figis_for_prices = []
-        instruments_info = {}
-        
-        for position in positions:
-            if position.instrument_type in ["share", "bond", "etf"]:
-                figi = position.figi
-                figis_for_prices.append(figi)
-                
-                try:
-                    if position.instrument_type == "share":
-                        instrument_response = client.instruments.share_by(id_type=1, id=figi)
-                    elif position.instrument_type == "bond":
-                        instrument_response = client.instruments.bond_by(id_type=1, id=figi)
-                    elif position.instrument_type == "etf":
-                        instrument_response = client.instruments.etf_by(id_type=1, id=figi)
-                    
-                    instruments_info[figi] = {
-                        'currency': instrument_response.instrument.currency
-                    }
-                except RequestError:
-                    instruments_info[figi] = {'currency': 'RUB'}
-        
-        # Получение текущих цен
-        current_prices = {}
-        if figis_for_prices:
-            try:
-                prices_response = client.market_data.get_last_prices(figi=figis_for_prices)
-                for price in prices_response.last_prices:
-                    current_prices[price.figi] = quotation_to_decimal(price.price)
-            except RequestError:
-                pass
+        if positions is None:
+            positions = client.operations.get_portfolio(account_id=account_id).positions
         
-        # Расчет общей стоимости
-        total_value_rub = Decimal("0")
-        cash_balances = {}
-        positions_count = 0
-        
-        for position in positions:
-            figi = position.figi
-            instrument_type = position.instrument_type
-            quantity = quotation_to_decimal(position.quantity)
-            
-            if instrument_type == "currency":
-                if figi == "RUB000UTSTOM":
-                    cash_balances["RUB"] = quantity
-                elif figi == "USD000UTSTOM":
-                    cash_balances["USD"] = quantity
-                elif figi == "EUR000UTSTOM":
-                    cash_balances["EUR"] = quantity
-                continue
-            
-            if quantity <= 0:
-                continue
-                
-            if instrument_type in ["share", "bond", "etf"]:
-                positions_count += 1
-                current_price = current_prices.get(figi, Decimal("0"))
-                currency = instruments_info.get(figi, {}).get('currency', 'RUB')
-                
-                # Конвертация в рубли
-                rate = currency_rates.get(currency, Decimal("1"))
-                current_price_rub = current_price * rate if currency != "RUB" else current_price
-                
-                total_value_rub += current_price_rub * quantity
-        
-        # Добавляем наличные в рублях
-        total_cash_rub = Decimal("0")
-        for curr, amount in cash_balances.items():
-            rate = currency_rates.get(curr, Decimal("1"))
-            total_cash_rub += amount * rate
-        
-        total_equity = total_value_rub + total_cash_rub
-        
-        return {
-            "total_equity": float(total_equity),
-            "positions_value": float(total_value_rub),
-            "cash_balance": float(total_cash_rub),
-            "positions_count": positions_count
-        }
+        valuator = PortfolioValuator(lambda: nullcontext(client), catalog)
+        return valuator.portfolio_values({account_id: positions}, price_table)[account_id]
         
     except Exception as e:
         logger.error(f"Ошибка получения портфеля {account_id}: {e}")
         return None
+    
+    finally:
+        if own_catalog:
+            catalog.close()
 
 
 def load_historical_data(filename: str = "portfolio_race_history.csv") -> List[Dict]:
@@ -400,8 +321,11 @@ def main():
         print("❌ Ошибка: токен не может быть пустым")
         return
     
+    catalog = None
     try:
-        with Client(token) as client:
+        with Client(token) as raw_client:
+            # Все запросы идут через лимиты по сервисам API
+            client = ThrottledServices(raw_client, RateLimiter())
             # Получение списка счетов
             print("🔍 Получение списка портфелей...")
             accounts_response = client.users.get_accounts()
@@ -445,10 +369,31 @@ def main():
             today = date.today().strftime('%Y-%m-%d')
             daily_data = {"date": today}
             
-            # Данные по портфелям
+            # Позиции всех портфелей, затем цены всех счетов, валют и MOEX одним запросом
+            catalog = InstrumentCatalog(lambda: nullcontext(client), INSTRUMENT_CATALOG_PATH)
+            planner = PriceFetchPlanner().add_currencies().add_benchmark()
+            account_positions = []
             for i, account in enumerate(selected_accounts):
                 print(f"  Загрузка {portfolio_names[i]}...")
-                portfolio_data = get_portfolio_value(client, account.id)
+                positions = client.operations.get_portfolio(account_id=account.id).positions
+                planner.add(position.figi for position in positions if position.instrument_type in ["share", "bond", "etf"])
+                account_positions.append(positions)
+            
+            print("  Загрузка цен...")
+            price_table = planner.fetch(client)
+            
+            # Оценка всех портфелей за один проход (общий расчет с ботом)
+            valuator = PortfolioValuator(lambda: nullcontext(client), catalog)
+            try:
+                portfolio_values = valuator.portfolio_values(
+                    {account.id: account_positions[i] for i, account in enumerate(selected_accounts)}, price_table
+                )
+            except Exception as e:
+                logger.error(f"Ошибка оценки портфелей: {e}")
+                portfolio_values = {}
+            
+            for i, account in enumerate(selected_accounts):
+                portfolio_data = portfolio_values.get(account.id)
                 
                 if portfolio_data:
                     daily_data[f'portfolio_{i+1}_value'] = portfolio_data['total_equity']
@@ -458,8 +403,7 @@ def main():
                     return
             
             # Данные по MOEX
-            print("  Загрузка индекса MOEX...")
-            moex_price = get_moex_index_price(client)
+            moex_price = get_moex_index_price(client, price_table)
             if moex_price:
                 daily_data['moex_index'] = moex_price
             
@@ -499,6 +443,10 @@ def main():
         print(f"❌ Ошибка: {e}")
         import traceback
         traceback.print_exc()
+    
+    finally:
+        if catalog is not None:
+            catalog.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Микробенчмарк расчета стоимости портфеля
+
+Сравнивается прежний цикл оценки позиций (конвертация Quotation через
+строки в Decimal, курс через Decimal(str(float)) на каждую позицию) и
+текущий TinkoffClient._build_portfolio_data (ValuationEngine). Итоги
+обоих расчетов сверяются.
+
+Пример:
+    python benchmarks/money_benchmark.py --positions 300 --repeat 20
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from decimal import Decimal
+from types import SimpleNamespace
+from typing import Dict, List
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.money import Money
+from src.tinkoff_client import TinkoffClient
+
+CURRENCIES = ("RUB", "RUB", "RUB", "USD", "EUR")
+
+
+def _quotation(value: str) -> SimpleNamespace:
+    money = Money.from_number(value)
+    return SimpleNamespace(units=money.units, nano=money.fraction)
+
+
+def _generate(count: int, seed: int):
+    """Синтетические позиции, справочник и цены"""
+    rng = random.Random(seed)
+    positions, instruments_info, quotations = [], {}, {}
+    for i in range(count):
+        figi = f"FIGI{i:08d}"
+        price = f"{rng.uniform(1, 5000):.4f}"
+        positions.append(SimpleNamespace(
+            figi=figi,
+            instrument_type=rng.choice(("share", "bond", "etf")),
+            quantity=_quotation(str(rng.randint(1, 10000))),
+            average_position_price=_quotation(f"{float(price) * rng.uniform(0.7, 1.3):.4f}"),
+        ))
+        instruments_info[figi] = {"ticker": f"T{i}", "name": f"Instrument {i}", "currency": rng.choice(CURRENCIES)}
+        quotations[figi] = _quotation(price)
+    for figi, amount in (("RUB000UTSTOM", "150000.55"), ("USD000UTSTOM", "1200.10")):
+        positions.append(SimpleNamespace(figi=figi, instrument_type="currency", quantity=_quotation(amount),
+                                         average_position_price=_quotation("0")))
+    return positions, instruments_info, quotations
+
+
+def _to_decimal(quotation) -> Decimal:
+    """Прежняя конвертация Quotation в Decimal"""
+    return Decimal(str(quotation.units)) + Decimal(str(quotation.nano)) / Decimal("1000000000")
+
+
+def _decimal_valuation(positions: List, instruments_info: Dict, current_prices: Dict,
+                       currency_rates: Dict[str, float]) -> Dict:
+    """Прежний цикл оценки на Decimal (для сравнения)"""
+    portfolio_positions = []
+    total_value_rub = Decimal("0")
+    total_pnl_rub = Decimal("0")
+    cash_balances = {}
+
+    for position in positions:
+        figi = position.figi
+        quantity = _to_decimal(position.quantity)
+        if position.instrument_type == "currency":
+            cash_balances[figi[:3]] = quantity
+            continue
+
+        instrument_info = instruments_info.get(figi, {})
+        currency = instrument_info.get('currency', 'RUB')
+        avg_price = _to_decimal(position.average_position_price)
+        current_price = current_prices.get(figi, Decimal("0"))
+
+        rate = Decimal(str(currency_rates.get(currency, 1.0)))
+        avg_price_rub = avg_price * rate if currency != "RUB" else avg_price
+        current_price_rub = current_price * rate if currency != "RUB" else current_price
+
+        total_position_value = current_price_rub * quantity
+        position_pnl = total_position_value - (avg_price_rub * quantity)
+        total_value_rub += total_position_value
+        total_pnl_rub += position_pnl
+
+        portfolio_positions.append({
+            "ticker": instrument_info.get('ticker'),
+            "shares": float(quantity),
+            "cost_basis": float(avg_price),
+            "cost_basis_rub": float(avg_price_rub),
+            "current_price": float(current_price),
+            "current_price_rub": float(current_price_rub),
+            "total_value": float(total_position_value),
+            "pnl": float(position_pnl),
+            "pnl_percent": float((position_pnl / (avg_price_rub * quantity)) * 100) if avg_price_rub * quantity > 0 else 0
+        })
+
+    total_cash_rub = Decimal("0")
+    for curr, amount in cash_balances.items():
+        total_cash_rub += amount * Decimal(str(currency_rates.get(curr, 1.0)))
+
+    return {
+        "positions": portfolio_positions,
+        "summary": {
+            "total_positions_value": float(total_value_rub),
+            "total_pnl": float(total_pnl_rub),
+            "total_equity": float(total_value_rub + total_cash_rub),
+        }
+    }
+
+
+def _measure(func, repeat: int) -> List[float]:
+    timings = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start_time)
+    return timings
+
+
+def main():
+    """Основная функция"""
+    parser = argparse.ArgumentParser(description="Микробенчмарк цикла оценки портфеля")
+    parser.add_argument("--positions", type=int, default=300, help="число позиций")
+    parser.add_argument("--repeat", type=int, default=20, help="число повторов")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    positions, instruments_info, quotations = _generate(args.positions, args.seed)
+    currency_rates = {"RUB": 1.0, "USD": 92.3456, "EUR": 100.1234}
+    decimal_prices = {figi: _to_decimal(quotation) for figi, quotation in quotations.items()}
+    money_prices = {figi: Money.from_quotation(quotation) for figi, quotation in quotations.items()}
+
+    def run_decimal():
+        return _decimal_valuation(positions, instruments_info, decimal_prices, currency_rates)
+
+    def run_current():
+        return TinkoffClient._build_portfolio_data(
+            "bench", "bench", positions, instruments_info, money_prices, {}, currency_rates
+        )
+
+    # Сверка итогов
+    decimal_summary, current_summary = run_decimal()["summary"], run_current()["summary"]
+    for key in ("total_positions_value", "total_pnl", "total_equity"):
+        if abs(decimal_summary[key] - current_summary[key]) > 0.01:
+            print(f"⚠️ Расхождение {key}: {decimal_summary[key]} != {current_summary[key]}")
+
+    results = {"Decimal": _measure(run_decimal, args.repeat), "Текущий": _measure(run_current, args.repeat)}
+
+    print(f"Позиций: {args.positions}, повторов: {args.repeat}")
+    for name, timings in results.items():
+        print(f"{name:8} медиана {statistics.median(timings) * 1000:8.3f} мс  "
+              f"мин {min(timings) * 1000:8.3f} мс")
+    speedup = statistics.median(results["Decimal"]) / statistics.median(results["Текущий"])
+    print(f"Ускорение: {speedup:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
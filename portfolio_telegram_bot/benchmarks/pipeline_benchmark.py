@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк ежедневных отчетов и команд бота на локальных заменах API
+
+Каждый сценарий выполняется в отдельном процессе на синтетической
+фикстуре (FakeInvestApi) и с записывающей заменой Telegram. Замеряются
+время, число запросов к API, объем отправленного в Telegram и пиковый RSS.
+Перед каждым повтором кэш ответов команд сбрасывается (холодные замеры);
+с --warm-cache повторы после первого берут ответы из кэша.
+
+Пример:
+    python benchmarks/pipeline_benchmark.py --positions 300 --operations 20000 --history-days 365
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import src.scheduler as scheduler_module
+from src.config import Config
+from src.fake_invest_api import generate_fixture, save_fixture
+from src.scheduler import Scheduler
+from src.telegram_bot import TelegramBot
+
+logger = logging.getLogger(__name__)
+
+# Сценарии: ежедневный прогон и команды бота
+SCENARIOS = {
+    "daily_reports": lambda scheduler, message: scheduler.run_daily_reports(),
+    "/portfolio": lambda scheduler, message: scheduler.command_handler._cmd_portfolio(message),
+    "/race": lambda scheduler, message: scheduler.command_handler._cmd_race(message),
+    "/chart": lambda scheduler, message: scheduler.command_handler._cmd_chart(message),
+    "/pnl": lambda scheduler, message: scheduler.command_handler._cmd_pnl(message),
+    "/report": lambda scheduler, message: scheduler.command_handler._cmd_full_report(message),
+}
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+class RecordingTelegramBot(TelegramBot):
+    """Замена Telegram: запросы не отправляются, а учитываются"""
+
+    def __init__(self, token: str, chat_id: int, **kwargs):
+        super().__init__(token, chat_id, **kwargs)
+        self.requests = []
+
+    def _call(self, method: str, data: dict = None, files: dict = None) -> Optional[Dict]:
+        size = len(json.dumps(data or {}, ensure_ascii=False).encode('utf-8'))
+        for file in (files or {}).values():
+            size += os.fstat(file.fileno()).st_size
+        self.requests.append({"method": method, "bytes": size})
+        result = {"message_id": len(self.requests)}
+        if method == "sendPhoto" and files:
+            result["photo"] = [{"file_id": f"recorded-{len(self.requests)}"}]
+        return {"ok": True, "result": result}
+
+    def get_updates(self, offset: int = 0, timeout: int = 30) -> dict:
+        return {'ok': True, 'result': []}
+
+    def stats(self) -> Dict:
+        return {
+            "telegram_requests": len(self.requests),
+            "telegram_bytes": sum(request["bytes"] for request in self.requests),
+        }
+
+    def reset(self) -> None:
+        self.requests = []
+
+
+def _seed_race_history(scheduler: Scheduler, accounts: Dict[str, str], days: int) -> None:
+    """Синтетическая история гонки до вчерашнего дня"""
+    start = date.today() - timedelta(days=days)
+    for day in range(days):
+        row = {"date": (start + timedelta(days=day)).strftime('%Y-%m-%d')}
+        for i, _ in enumerate(accounts, 1):
+            row[f'portfolio_{i}_value'] = 1_000_000 * (1 + 0.0005 * i * day)
+            row[f'portfolio_{i}_positions'] = 20
+        row['moex_index'] = 3000 + day
+        row['portfolio_names'] = '|'.join(accounts)
+        scheduler.race_tracker._save_daily_data(row)
+
+
+def _build_environment(work_dir: str, params: Dict) -> Scheduler:
+    """Фикстура, настройки и планировщик с заменой Telegram"""
+    fixture = generate_fixture(params["accounts"], params["positions"], params["operations"], params["seed"])
+    fixture_path = os.path.join(work_dir, "fixture.json")
+    save_fixture(fixture, fixture_path)
+
+    accounts = {account["name"]: account["id"] for account in fixture["accounts"]}
+    settings = {
+        "tinkoff_token": "fake",
+        "telegram_token": "fake",
+        "chat_id": 1,
+        "portfolio_accounts": accounts,
+        "bot_trader_account_id": fixture["accounts"][0]["id"],
+        "data_directory": os.path.join(work_dir, "data"),
+        "logs_directory": os.path.join(work_dir, "logs"),
+        "fake_api_fixture": fixture_path,
+        "fake_api_latency": params["latency"],
+        "use_async_client": params["async_client"],
+    }
+    settings_path = os.path.join(work_dir, "settings.json")
+    with open(settings_path, 'w', encoding='utf-8') as f:
+        json.dump(settings, f, ensure_ascii=False)
+
+    # Планировщик создает записывающую замену вместо TelegramBot
+    scheduler_module.TelegramBot = RecordingTelegramBot
+
+    scheduler = Scheduler(Config(settings_path))
+    _seed_race_history(scheduler, accounts, params["history_days"])
+    return scheduler
+
+
+def _run_scenario(name: str, params: Dict, results: multiprocessing.Queue) -> None:
+    """Выполнение сценария в отдельном процессе"""
+    logging.basicConfig(level=logging.WARNING)
+    try:
+        results.put(_measure_scenario(name, params))
+    except Exception as e:
+        results.put({"scenario": name, "error": repr(e)})
+
+
+def _measure_scenario(name: str, params: Dict) -> Dict:
+    """Замеры сценария: повторы на одном окружении"""
+    with tempfile.TemporaryDirectory() as work_dir:
+        scheduler = _build_environment(work_dir, params)
+        telegram = scheduler.telegram_bot
+        message = {"chat": {"id": 1}, "text": name}
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        runs = []
+        for _ in range(params["repeat"]):
+            if not params["warm_cache"]:
+                scheduler.command_handler.responses.invalidate()
+            scheduler.fake_api.reset_stats()
+            telegram.reset()
+            start_time = time.perf_counter()
+            SCENARIOS[name](scheduler, message)
+            elapsed = time.perf_counter() - start_time
+            api_stats = scheduler.fake_api.stats()
+            runs.append({
+                "wall_time": elapsed,
+                "api_calls": api_stats["total_calls"],
+                "api_calls_by_method": api_stats["calls"],
+                **telegram.stats(),
+            })
+
+        scheduler.race_tracker.close()
+        scheduler.tinkoff_client.close()
+        scheduler.operations_ledger.close()
+
+        return {
+            "scenario": name,
+            "wall_time_first": runs[0]["wall_time"],
+            "wall_time_median": statistics.median(run["wall_time"] for run in runs),
+            "wall_time_min": min(run["wall_time"] for run in runs),
+            "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "setup_rss_kb": rss_before,
+            "runs": runs,
+        }
+
+
+def run_benchmarks(params: Dict, scenarios: List[str]) -> Dict:
+    """Запуск сценариев, каждый в своем процессе"""
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for name in scenarios:
+        queue = context.Queue()
+        process = context.Process(target=_run_scenario, args=(name, params, queue))
+        process.start()
+        result = queue.get()
+        process.join()
+        results.append(result)
+        if "error" in result:
+            print(f"{name:15} ошибка: {result['error']}")
+            continue
+        print(f"{name:15} {result['wall_time_median'] * 1000:9.1f} мс  "
+              f"API: {result['runs'][0]['api_calls']:4}  "
+              f"Telegram: {result['runs'][0]['telegram_bytes']:8} байт  "
+              f"RSS: {result['peak_rss_kb'] / 1024:.1f} МБ")
+
+    return {
+        "date": datetime.now().isoformat(),
+        "params": params,
+        "python": sys.version.split()[0],
+        "results": results,
+    }
+
+
+def main():
+    """Основная функция"""
+    parser = argparse.ArgumentParser(description="Бенчмарк отчетов бота на локальных заменах API")
+    parser.add_argument("--accounts", type=int, default=4, help="число счетов в гонке")
+    parser.add_argument("--positions", type=int, default=20, help="позиций на счет")
+    parser.add_argument("--operations", type=int, default=1000, help="операций на счет")
+    parser.add_argument("--history-days", type=int, default=90, help="длина истории гонки, дней")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа API, сек")
+    parser.add_argument("--async-client", action="store_true", help="асинхронный клиент API")
+    parser.add_argument("--repeat", type=int, default=3, help="повторов каждого сценария")
+    parser.add_argument("--warm-cache", action="store_true", help="не сбрасывать кэш ответов между повторами")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS), help="только выбранные сценарии")
+    parser.add_argument("--label", default="", help="метка прогона (например, версия)")
+    parser.add_argument("-o", "--output", help="файл результатов JSON")
+    args = parser.parse_args()
+
+    params = {
+        "accounts": args.accounts,
+        "positions": args.positions,
+        "operations": args.operations,
+        "history_days": args.history_days,
+        "latency": args.latency,
+        "async_client": args.async_client,
+        "repeat": args.repeat,
+        "warm_cache": args.warm_cache,
+        "seed": args.seed,
+    }
+
+    report = run_benchmarks(params, args.scenario or list(SCENARIOS))
+    report["label"] = args.label
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        suffix = f"_{args.label}" if args.label else ""
+        output = os.path.join(RESULTS_DIR, f"pipeline_{datetime.now().strftime('%Y%m%d_%H%M%S')}{suffix}.json")
+
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n📊 Результаты сохранены: {output}")
+
+
+if __name__ == "__main__":
+    main()
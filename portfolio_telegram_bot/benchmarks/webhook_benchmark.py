@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк приема команд через webhook
+
+Локальная замена Telegram отправляет обновления /help на WebhookServer
+из нескольких потоков. Обновления проходят тот же путь, что и в боте
+(CommandHandler._process_update и пул команд), ответы записываются
+вместо отправки. Замеряются задержка подтверждения (POST → 200),
+задержка до обработки обновления и пропускная способность до отправки
+всех ответов.
+
+Пример:
+    python benchmarks/webhook_benchmark.py --updates 2000 --concurrency 8
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import requests
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.command_handler import CommandHandler
+from src.config import Config
+from src.telegram_bot import TelegramBot
+from src.webhook_server import SECRET_HEADER, WebhookServer
+
+SECRET = "benchmark-secret"
+CHAT_ID = 1
+
+
+class RecordingTelegramBot(TelegramBot):
+    """Замена Telegram: ответы не отправляются, а учитываются"""
+
+    def __init__(self):
+        super().__init__("benchmark", CHAT_ID)
+        self.replies = 0
+        self.all_replied = threading.Event()
+        self.expected = 0
+        self._lock = threading.Lock()
+
+    def _call(self, method: str, data: dict = None, files: dict = None) -> Optional[Dict]:
+        with self._lock:
+            self.replies += 1
+            if self.replies >= self.expected:
+                self.all_replied.set()
+        return {"ok": True, "result": {}}
+
+
+def _percentiles(values: List[float]) -> Dict[str, float]:
+    values = sorted(values)
+    return {
+        "p50_ms": round(values[len(values) // 2] * 1000, 3),
+        "p95_ms": round(values[int(len(values) * 0.95)] * 1000, 3),
+        "max_ms": round(values[-1] * 1000, 3),
+        "avg_ms": round(statistics.mean(values) * 1000, 3),
+    }
+
+
+def run_benchmark(updates: int, concurrency: int, workers: int) -> Dict:
+    with tempfile.TemporaryDirectory() as work_dir:
+        config = Config(os.path.join(work_dir, "missing.json"))
+    config.CHAT_ID = CHAT_ID
+    config.COMMAND_WORKERS = workers
+    config.COMMAND_QUEUE_SIZE = updates
+
+    bot = RecordingTelegramBot()
+    bot.expected = updates
+    handler = CommandHandler(config, bot, None, None, None)
+    bot.replies = 0  # без setMyCommands при создании обработчика
+
+    # Время получения обновления обработчиком по update_id
+    posted, dispatched = {}, {}
+    process_update = handler._process_update
+
+    def timed_process_update(update: dict) -> None:
+        dispatched[update['update_id']] = time.perf_counter()
+        process_update(update)
+
+    server = WebhookServer(timed_process_update, host="127.0.0.1", port=0, secret_token=SECRET)
+    server.start()
+    handler.pool.start()
+
+    local = threading.local()
+
+    def post(update_id: int) -> float:
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        update = {"update_id": update_id, "message": {"chat": {"id": CHAT_ID}, "from": {"id": 1}, "text": "/help"}}
+        posted[update_id] = time.perf_counter()
+        response = session.post(server.address, json=update, headers={SECRET_HEADER: SECRET}, timeout=10)
+        response.raise_for_status()
+        return time.perf_counter() - posted[update_id]
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        ack_latencies = list(executor.map(post, range(1, updates + 1)))
+    completed = bot.all_replied.wait(timeout=60)
+    elapsed = time.perf_counter() - start_time
+
+    handler.pool.stop()
+    server.stop()
+
+    dispatch_latencies = [dispatched[update_id] - posted[update_id] for update_id in dispatched]
+    return {
+        "updates": updates,
+        "concurrency": concurrency,
+        "workers": workers,
+        "completed": completed,
+        "replies": bot.replies,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_per_s": round(updates / elapsed, 1),
+        "ack_latency": _percentiles(ack_latencies),
+        "dispatch_latency": _percentiles(dispatch_latencies),
+        "command_pool": handler.pool.stats()["commands"].get("/help", {}),
+    }
+
+
+def main():
+    """Основная функция"""
+    parser = argparse.ArgumentParser(description="Бенчмарк приема команд через webhook")
+    parser.add_argument("--updates", type=int, default=1000, help="число обновлений")
+    parser.add_argument("--concurrency", type=int, default=4, help="параллельных отправителей")
+    parser.add_argument("--workers", type=int, default=4, help="обработчиков пула команд")
+    parser.add_argument("-o", "--output", help="файл результатов JSON")
+    args = parser.parse_args()
+
+    result = run_benchmark(args.updates, args.concurrency, args.workers)
+    print(f"Обновлений: {result['updates']}, отправителей: {result['concurrency']}, "
+          f"обработано: {result['replies']}{'' if result['completed'] else ' (не все)'}")
+    print(f"Пропускная способность: {result['throughput_per_s']} обновлений/сек")
+    for name in ("ack_latency", "dispatch_latency"):
+        stats = result[name]
+        print(f"{name:17} p50 {stats['p50_ms']:7.3f} мс  p95 {stats['p95_ms']:7.3f} мс  max {stats['max_ms']:7.3f} мс")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"\n📊 Результаты сохранены: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+"""Асинхронная работа с API Тинькофф"""
+import asyncio
+import logging
+import threading
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import Callable, Dict, List, Optional
+import grpc
+from tinkoff.invest import AsyncClient, Client, RequestError
+from .channel_manager import RECONNECT_STATUS_CODES, ChannelManager
+from .metrics import REGISTRY, span
+from .portfolio_valuation import instrument_info
+from .price_table import PriceFetchPlanner, PriceTable
+from .tinkoff_client import TinkoffClient
+from .valuation_engine import VALUED_TYPES
+
+logger = logging.getLogger(__name__)
+
+# Максимум одновременных запросов к каждому сервису API
+SERVICE_CONCURRENCY = {
+    "users": 2,
+    "operations": 4,
+    "instruments": 8,
+    "market_data": 4,
+    "stop_orders": 2,
+}
+
+# Сколько синхронный фасад ждет результата корутины, секунды
+SYNC_CALL_TIMEOUT = 120
+
+
+class AsyncTinkoffClient:
+    """Асинхронный аналог TinkoffClient на AsyncClient.
+
+    Независимые запросы (портфель, стоп-заявки, счета, курсы, цены и
+    промахи справочника) выполняются одновременно через asyncio.gather,
+    а общие семафоры ограничивают параллелизм по каждому сервису.
+    """
+
+    def __init__(self, token: str, base_client: TinkoffClient, client_factory: Callable = AsyncClient):
+        self.token = token
+        self.base = base_client  # расчеты и справочник инструментов
+        self.client_factory = client_factory
+        self.semaphores = {service: asyncio.Semaphore(limit) for service, limit in SERVICE_CONCURRENCY.items()}
+        self._client = None
+        self._services = None
+        self._open_lock = asyncio.Lock()
+
+    async def _get_services(self):
+        """Ленивое открытие долгоживущего асинхронного канала"""
+        async with self._open_lock:
+            if self._services is None:
+                self._client = self.client_factory(self.token, options=ChannelManager.KEEPALIVE_OPTIONS)
+                self._services = await self._client.__aenter__()
+                logger.info("Открыт асинхронный gRPC-канал к Tinkoff API")
+            return self._services
+
+    async def _invalidate(self, services, error: Exception) -> None:
+        """Закрытие сломанного канала (как ChannelManager); новый откроется при следующем запросе"""
+        async with self._open_lock:
+            if services is not self._services:
+                return
+            logger.warning(f"Ошибка транспорта gRPC, асинхронный канал будет переоткрыт: {error}")
+            client, self._client, self._services = self._client, None, None
+            try:
+                await client.__aexit__(None, None, None)
+            except Exception as e:
+                logger.warning(f"Ошибка закрытия асинхронного gRPC-канала: {e}")
+
+    async def _call(self, service: str, method: str, **kwargs):
+        """Вызов метода API под семафором сервиса с учетом лимитов запросов"""
+        services = await self._get_services()
+        limiter = self.base.rate_limiter
+        bucket = limiter.bucket(service)
+
+        attempt = 0
+        while True:
+            if bucket is not None:
+                delay = bucket.reserve()
+                if delay > 0:
+                    bucket.enter_queue()
+                    try:
+                        await asyncio.sleep(delay)
+                    finally:
+                        bucket.leave_queue()
+                REGISTRY.observe("tinkoff_queue_wait_seconds", delay, service=service)
+
+            try:
+                async with self.semaphores[service]:
+                    with span("tinkoff_rpc", service=service, method=method):
+                        return await getattr(getattr(services, service), method)(**kwargs)
+            except RequestError as e:
+                if e.code in RECONNECT_STATUS_CODES:
+                    await self._invalidate(services, e)
+                    raise
+                delay = limiter.reset_delay(e)
+                if bucket is None or delay is None or attempt >= limiter.max_retries:
+                    raise
+                attempt += 1
+                bucket.pause(delay)
+                REGISTRY.inc("tinkoff_rate_limited_total", service=service)
+                logger.warning(f"Превышен лимит запросов {service}, повтор через {delay:.0f} сек")
+            except grpc.RpcError as e:
+                await self._invalidate(services, e)
+                raise
+
+    async def close(self) -> None:
+        """Закрытие асинхронного канала"""
+        if self._client is not None:
+            await self._client.__aexit__(None, None, None)
+            self._client = None
+            self._services = None
+
+    async def _fetch_prices(self, planner: PriceFetchPlanner) -> PriceTable:
+        """Цены по плану: свежие — из кэша или стрима, остальные пакетами одновременно"""
+        valuator = self.base.valuator
+        with span("valuation_stage", stage="prices"):
+            prices, chunks = valuator.split_prices(planner)
+            responses = await asyncio.gather(
+                *(self._call("market_data", "get_last_prices", figi=chunk) for chunk in chunks)
+            )
+            return valuator.build_price_table(planner, prices, responses)
+
+    async def get_currency_rates(self) -> Dict[str, float]:
+        """Курсы USD и EUR одним запросом (кэш и значения по умолчанию — общие с PortfolioValuator)"""
+        valuator = self.base.valuator
+        if self.base.price_stream is None and valuator.rates_cached:
+            return valuator.cached_currency_rates()
+
+        try:
+            price_table = await self._fetch_prices(PriceFetchPlanner().add_currencies())
+            return valuator.currency_rates(price_table)
+        except Exception as e:
+            logger.warning(f"Ошибка получения курсов валют: {e}")
+            return valuator.cached_currency_rates()
+
+    async def get_moex_index_price(self) -> Optional[float]:
+        """Текущее значение индекса MOEX"""
+        try:
+            return (await self._fetch_prices(PriceFetchPlanner().add_benchmark())).moex_index()
+        except RequestError as e:
+            logger.error(f"Ошибка получения индекса MOEX: {e}")
+            return None
+
+    async def _lookup_instruments(self, positions: List) -> Dict[str, Dict]:
+        """Сведения об инструментах: справочник, а промахи — параллельными запросами *_by"""
+        catalog = self.base.instrument_catalog
+        await asyncio.get_running_loop().run_in_executor(None, catalog.ensure_fresh)
+
+        instruments_info = {}
+        misses = []
+        for position in positions:
+            if position.instrument_type not in VALUED_TYPES or position.quantity.units <= 0:
+                continue
+            figi = position.figi
+            instrument = catalog.get(figi)
+            if instrument:
+                instruments_info[figi] = instrument_info(figi, position.instrument_type, instrument)
+            else:
+                misses.append(position)
+
+        methods = {"share": "share_by", "bond": "bond_by", "etf": "etf_by"}
+        responses = await asyncio.gather(
+            *(self._call("instruments", methods[position.instrument_type], id_type=1, id=position.figi)
+              for position in misses),
+            return_exceptions=True
+        )
+        catalog.metadata_requests += len(misses)
+
+        for position, response in zip(misses, responses):
+            instrument = None
+            if isinstance(response, Exception):
+                logger.warning(f"Не удалось получить информацию об инструменте {position.figi}: {response}")
+            else:
+                instrument = catalog.remember(response.instrument, position.instrument_type)
+            instruments_info[position.figi] = instrument_info(
+                position.figi, position.instrument_type, instrument
+            )
+
+        if misses:
+            await asyncio.get_running_loop().run_in_executor(None, catalog.flush)
+        return instruments_info
+
+    async def _price_table(self, positions: List) -> PriceTable:
+        """Цены позиций и курсы валют одним планом (как PortfolioValuator.price_table)"""
+        try:
+            return await self._fetch_prices(PriceFetchPlanner().add_currencies().add_positions(positions))
+        except RequestError as e:
+            logger.warning(f"Не удалось получить текущие цены и курсы валют: {e}")
+            return PriceTable()
+
+    async def get_portfolio_data(self, account_id: str) -> Dict:
+        """Получение полных данных портфеля
+
+        Запросы выполняются асинхронно, расчет — общий с синхронным
+        клиентом (PortfolioValuator.assemble).
+        """
+        valuator = self.base.valuator
+        try:
+            portfolio_response, stop_orders_response, accounts_response = await asyncio.gather(
+                self._call("operations", "get_portfolio", account_id=account_id),
+                self._call("stop_orders", "get_stop_orders", account_id=account_id),
+                self._call("users", "get_accounts"),
+                return_exceptions=True
+            )
+
+            if isinstance(portfolio_response, Exception):
+                raise portfolio_response
+            positions = portfolio_response.positions
+
+            # Справочник и цены не зависят друг от друга
+            with span("valuation", accounts=1):
+                instruments_info, price_table = await asyncio.gather(
+                    self._lookup_instruments(positions),
+                    self._price_table(positions)
+                )
+
+                stop_orders = {}
+                if isinstance(stop_orders_response, Exception):
+                    logger.warning(f"Не удалось получить стоп-заявки {account_id}: {stop_orders_response}")
+                else:
+                    stop_orders = valuator.stop_orders_from(stop_orders_response)
+
+                account_names = {}
+                if isinstance(accounts_response, Exception):
+                    logger.warning(f"Не удалось получить список счетов: {accounts_response}")
+                else:
+                    account_names = valuator.account_names_from(accounts_response)
+
+                account_positions = {account_id: positions}
+                instruments_info = {account_id: instruments_info}
+                order_book_prices = {}
+                if valuator.pricer is not None:
+                    order_book_prices = await asyncio.get_running_loop().run_in_executor(
+                        None, self._order_book_prices, account_positions, instruments_info
+                    )
+
+                valuation = valuator.assemble(
+                    account_positions, instruments_info, price_table,
+                    account_names, {account_id: stop_orders}, order_book_prices
+                )
+            return valuation.portfolio_data(account_id)
+
+        except Exception as e:
+            logger.error(f"Ошибка получения портфеля {account_id}: {e}")
+            raise
+
+    def _order_book_prices(self, account_positions: Dict[str, List], instruments_info: Dict) -> Dict:
+        """Цены по стакану (синхронный OrderBookPricer на общем канале)"""
+        valuator = self.base.valuator
+        positions = valuator.order_book_positions(account_positions, instruments_info)
+        with span("valuation_stage", stage="order_book"), self.base.services() as client:
+            return valuator.pricer.fetch_prices(client, positions)
+
+
+class SyncTinkoffClient(TinkoffClient):
+    """Синхронный фасад над AsyncTinkoffClient.
+
+    Подменяет TinkoffClient в Scheduler/CommandHandler без изменения
+    вызывающего кода: корутины выполняются в собственном цикле событий
+    в фоновом потоке.
+    """
+
+    def __init__(self, token: str, data_dir: Optional[str] = None, catalog_ttl: int = 86400,
+                 rate_limits: Optional[Dict[str, int]] = None, client_factory: Callable = Client,
+                 async_client_factory: Callable = AsyncClient, price_cache_ttl: float = 0,
+                 call_timeout: float = SYNC_CALL_TIMEOUT):
+        super().__init__(token, data_dir=data_dir, catalog_ttl=catalog_ttl, rate_limits=rate_limits,
+                         client_factory=client_factory, price_cache_ttl=price_cache_ttl)
+        self.async_client_factory = async_client_factory
+        self.call_timeout = call_timeout
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self._loop.run_forever, daemon=True, name="tinkoff-async")
+        self._loop_thread.start()
+        self.async_client = self._run_sync(self._create_async_client())
+
+    async def _create_async_client(self) -> AsyncTinkoffClient:
+        """Создание асинхронного клиента внутри его цикла событий"""
+        return AsyncTinkoffClient(self.token, self, self.async_client_factory)
+
+    def _run_sync(self, coroutine):
+        """Выполнение корутины в фоновом цикле с ожиданием результата
+
+        Если результат не получен за call_timeout, корутина отменяется
+        и выбрасывается TimeoutError.
+        """
+        future = asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+        try:
+            return future.result(timeout=self.call_timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise TimeoutError(f"Запрос к API не завершился за {self.call_timeout} сек")
+
+    def get_currency_rates(self, price_table: Optional[PriceTable] = None) -> Dict[str, float]:
+        """Получение курсов валют с кэшированием"""
+        if price_table is not None:
+            return super().get_currency_rates(price_table)
+        try:
+            return self._run_sync(self.async_client.get_currency_rates())
+        except TimeoutError as e:
+            logger.warning(f"Ошибка получения курсов валют: {e}")
+            return self.valuator.cached_currency_rates()
+
+    def get_moex_index_price(self, price_table: Optional[PriceTable] = None) -> Optional[float]:
+        """Получение текущего значения индекса MOEX"""
+        if price_table is not None:
+            return super().get_moex_index_price(price_table)
+        try:
+            return self._run_sync(self.async_client.get_moex_index_price())
+        except TimeoutError as e:
+            logger.error(f"Ошибка получения индекса MOEX: {e}")
+            return None
+
+    def get_portfolio_data(self, account_id: str, price_table: Optional[PriceTable] = None,
+                           positions: Optional[List] = None, details: bool = True) -> Dict:
+        """Получение полных данных портфеля
+
+        С готовыми позициями и таблицей цен (пакетный режим гонки) расчет
+        выполняется синхронной реализацией без лишних запросов.
+        """
+        if price_table is not None or positions is not None or not details:
+            return super().get_portfolio_data(account_id, price_table, positions, details)
+        return self._run_sync(self.async_client.get_portfolio_data(account_id))
+
+    def close(self) -> None:
+        """Закрытие асинхронного и синхронного каналов"""
+        try:
+            self._run_sync(self.async_client.close())
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            super().close()
@@ -0,0 +1,172 @@
+"""Долгоживущий gRPC-канал к API Тинькофф"""
+import logging
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+import grpc
+from tinkoff.invest import Client, RequestError
+from .rate_limiter import RateLimiter, ThrottledServices
+
+logger = logging.getLogger(__name__)
+
+# Коды ошибок, после которых канал считается сломанным
+RECONNECT_STATUS_CODES = (grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.UNKNOWN)
+
+
+class _CallDetails(
+    namedtuple("_CallDetails", ("method", "timeout", "metadata", "credentials", "wait_for_ready", "compression")),
+    grpc.ClientCallDetails
+):
+    """Параметры вызова с подставленным сроком ответа"""
+
+
+class DeadlineInterceptor(grpc.UnaryUnaryClientInterceptor):
+    """Срок ответа для каждого unary-запроса канала (если вызов не задал свой)"""
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+
+    def intercept_unary_unary(self, continuation, client_call_details, request):
+        if client_call_details.timeout is None:
+            client_call_details = _CallDetails(
+                client_call_details.method, self.timeout, client_call_details.metadata,
+                client_call_details.credentials, getattr(client_call_details, "wait_for_ready", None),
+                getattr(client_call_details, "compression", None)
+            )
+        return continuation(client_call_details, request)
+
+
+class ChannelManager:
+    """Один канал на весь процесс: создается лениво, проверяется и переоткрывается при сбое"""
+
+    KEEPALIVE_OPTIONS = [
+        ('grpc.keepalive_time_ms', 30000),
+        ('grpc.keepalive_timeout_ms', 10000),
+        ('grpc.keepalive_permit_without_calls', 1),
+        ('grpc.http2.max_pings_without_data', 0),
+    ]
+
+    def __init__(self, token: str, client_factory: Callable = Client, health_check_interval: int = 300,
+                 rate_limiter: Optional[RateLimiter] = None, call_timeout: Optional[float] = None):
+        self.token = token
+        self.client_factory = client_factory
+        self.health_check_interval = health_check_interval
+        self.rate_limiter = rate_limiter
+        self.call_timeout = call_timeout  # срок ответа каждого запроса, секунд (None — без срока)
+        self._client = None
+        self._services = None
+        self._last_health_check = 0.0
+        self._broken = False
+        self._lock = threading.RLock()
+
+        # Счетчики для диагностики
+        self.channels_opened = 0
+        self.reconnects = 0
+        self.health_checks = 0
+
+    def _open(self) -> None:
+        """Открытие нового канала"""
+        kwargs = {"options": self.KEEPALIVE_OPTIONS}
+        if self.call_timeout:
+            kwargs["interceptors"] = [DeadlineInterceptor(self.call_timeout)]
+        self._client = self.client_factory(self.token, **kwargs)
+        self._services = self._client.__enter__()
+        self._broken = False
+        self._last_health_check = time.time()
+        self.channels_opened += 1
+        logger.info(f"Открыт gRPC-канал к Tinkoff API (всего: {self.channels_opened})")
+
+    def _close(self) -> None:
+        """Закрытие текущего канала"""
+        if self._client is None:
+            return
+
+        try:
+            self._client.__exit__(None, None, None)
+        except Exception as e:
+            logger.warning(f"Ошибка закрытия gRPC-канала: {e}")
+        finally:
+            self._client = None
+            self._services = None
+
+    def _is_healthy(self) -> bool:
+        """Легкий запрос для проверки живости канала"""
+        self.health_checks += 1
+        try:
+            self._services.users.get_info()
+            return True
+        except Exception as e:
+            logger.warning(f"Проверка gRPC-канала не пройдена: {e}")
+            return False
+
+    def acquire(self):
+        """Получение сервисов API на общем канале"""
+        with self._lock:
+            if self._services is None:
+                self._open()
+            elif self._broken:
+                logger.warning("gRPC-канал помечен как сломанный, переоткрываем")
+                self._reconnect()
+            elif time.time() - self._last_health_check > self.health_check_interval:
+                if not self._is_healthy():
+                    self._reconnect()
+                self._last_health_check = time.time()
+            return self._services
+
+    def _reconnect(self) -> None:
+        """Переоткрытие канала"""
+        self.reconnects += 1
+        self._close()
+        self._open()
+
+    def invalidate(self, services) -> None:
+        """Пометка канала как сломанного; новый откроется при следующем запросе"""
+        with self._lock:
+            if services is self._services:
+                self.reconnects += 1
+                self._close()
+
+    def _record_failure(self, services, error: Exception) -> None:
+        """Учет ошибки запроса: после ошибки транспорта канал переоткроется при следующем запросе
+
+        Вызывается прокси сервисов, поэтому срабатывает и тогда, когда
+        вызывающий код перехватывает RequestError внутри `with`.
+        """
+        if isinstance(error, RequestError) and error.code not in RECONNECT_STATUS_CODES:
+            return
+        with self._lock:
+            if services is self._services and not self._broken:
+                self._broken = True
+                logger.warning(f"Ошибка транспорта gRPC, канал будет переоткрыт: {error}")
+
+    @contextmanager
+    def services(self):
+        """Контекст, совместимый с `with Client(token) as client`, но без открытия канала"""
+        services = self.acquire()
+        try:
+            yield ThrottledServices(
+                services, self.rate_limiter, on_error=lambda error: self._record_failure(services, error)
+            )
+        except RequestError as e:
+            if e.code in RECONNECT_STATUS_CODES:
+                self.invalidate(services)
+            raise
+        except grpc.RpcError:
+            self.invalidate(services)
+            raise
+
+    def close(self) -> None:
+        """Закрытие канала при остановке"""
+        with self._lock:
+            self._close()
+        logger.info("gRPC-канал к Tinkoff API закрыт")
+
+    def stats(self) -> Dict[str, int]:
+        """Счетчики открытых каналов и проверок"""
+        return {
+            "channels_opened": self.channels_opened,
+            "reconnects": self.reconnects,
+            "health_checks": self.health_checks,
+        }
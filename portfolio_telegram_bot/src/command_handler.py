@@ -1,5 +1,6 @@
 """Обработчик команд Telegram бота"""
 import logging
+import secrets
 import threading
 import time
 from typing import Dict, List, Callable
@@ -7,7 +8,11 @@ from .telegram_bot import TelegramBot
 from .portfolio_analyzer import PortfolioAnalyzer
 from .race_tracker import RaceTracker
 from .report_formatter import ReportFormatter
+from .command_pool import CommandPool
 from .config import Config
+from .metrics import span
+from .response_cache import ResponseCache, format_as_of
+from .webhook_server import WebhookServer
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +29,18 @@ class CommandHandler:
         self.last_update_id = 0
         self.running = False
         self.polling_thread = None
+        self.webhook_server = None
+        
+        # Результаты /portfolio, /race, /pnl и /status по счетам (сбрасываются планировщиком)
+        self.responses = ResponseCache(config.RESPONSE_CACHE_TTLS)
+        
+        # Команды выполняются пулом, цикл получения обновлений их не ждет
+        self.pool = CommandPool(
+            workers=config.COMMAND_WORKERS,
+            queue_size=config.COMMAND_QUEUE_SIZE,
+            limits=config.COMMAND_LIMITS,
+            timeouts=config.COMMAND_TIMEOUTS
+        )
         
         # Регистрация команд
         self.commands = {
@@ -58,13 +75,71 @@ class CommandHandler:
         else:
             logger.warning("Не удалось установить команды бота")
     
+    def start(self) -> None:
+        """Запуск приема команд в режиме из настроек (receive_mode: polling или webhook)"""
+        if self.config.RECEIVE_MODE == 'webhook':
+            self.start_webhook()
+        else:
+            self.start_polling()
+    
+    def stop(self) -> None:
+        """Остановка приема команд"""
+        if self.webhook_server:
+            self.stop_webhook()
+        else:
+            self.stop_polling()
+    
+    def start_webhook(self) -> None:
+        """Запуск локального сервера webhook и регистрация его адреса в Telegram"""
+        if self.webhook_server:
+            logger.warning("Webhook уже запущен")
+            return
+        if not self.config.WEBHOOK_URL:
+            logger.error("Не задан webhook_url, команды принимаются через polling")
+            self.start_polling()
+            return
+        
+        # Без заданного секрета для каждого запуска создается случайный
+        secret_token = self.config.WEBHOOK_SECRET or secrets.token_urlsafe(32)
+        self.pool.start()
+        self.webhook_server = WebhookServer(
+            self._process_update,
+            host=self.config.WEBHOOK_HOST,
+            port=self.config.WEBHOOK_PORT,
+            path=self.config.WEBHOOK_PATH,
+            secret_token=secret_token,
+            cert_file=self.config.WEBHOOK_CERT,
+            key_file=self.config.WEBHOOK_KEY
+        )
+        self.webhook_server.start()
+        
+        if self.telegram_bot.set_webhook(self.config.WEBHOOK_URL, secret_token):
+            logger.info(f"Webhook зарегистрирован: {self.config.WEBHOOK_URL}")
+        else:
+            logger.error("Не удалось зарегистрировать webhook, команды принимаются через polling")
+            self.webhook_server.stop()
+            self.webhook_server = None
+            self.start_polling()
+    
+    def stop_webhook(self) -> None:
+        """Удаление webhook и остановка сервера"""
+        self.telegram_bot.delete_webhook()
+        self.webhook_server.stop()
+        self.webhook_server = None
+        self.pool.stop()
+        logger.info("Прием команд через webhook остановлен")
+    
     def start_polling(self) -> None:
         """Запуск polling для обработки команд"""
         if self.running:
             logger.warning("Polling уже запущен")
             return
         
+        # getUpdates не работает, пока зарегистрирован webhook
+        self.telegram_bot.delete_webhook()
+        
         self.running = True
+        self.pool.start()
         self.polling_thread = threading.Thread(target=self._polling_loop, daemon=True)
         self.polling_thread.start()
         
@@ -75,6 +150,7 @@ class CommandHandler:
         self.running = False
         if self.polling_thread:
             self.polling_thread.join(timeout=5)
+        self.pool.stop()
         logger.info("Command handler polling остановлен")
     
     def _polling_loop(self) -> None:
@@ -91,8 +167,6 @@ class CommandHandler:
                         self._process_update(update)
                         self.last_update_id = update['update_id']
                 
-                time.sleep(1)  # Небольшая пауза между запросами
-                
             except Exception as e:
                 logger.error(f"Ошибка в polling loop: {e}")
                 time.sleep(5)  # Пауза при ошибке
@@ -104,16 +178,18 @@ class CommandHandler:
                 self.telegram_bot.send_message("❌ Портфель Бот-трейдер не настроен")
                 return
             
-            self.telegram_bot.send_message("📊 Анализирую P&L...")
+            account_id = self.config.BOT_TRADER_ACCOUNT_ID
             
-            # Получаем детальные данные P&L
-            pnl_data = self.portfolio_analyzer.calculate_total_pnl_from_inception(
-                self.config.BOT_TRADER_ACCOUNT_ID
+            # Получаем детальные данные P&L (или недавний результат из кэша)
+            pnl_data, as_of = self.responses.get(
+                "/pnl", account_id,
+                lambda: self.portfolio_analyzer.calculate_total_pnl_from_inception(account_id),
+                on_miss=lambda: self.telegram_bot.send_message("📊 Анализирую P&L...")
             )
             
             # Форматируем детальный отчет
             pnl_report = self._format_detailed_pnl(pnl_data)
-            self.telegram_bot.send_message(pnl_report)
+            self.telegram_bot.send_message(f"{pnl_report}\n\n{format_as_of(as_of)}")
             
         except Exception as e:
             error_text = self.report_formatter.format_error_report(str(e), "Анализ P&L")
@@ -196,13 +272,32 @@ class CommandHandler:
             if text.startswith('/'):
                 command = text.split()[0].lower()
                 if command in self.commands:
-                    self.commands[command](message)
+                    self._run_command(command, message)
                 else:
                     self._cmd_unknown(message, command)
             
         except Exception as e:
             logger.error(f"Ошибка обработки обновления: {e}")
     
+    def _run_command(self, command: str, message: dict) -> None:
+        """Выполнение команды: через пул, если он запущен, иначе сразу"""
+        if not self.pool.running:
+            self._execute_command(command, message)
+            return
+        
+        if not self.pool.submit(command, self._execute_command, command, message,
+                                on_timeout=self._command_timed_out):
+            self.telegram_bot.send_message("⏳ Бот занят, повторите команду позже")
+    
+    def _execute_command(self, command: str, message: dict) -> None:
+        with span("bot_command", command=command):
+            self.commands[command](message)
+    
+    def _command_timed_out(self, command: str, timeout: float) -> None:
+        self.telegram_bot.send_message(
+            f"⏱ Команда {command} выполняется дольше {timeout:.0f} сек, результат придет позже"
+        )
+    
     def _cmd_start(self, message: dict) -> None:
         """Команда /start"""
         welcome_text = [
@@ -261,9 +356,12 @@ class CommandHandler:
             next_run = schedule.next_run()
             now = datetime.now()
             
-            # Проверяем доступность API
-            moex_price = self.race_tracker.client.get_moex_index_price()
+            # Проверяем доступность API (результат проверки кэшируется)
+            moex_price, as_of = self.responses.get(
+                "/status", "api", self.race_tracker.client.get_moex_index_price
+            )
             api_status = "✅ Доступен" if moex_price else "❌ Недоступен"
+            api_status += f" (проверено в {datetime.fromtimestamp(as_of).strftime('%H:%M')})"
             
             status_lines = [
                 "📊 *СТАТУС СИСТЕМЫ*",
@@ -276,6 +374,8 @@ class CommandHandler:
                 f"📅 Следующий отчет: {next_run.strftime('%d.%m.%Y %H:%M')}",
                 f"🌍 Часовой пояс: {self.config.TIMEZONE}",
                 "",
+                f"⚙️ Команд в очереди: {self.pool.stats()['pending']}",
+                "",
                 f"📊 Портфелей в гонке: {len(self.config.PORTFOLIO_ACCOUNTS)}",
                 f"💼 Основной портфель: {self.config.BOT_TRADER_ACCOUNT_ID[-4:]}...{self.config.BOT_TRADER_ACCOUNT_ID[-4:]}" if self.config.BOT_TRADER_ACCOUNT_ID else "Не настроен",
             ]
@@ -299,16 +399,14 @@ class CommandHandler:
                 self.telegram_bot.send_message("❌ Портфель Бот-трейдер не настроен")
                 return
             
-            self.telegram_bot.send_message("📊 Генерирую отчет по портфелю...")
-            
             # Получаем данные портфеля
-            portfolio_data = self.portfolio_analyzer.generate_portfolio_report(
-                self.config.BOT_TRADER_ACCOUNT_ID
+            portfolio_data, as_of = self._portfolio_data(
+                on_miss=lambda: self.telegram_bot.send_message("📊 Генерирую отчет по портфелю...")
             )
             
             # Форматируем и отправляем
             portfolio_report = self.report_formatter.format_portfolio_report(portfolio_data)
-            self.telegram_bot.send_message(portfolio_report)
+            self.telegram_bot.send_message(f"{portfolio_report}\n\n{format_as_of(as_of)}")
             
         except Exception as e:
             error_text = self.report_formatter.format_error_report(str(e), "Отчет по портфелю")
@@ -321,14 +419,14 @@ class CommandHandler:
                 self.telegram_bot.send_message("❌ Портфели для гонки не настроены")
                 return
             
-            self.telegram_bot.send_message("🏁 Генерирую отчет о гонке...")
-            
             # Получаем данные гонки
-            race_data = self.race_tracker.generate_race_report()
+            race_data, as_of = self._race_data(
+                on_miss=lambda: self.telegram_bot.send_message("🏁 Генерирую отчет о гонке...")
+            )
             
             # Форматируем и отправляем
             race_report = self.report_formatter.format_race_report(race_data)
-            self.telegram_bot.send_message(race_report)
+            self.telegram_bot.send_message(f"{race_report}\n\n{format_as_of(as_of)}")
             
         except Exception as e:
             error_text = self.report_formatter.format_error_report(str(e), "Отчет о гонке")
@@ -359,19 +457,15 @@ class CommandHandler:
             
             # 1. Отчет по портфелю
             if self.config.BOT_TRADER_ACCOUNT_ID:
-                portfolio_data = self.portfolio_analyzer.generate_portfolio_report(
-                    self.config.BOT_TRADER_ACCOUNT_ID
-                )
+                portfolio_data, as_of = self._portfolio_data()
                 portfolio_report = self.report_formatter.format_portfolio_report(portfolio_data)
-                self.telegram_bot.send_message(portfolio_report)
-                time.sleep(1)  # Небольшая пауза между сообщениями
+                self.telegram_bot.send_message(f"{portfolio_report}\n\n{format_as_of(as_of)}")
             
             # 2. Отчет о гонке
             if self.config.PORTFOLIO_ACCOUNTS:
-                race_data = self.race_tracker.generate_race_report()
+                race_data, as_of = self._race_data()
                 race_report = self.report_formatter.format_race_report(race_data)
-                self.telegram_bot.send_message(race_report)
-                time.sleep(1)
+                self.telegram_bot.send_message(f"{race_report}\n\n{format_as_of(as_of)}")
             
             # 3. График
             chart_path = self.race_tracker.create_performance_chart()
@@ -385,6 +479,19 @@ class CommandHandler:
             error_text = self.report_formatter.format_error_report(str(e), "Полный отчет")
             self.telegram_bot.send_message(error_text)
     
+    def _portfolio_data(self, on_miss=None):
+        """Данные отчета по портфелю Бот-трейдер и время их расчета"""
+        account_id = self.config.BOT_TRADER_ACCOUNT_ID
+        return self.responses.get(
+            "/portfolio", account_id,
+            lambda: self.portfolio_analyzer.generate_portfolio_report(account_id),
+            on_miss=on_miss
+        )
+    
+    def _race_data(self, on_miss=None):
+        """Данные отчета о гонке и время их расчета"""
+        return self.responses.get("/race", "race", self.race_tracker.generate_race_report, on_miss=on_miss)
+    
     def _cmd_unknown(self, message: dict, command: str) -> None:
         """Обработка неизвестной команды"""
         unknown_text = [
@@ -0,0 +1,205 @@
+"""Пул выполнения команд бота"""
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Optional
+from .metrics import REGISTRY, Histogram
+
+logger = logging.getLogger(__name__)
+
+# Одновременных выполнений по командам (остальные ждут в очереди команды)
+DEFAULT_COMMAND_LIMITS = {
+    "/portfolio": 2,
+    "/race": 2,
+    "/chart": 1,
+    "/report": 1,
+    "/pnl": 1,
+}
+
+# Таймауты команд, секунды
+DEFAULT_COMMAND_TIMEOUTS = {
+    "/portfolio": 120,
+    "/chart": 120,
+    "/report": 300,
+    "/pnl": 180,
+}
+DEFAULT_COMMAND_TIMEOUT = 60
+
+
+class _CommandStats:
+    """Метрики одной команды"""
+
+    def __init__(self):
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.wait = Histogram()
+        self.execution = Histogram()
+
+    def to_dict(self) -> Dict:
+        return {
+            "queued": self.queued,
+            "running": self.running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "timeouts": self.timeouts,
+            "rejected": self.rejected,
+            "queue_wait": self.wait.to_dict(),
+            "execution": self.execution.to_dict(),
+        }
+
+
+class _Job:
+    def __init__(self, command: str, func: Callable, args: tuple, on_timeout: Optional[Callable]):
+        self.command = command
+        self.func = func
+        self.args = args
+        self.on_timeout = on_timeout
+        self.enqueued = time.monotonic()
+
+
+class CommandPool:
+    """Очередь команд с пулом обработчиков.
+
+    Получение обновлений не ждет выполнения команд: submit() ставит
+    команду в ограниченную очередь и сразу возвращается. У каждой
+    команды свой лимит одновременных выполнений — команда сверх лимита
+    ждет в своей очереди и не занимает обработчик, поэтому медленный
+    /report не задерживает /status. Команда, не уложившаяся в таймаут,
+    не прерывается (потоки Python нельзя остановить), но обработчик
+    освобождается, а место в лимите команды — только после ее завершения.
+    """
+
+    def __init__(self, workers: int = 4, queue_size: int = 50, limits: Optional[Dict[str, int]] = None,
+                 timeouts: Optional[Dict[str, float]] = None, default_timeout: float = DEFAULT_COMMAND_TIMEOUT):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.limits = {**DEFAULT_COMMAND_LIMITS, **(limits or {})}
+        self.timeouts = {**DEFAULT_COMMAND_TIMEOUTS, **(timeouts or {})}
+        self.default_timeout = default_timeout
+
+        self._ready: queue.Queue = queue.Queue()
+        self._waiting: Dict[str, deque] = {}  # команды сверх лимита
+        self._active: Dict[str, int] = {}  # выполняющиеся (в том числе после таймаута)
+        self._pending = 0  # в очереди и в ожидании лимита
+        self._stats: Dict[str, _CommandStats] = {}
+        self._lock = threading.Lock()
+        self._threads = []
+
+    @property
+    def running(self) -> bool:
+        return bool(self._threads)
+
+    def start(self) -> None:
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"command-{i + 1}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Пул команд запущен: {self.workers} обработчиков, очередь до {self.queue_size}")
+
+    def stop(self, timeout: float = 5) -> None:
+        threads, self._threads = self._threads, []
+        for _ in threads:
+            self._ready.put(None)
+        for thread in threads:
+            thread.join(timeout=timeout)
+        logger.info("Пул команд остановлен")
+
+    def _command_stats(self, command: str) -> _CommandStats:
+        stats = self._stats.get(command)
+        if stats is None:
+            stats = self._stats[command] = _CommandStats()
+        return stats
+
+    def submit(self, command: str, func: Callable, *args, on_timeout: Optional[Callable] = None) -> bool:
+        """Постановка команды в очередь (False, если очередь заполнена)"""
+        job = _Job(command, func, args, on_timeout)
+        with self._lock:
+            stats = self._command_stats(command)
+            if self._pending >= self.queue_size:
+                stats.rejected += 1
+                REGISTRY.inc("bot_command_rejected_total", command=command)
+                logger.warning(f"Очередь команд заполнена, {command} отклонена")
+                return False
+
+            self._pending += 1
+            stats.queued += 1
+            if self._active.get(command, 0) < self.limits.get(command, self.workers):
+                self._active[command] = self._active.get(command, 0) + 1
+                self._ready.put(job)
+            else:
+                self._waiting.setdefault(command, deque()).append(job)
+        return True
+
+    def _finish(self, command: str) -> None:
+        """Освобождение места в лимите команды: следующая ожидающая — в очередь"""
+        with self._lock:
+            waiting = self._waiting.get(command)
+            if waiting:
+                self._ready.put(waiting.popleft())
+            else:
+                self._active[command] -= 1
+
+    def _execute(self, job: _Job) -> None:
+        stats = self._stats[job.command]
+        start_time = time.perf_counter()
+        try:
+            job.func(*job.args)
+            failed = False
+        except Exception as e:
+            failed = True
+            logger.error(f"Ошибка выполнения команды {job.command}: {e}")
+        elapsed = time.perf_counter() - start_time
+        with self._lock:
+            stats.running -= 1
+            stats.completed += 1
+            stats.failed += failed
+            stats.execution.observe(elapsed)
+        REGISTRY.observe("bot_command_execution_seconds", elapsed, command=job.command)
+        self._finish(job.command)
+
+    def _worker(self) -> None:
+        while True:
+            job = self._ready.get()
+            if job is None:
+                return
+
+            wait = time.monotonic() - job.enqueued
+            with self._lock:
+                stats = self._stats[job.command]
+                self._pending -= 1
+                stats.queued -= 1
+                stats.running += 1
+                stats.wait.observe(wait)
+            REGISTRY.observe("bot_command_queue_wait_seconds", wait, command=job.command)
+
+            # Команда выполняется в своем потоке, обработчик ждет ее не дольше таймаута
+            timeout = self.timeouts.get(job.command, self.default_timeout)
+            thread = threading.Thread(target=self._execute, args=(job,), name=f"cmd{job.command}", daemon=True)
+            thread.start()
+            thread.join(timeout)
+            if thread.is_alive():
+                with self._lock:
+                    stats.timeouts += 1
+                REGISTRY.inc("bot_command_timeouts_total", command=job.command)
+                logger.error(f"Команда {job.command} не уложилась в {timeout} сек")
+                if job.on_timeout:
+                    try:
+                        job.on_timeout(job.command, timeout)
+                    except Exception as e:
+                        logger.error(f"Ошибка обработки таймаута {job.command}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Очередь и метрики по командам"""
+        with self._lock:
+            return {
+                "pending": self._pending,
+                "commands": {command: stats.to_dict() for command, stats in self._stats.items()},
+            }
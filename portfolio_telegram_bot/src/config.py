@@ -23,6 +23,36 @@ class Config:
             self.REPORT_TIME = config_data.get('report_time', '11:00')
             self.DATA_DIRECTORY = config_data.get('data_directory', './data')
             self.LOGS_DIRECTORY = config_data.get('logs_directory', './logs')
+            self.INSTRUMENT_CATALOG_TTL = config_data.get('instrument_catalog_ttl', 86400)
+            self.RACE_MAX_WORKERS = config_data.get('race_max_workers', 5)
+            self.RACE_ACCOUNT_TIMEOUT = config_data.get('race_account_timeout', 60)
+            self.USE_ASYNC_CLIENT = config_data.get('use_async_client', False)
+            self.MARKET_DATA_STREAM = config_data.get('market_data_stream', False)
+            self.STREAM_MAX_PRICE_AGE = config_data.get('stream_max_price_age', 60)
+            self.STREAM_RESUBSCRIBE_INTERVAL = config_data.get('stream_resubscribe_interval', 900)
+            self.API_RATE_LIMITS = config_data.get('api_rate_limits', {})
+            self.FAKE_API_FIXTURE = config_data.get('fake_api_fixture', '')
+            self.FAKE_API_LATENCY = config_data.get('fake_api_latency', 0.0)
+            self.FAKE_API_ERROR_RATE = config_data.get('fake_api_error_rate', 0.0)
+            self.METRICS_FILE = config_data.get('metrics_file', '')
+            self.METRICS_FLUSH_INTERVAL = config_data.get('metrics_flush_interval', 60)
+            self.METRICS_PORT = config_data.get('metrics_port', 0)
+            self.STAGE_TIMEOUTS = config_data.get('stage_timeouts', {})
+            self.PRICE_CACHE_TTL = config_data.get('price_cache_ttl', 30)
+            self.TELEGRAM_RATE_LIMITS = config_data.get('telegram_rate_limits', {})
+            self.COMMAND_WORKERS = config_data.get('command_workers', 4)
+            self.COMMAND_QUEUE_SIZE = config_data.get('command_queue_size', 50)
+            self.COMMAND_LIMITS = config_data.get('command_limits', {})
+            self.COMMAND_TIMEOUTS = config_data.get('command_timeouts', {})
+            self.RECEIVE_MODE = config_data.get('receive_mode', 'polling')
+            self.WEBHOOK_URL = config_data.get('webhook_url', '')
+            self.WEBHOOK_HOST = config_data.get('webhook_host', '0.0.0.0')
+            self.WEBHOOK_PORT = config_data.get('webhook_port', 8443)
+            self.WEBHOOK_PATH = config_data.get('webhook_path', '/telegram')
+            self.WEBHOOK_SECRET = config_data.get('webhook_secret', '')
+            self.WEBHOOK_CERT = config_data.get('webhook_cert', '')
+            self.WEBHOOK_KEY = config_data.get('webhook_key', '')
+            self.RESPONSE_CACHE_TTLS = config_data.get('response_cache_ttls', {})
             
         except FileNotFoundError:
             print(f"⚠️ Файл конфигурации {self.config_path} не найден")
@@ -39,3 +69,33 @@ class Config:
         self.REPORT_TIME = '11:00'
         self.DATA_DIRECTORY = './data'
         self.LOGS_DIRECTORY = './logs'
+        self.INSTRUMENT_CATALOG_TTL = 86400
+        self.RACE_MAX_WORKERS = 5
+        self.RACE_ACCOUNT_TIMEOUT = 60
+        self.USE_ASYNC_CLIENT = False
+        self.MARKET_DATA_STREAM = False
+        self.STREAM_MAX_PRICE_AGE = 60
+        self.STREAM_RESUBSCRIBE_INTERVAL = 900
+        self.API_RATE_LIMITS = {}
+        self.FAKE_API_FIXTURE = ''
+        self.FAKE_API_LATENCY = 0.0
+        self.FAKE_API_ERROR_RATE = 0.0
+        self.METRICS_FILE = ''
+        self.METRICS_FLUSH_INTERVAL = 60
+        self.METRICS_PORT = 0
+        self.STAGE_TIMEOUTS = {}
+        self.PRICE_CACHE_TTL = 30
+        self.TELEGRAM_RATE_LIMITS = {}
+        self.COMMAND_WORKERS = 4
+        self.COMMAND_QUEUE_SIZE = 50
+        self.COMMAND_LIMITS = {}
+        self.COMMAND_TIMEOUTS = {}
+        self.RECEIVE_MODE = 'polling'
+        self.WEBHOOK_URL = ''
+        self.WEBHOOK_HOST = '0.0.0.0'
+        self.WEBHOOK_PORT = 8443
+        self.WEBHOOK_PATH = '/telegram'
+        self.WEBHOOK_SECRET = ''
+        self.WEBHOOK_CERT = ''
+        self.WEBHOOK_KEY = ''
+        self.RESPONSE_CACHE_TTLS = {}
@@ -0,0 +1,656 @@
+"""Локальная замена API Тинькофф Инвестиций на фикстурах"""
+import argparse
+import asyncio
+import bisect
+import json
+import logging
+import queue
+import random
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from types import SimpleNamespace
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+import grpc
+from tinkoff.invest import RequestError
+from tinkoff.invest.schemas import OperationState, OperationType, StopOrderDirection
+from .money import Money
+from .price_table import EUR_FIGI, MOEX_FIGI, USD_FIGI
+
+logger = logging.getLogger(__name__)
+
+# Сервисы клиента, которые эмулируются
+FAKE_SERVICES = ("users", "operations", "instruments", "market_data", "stop_orders", "market_data_stream")
+
+CASH_FIGIS = {"RUB": "RUB000UTSTOM", "USD": "USD000UTSTOM", "EUR": "EUR000UTSTOM"}
+
+
+def _quotation(value) -> SimpleNamespace:
+    """Quotation из числа или строки"""
+    money = Money.from_number(value)
+    return SimpleNamespace(units=money.units, nano=money.fraction)
+
+
+def _money(value, currency: str = "rub") -> SimpleNamespace:
+    """MoneyValue из числа или строки"""
+    money = _quotation(value)
+    money.currency = currency
+    return money
+
+
+def _from_quotation(value) -> str:
+    """Quotation/MoneyValue в строку для фикстуры"""
+    return str(Money.from_quotation(value))
+
+
+def _aware(value: datetime) -> datetime:
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def _parse_date(value: str) -> datetime:
+    return _aware(datetime.fromisoformat(value))
+
+
+class FakeInvestApi:
+    """Состояние фейкового API: данные фикстуры, задержки, ошибки и счетчики вызовов.
+
+    Формат фикстуры (JSON, суммы — строки):
+        accounts:    [{"id", "name"}]
+        instruments: [{"figi", "uid", "ticker", "name", "currency", "lot", "type"}]
+        prices:      {figi: price}
+        portfolios:  {account_id: [{"figi", "instrument_type", "quantity", "average_price", "currency"}]}
+        stop_orders: {account_id: [{"figi", "direction", "stop_price", "currency"}]}
+        operations:  {account_id: [{"id", "parent_operation_id", "date", "operation_type",
+                                    "payment", "price", "currency", "figi", "instrument_type", "quantity"}]}
+
+    client() и async_client() совместимы с Client/AsyncClient и
+    подставляются как client_factory в TinkoffClient и LastPriceStream.
+    """
+
+    def __init__(self, fixture: Dict, latency: Union[float, Tuple[float, float]] = 0.0,
+                 error_rate: float = 0.0, error_code: grpc.StatusCode = grpc.StatusCode.UNAVAILABLE,
+                 failing_methods: Iterable[str] = (), seed: Optional[int] = None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self.failing_methods = set(failing_methods)  # "service.method", всегда с ошибкой
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = Counter()
+        self.errors = Counter()
+        self._load(fixture)
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs) -> "FakeInvestApi":
+        """Загрузка фикстуры из JSON файла"""
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f), **kwargs)
+
+    def _load(self, fixture: Dict) -> None:
+        """Построение индексов по данным фикстуры"""
+        self.accounts = fixture.get("accounts", [])
+        self.instruments = {item["figi"]: item for item in fixture.get("instruments", [])}
+        self.prices = {figi: Decimal(str(price)) for figi, price in fixture.get("prices", {}).items()}
+        self.portfolios = fixture.get("portfolios", {})
+        self.stop_orders = fixture.get("stop_orders", {})
+
+        # Операции по возрастанию даты для выборки по диапазону
+        self.operations = {}
+        self._operation_dates = {}
+        for account_id, operations in fixture.get("operations", {}).items():
+            rows = sorted(
+                ((_parse_date(operation["date"]), operation) for operation in operations),
+                key=lambda row: row[0]
+            )
+            self._operation_dates[account_id] = [row[0] for row in rows]
+            self.operations[account_id] = [row[1] for row in rows]
+
+    # --- Фабрики клиентов ---
+
+    def client(self, token: str = "", options=None, interceptors=None) -> "FakeClient":
+        """Замена tinkoff.invest.Client (срок ответа берется из DeadlineInterceptor)"""
+        timeouts = [interceptor.timeout for interceptor in interceptors or () if hasattr(interceptor, "timeout")]
+        return FakeClient(self, min(timeouts) if timeouts else None)
+
+    def async_client(self, token: str = "", options=None) -> "FakeAsyncClient":
+        """Замена tinkoff.invest.AsyncClient"""
+        return FakeAsyncClient(self)
+
+    # --- Задержки, ошибки и учет вызовов ---
+
+    def _delay(self) -> float:
+        if isinstance(self.latency, (tuple, list)):
+            return self._random.uniform(*self.latency)
+        return self.latency
+
+    def _before_call(self, name: str) -> float:
+        """Учет вызова и внедрение ошибки; возвращает задержку ответа"""
+        with self._lock:
+            self.calls[name] += 1
+            fail = name in self.failing_methods or (self.error_rate and self._random.random() < self.error_rate)
+            delay = self._delay()
+            if fail:
+                self.errors[name] += 1
+
+        if fail:
+            metadata = SimpleNamespace(tracking_id="fake", message="Injected error",
+                                       ratelimit_limit=None, ratelimit_remaining=0, ratelimit_reset=1)
+            raise RequestError(self.error_code, f"Injected error in {name}", metadata)
+        return delay
+
+    def stats(self) -> Dict:
+        """Число вызовов и внедренных ошибок по методам"""
+        with self._lock:
+            return {
+                "calls": dict(self.calls),
+                "errors": dict(self.errors),
+                "total_calls": sum(self.calls.values()),
+            }
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.calls.clear()
+            self.errors.clear()
+
+    # --- Преобразование данных фикстуры в ответы API ---
+
+    def _instrument(self, info: Dict) -> SimpleNamespace:
+        return SimpleNamespace(
+            figi=info["figi"], uid=info.get("uid", ""), ticker=info["ticker"], name=info["name"],
+            currency=info["currency"], lot=info.get("lot", 1), class_code="TQBR",
+        )
+
+    def _not_found(self, name: str, identifier: str) -> RequestError:
+        metadata = SimpleNamespace(tracking_id="fake", message="Instrument not found",
+                                   ratelimit_limit=None, ratelimit_remaining=None, ratelimit_reset=None)
+        return RequestError(grpc.StatusCode.NOT_FOUND, f"{name}: {identifier} not found", metadata)
+
+    def _price(self, figi: str) -> Decimal:
+        return self.prices.get(figi, Decimal("0"))
+
+    def _position(self, info: Dict) -> SimpleNamespace:
+        currency = info.get("currency", "rub")
+        return SimpleNamespace(
+            figi=info["figi"],
+            instrument_type=info["instrument_type"],
+            quantity=_quotation(info["quantity"]),
+            average_position_price=_money(info.get("average_price", "0"), currency),
+            current_price=_money(self._price(info["figi"]), currency),
+            instrument_uid=self.instruments.get(info["figi"], {}).get("uid", ""),
+        )
+
+    def _operation(self, info: Dict) -> SimpleNamespace:
+        currency = info.get("currency", "rub")
+        return SimpleNamespace(
+            id=info["id"],
+            parent_operation_id=info.get("parent_operation_id", ""),
+            currency=currency,
+            payment=_money(info.get("payment", "0"), currency),
+            price=_money(info.get("price", "0"), currency),
+            state=OperationState.OPERATION_STATE_EXECUTED,
+            quantity=info.get("quantity", 0),
+            quantity_rest=0,
+            figi=info.get("figi", ""),
+            instrument_type=info.get("instrument_type", ""),
+            date=_parse_date(info["date"]),
+            type=info["operation_type"],
+            operation_type=OperationType[info["operation_type"]],
+            trades=[],
+        )
+
+    def order_book(self, figi: str, depth: int) -> SimpleNamespace:
+        """Синтетический стакан вокруг последней цены"""
+        price = self._price(figi)
+        if not price:
+            return SimpleNamespace(figi=figi, depth=depth, bids=[], asks=[])
+
+        step = price / 1000
+        return SimpleNamespace(
+            figi=figi,
+            depth=depth,
+            bids=[SimpleNamespace(price=_quotation(price - step * level), quantity=10 * (level + 1))
+                  for level in range(depth)],
+            asks=[SimpleNamespace(price=_quotation(price + step * (level + 1)), quantity=10 * (level + 1))
+                  for level in range(depth)],
+            last_price=_quotation(price),
+        )
+
+    def operations_between(self, account_id: str, from_: datetime, to: datetime) -> List[SimpleNamespace]:
+        dates = self._operation_dates.get(account_id, [])
+        start = bisect.bisect_left(dates, _aware(from_))
+        end = bisect.bisect_right(dates, _aware(to))
+        return [self._operation(operation) for operation in self.operations.get(account_id, [])[start:end]]
+
+
+class _UsersService:
+    def __init__(self, api: FakeInvestApi):
+        self.api = api
+
+    def get_accounts(self, **kwargs):
+        return SimpleNamespace(accounts=[SimpleNamespace(id=account["id"], name=account["name"])
+                                         for account in self.api.accounts])
+
+    def get_info(self, **kwargs):
+        return SimpleNamespace(prem_status=False, qual_status=False, qualified_for_work_with=[], tariff="investor")
+
+
+class _OperationsService:
+    def __init__(self, api: FakeInvestApi):
+        self.api = api
+
+    def get_portfolio(self, account_id: str, **kwargs):
+        if account_id not in self.api.portfolios:
+            raise self.api._not_found("get_portfolio", account_id)
+        return SimpleNamespace(positions=[self.api._position(item) for item in self.api.portfolios[account_id]])
+
+    def get_operations(self, account_id: str, from_: Optional[datetime] = None, to: Optional[datetime] = None,
+                       state=None, figi: str = "", **kwargs):
+        from_ = from_ or datetime(1970, 1, 1, tzinfo=timezone.utc)
+        to = to or datetime.now(timezone.utc)
+        operations = self.api.operations_between(account_id, from_, to)
+        if figi:
+            operations = [operation for operation in operations if operation.figi == figi]
+        return SimpleNamespace(operations=operations)
+
+
+class _InstrumentsService:
+    def __init__(self, api: FakeInvestApi):
+        self.api = api
+
+    def _listing(self, instrument_type: str):
+        return SimpleNamespace(instruments=[
+            self.api._instrument(info) for info in self.api.instruments.values() if info["type"] == instrument_type
+        ])
+
+    def shares(self, **kwargs):
+        return self._listing("share")
+
+    def bonds(self, **kwargs):
+        return self._listing("bond")
+
+    def etfs(self, **kwargs):
+        return self._listing("etf")
+
+    def _by(self, instrument_type: str, id: str):
+        info = self.api.instruments.get(id)
+        if info is None or info["type"] != instrument_type:
+            raise self.api._not_found(f"{instrument_type}_by", id)
+        return SimpleNamespace(instrument=self.api._instrument(info))
+
+    def share_by(self, id_type=None, class_code: str = "", id: str = "", **kwargs):
+        return self._by("share", id)
+
+    def bond_by(self, id_type=None, class_code: str = "", id: str = "", **kwargs):
+        return self._by("bond", id)
+
+    def etf_by(self, id_type=None, class_code: str = "", id: str = "", **kwargs):
+        return self._by("etf", id)
+
+
+class _MarketDataService:
+    def __init__(self, api: FakeInvestApi):
+        self.api = api
+
+    def get_last_prices(self, figi: Optional[List[str]] = None, **kwargs):
+        now = datetime.now(timezone.utc)
+        return SimpleNamespace(last_prices=[
+            SimpleNamespace(figi=item, price=_quotation(self.api.prices[item]), time=now)
+            for item in (figi or []) if item in self.api.prices
+        ])
+
+    def get_order_book(self, figi: str = "", depth: int = 1, **kwargs):
+        return self.api.order_book(figi, depth)
+
+
+class _StopOrdersService:
+    def __init__(self, api: FakeInvestApi):
+        self.api = api
+
+    def get_stop_orders(self, account_id: str, **kwargs):
+        stop_orders = []
+        for index, info in enumerate(self.api.stop_orders.get(account_id, [])):
+            direction = (StopOrderDirection.STOP_ORDER_DIRECTION_SELL if info.get("direction", "sell") == "sell"
+                         else StopOrderDirection.STOP_ORDER_DIRECTION_BUY)
+            stop_orders.append(SimpleNamespace(
+                stop_order_id=f"{account_id}-stop-{index}",
+                figi=info["figi"],
+                direction=direction,
+                currency=info.get("currency", "rub"),
+                stop_price=_money(info["stop_price"], info.get("currency", "rub")),
+            ))
+        return SimpleNamespace(stop_orders=stop_orders)
+
+
+class _MarketDataStreamService:
+    """Стрим последних цен: на каждую подписку отвечает ценами из фикстуры"""
+
+    def __init__(self, api: FakeInvestApi):
+        self.api = api
+
+    def market_data_stream(self, request_iterator):
+        responses = queue.Queue()
+        done = object()
+
+        def consume():
+            try:
+                for request in request_iterator:
+                    subscription = getattr(request, "subscribe_last_price_request", None)
+                    for instrument in getattr(subscription, "instruments", None) or []:
+                        if instrument.figi in self.api.prices:
+                            responses.put(SimpleNamespace(last_price=SimpleNamespace(
+                                figi=instrument.figi,
+                                price=_quotation(self.api.prices[instrument.figi]),
+                                time=datetime.now(timezone.utc),
+                            )))
+            finally:
+                responses.put(done)
+
+        threading.Thread(target=consume, daemon=True, name="fake-stream").start()
+        while True:
+            response = responses.get()
+            if response is done:
+                return
+            yield response
+
+
+_SERVICE_CLASSES = {
+    "users": _UsersService,
+    "operations": _OperationsService,
+    "instruments": _InstrumentsService,
+    "market_data": _MarketDataService,
+    "stop_orders": _StopOrdersService,
+    "market_data_stream": _MarketDataStreamService,
+}
+
+
+class _SyncService:
+    """Вызов метода сервиса с учетом, задержкой и внедрением ошибок"""
+
+    def __init__(self, api: FakeInvestApi, name: str, timeout: Optional[float] = None):
+        self._api = api
+        self._name = name
+        self._timeout = timeout
+        self._impl = _SERVICE_CLASSES[name](api)
+
+    def __getattr__(self, method_name: str):
+        method = getattr(self._impl, method_name)
+
+        def call(*args, **kwargs):
+            delay = self._api._before_call(f"{self._name}.{method_name}")
+            if self._timeout is not None and delay > self._timeout:
+                time.sleep(self._timeout)
+                raise RequestError(grpc.StatusCode.DEADLINE_EXCEEDED, f"Deadline exceeded in {method_name}", None)
+            if delay:
+                time.sleep(delay)
+            return method(*args, **kwargs)
+
+        return call
+
+
+class _AsyncService(_SyncService):
+    def __getattr__(self, method_name: str):
+        method = getattr(self._impl, method_name)
+
+        async def call(*args, **kwargs):
+            delay = self._api._before_call(f"{self._name}.{method_name}")
+            if delay:
+                await asyncio.sleep(delay)
+            return method(*args, **kwargs)
+
+        return call
+
+
+class FakeClient:
+    """Контекстный менеджер, совместимый с `with Client(token) as client`"""
+
+    service_class = _SyncService
+
+    def __init__(self, api: FakeInvestApi, timeout: Optional[float] = None):
+        self.api = api
+        self.timeout = timeout
+
+    def _services(self) -> SimpleNamespace:
+        return SimpleNamespace(**{name: self.service_class(self.api, name, self.timeout) for name in FAKE_SERVICES})
+
+    def __enter__(self):
+        return self._services()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+class FakeAsyncClient(FakeClient):
+    """Контекстный менеджер, совместимый с `async with AsyncClient(token) as client`"""
+
+    service_class = _AsyncService
+
+    async def __aenter__(self):
+        return self._services()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+def generate_fixture(accounts: int = 4, positions: int = 20, operations: int = 1000,
+                     seed: int = 42, days: int = 730) -> Dict:
+    """Синтетическая фикстура: accounts счетов по positions бумаг и operations операций"""
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    start = now - timedelta(days=days)
+
+    # Пул инструментов: в основном рублевые акции, немного облигаций, фондов и валютных бумаг
+    pool_size = max(positions * 2, 50)
+    instruments = []
+    prices = {USD_FIGI: "92.5", EUR_FIGI: "100.3", MOEX_FIGI: "3200.5"}
+    for index in range(pool_size):
+        instrument_type = rng.choices(["share", "bond", "etf"], weights=[70, 20, 10])[0]
+        currency = rng.choices(["rub", "usd", "eur"], weights=[85, 10, 5])[0]
+        figi = f"FAKE{index:08d}"
+        instruments.append({
+            "figi": figi,
+            "uid": f"fake-uid-{index}",
+            "ticker": f"FK{index:04d}",
+            "name": f"Fake {instrument_type} {index}",
+            "currency": currency,
+            "lot": rng.choice([1, 1, 10, 100]) if instrument_type == "share" else 1,
+            "type": instrument_type,
+        })
+        price = rng.uniform(90, 110) if instrument_type == "bond" else rng.uniform(5, 5000)
+        prices[figi] = f"{price:.2f}"
+
+    fixture = {"accounts": [], "instruments": instruments, "prices": prices,
+               "portfolios": {}, "stop_orders": {}, "operations": {}}
+
+    for account_index in range(accounts):
+        account_id = f"fake-account-{account_index + 1}"
+        fixture["accounts"].append({"id": account_id, "name": f"Портфель {account_index + 1}"})
+
+        held = rng.sample(instruments, min(positions, len(instruments)))
+        portfolio = [{
+            "figi": CASH_FIGIS["RUB"], "instrument_type": "currency",
+            "quantity": f"{rng.uniform(1000, 100000):.2f}", "average_price": "1", "currency": "rub",
+        }]
+        stop_orders = []
+        for info in held:
+            price = Decimal(prices[info["figi"]])
+            portfolio.append({
+                "figi": info["figi"],
+                "instrument_type": info["type"],
+                "quantity": str(rng.randint(1, 50) * info["lot"]),
+                "average_price": f"{price * Decimal(str(rng.uniform(0.7, 1.3))):.2f}",
+                "currency": info["currency"],
+            })
+            if rng.random() < 0.3:
+                stop_orders.append({"figi": info["figi"], "direction": "sell",
+                                    "stop_price": f"{price * Decimal('0.9'):.2f}", "currency": info["currency"]})
+
+        fixture["portfolios"][account_id] = portfolio
+        fixture["stop_orders"][account_id] = stop_orders
+        fixture["operations"][account_id] = _generate_operations(rng, account_id, held, prices, operations, start, now)
+
+    return fixture
+
+
+def _generate_operations(rng: random.Random, account_id: str, held: List[Dict], prices: Dict,
+                         count: int, start: datetime, end: datetime) -> List[Dict]:
+    """История операций: пополнения, сделки с комиссиями, дивиденды, купоны и выводы"""
+    span = (end - start).total_seconds()
+    operations = []
+    index = 0
+
+    def add(date: datetime, operation_type: str, payment: Decimal, parent: str = "", info: Optional[Dict] = None,
+            price: Decimal = Decimal("0"), quantity: int = 0) -> str:
+        nonlocal index
+        index += 1
+        operation_id = f"{account_id}-op-{index}"
+        operations.append({
+            "id": operation_id,
+            "parent_operation_id": parent,
+            "date": date.isoformat(),
+            "operation_type": operation_type,
+            "payment": f"{payment:.2f}",
+            "price": f"{price:.2f}",
+            "currency": info["currency"] if info else "rub",
+            "figi": info["figi"] if info else "",
+            "instrument_type": info["type"] if info else "",
+            "quantity": quantity,
+        })
+        return operation_id
+
+    add(start, "OPERATION_TYPE_INPUT", Decimal("1000000"))
+    while len(operations) < count:
+        date = start + timedelta(seconds=rng.uniform(0, span))
+        info = rng.choice(held) if held else None
+        kind = rng.random()
+        if info and kind < 0.8:
+            price = Decimal(prices[info["figi"]]) * Decimal(str(rng.uniform(0.8, 1.2)))
+            quantity = rng.randint(1, 20) * info["lot"]
+            is_buy = rng.random() < 0.6
+            amount = price * quantity
+            parent = add(date, "OPERATION_TYPE_BUY" if is_buy else "OPERATION_TYPE_SELL",
+                         -amount if is_buy else amount, info=info, price=price, quantity=quantity)
+            add(date, "OPERATION_TYPE_BROKER_FEE", -amount * Decimal("0.0005"), parent=parent, info=info)
+        elif info and kind < 0.9:
+            operation_type = "OPERATION_TYPE_COUPON" if info["type"] == "bond" else "OPERATION_TYPE_DIVIDEND"
+            add(date, operation_type, Decimal(str(rng.uniform(100, 5000))), info=info)
+        elif kind < 0.95:
+            add(date, "OPERATION_TYPE_SERVICE_FEE", -Decimal(str(rng.uniform(10, 300))))
+        elif kind < 0.98:
+            add(date, "OPERATION_TYPE_INPUT", Decimal(str(rng.uniform(1000, 100000))))
+        else:
+            add(date, "OPERATION_TYPE_OUTPUT", -Decimal(str(rng.uniform(1000, 50000))))
+
+    return operations[:count]
+
+
+def record_fixture(client, account_ids: Optional[List[str]] = None,
+                   start_date: datetime = datetime(2020, 1, 1, tzinfo=timezone.utc)) -> Dict:
+    """Запись фикстуры с реального API (client — сервисы `with Client(token)`)"""
+    accounts = client.users.get_accounts().accounts
+    if account_ids:
+        accounts = [account for account in accounts if account.id in account_ids]
+
+    fixture = {"accounts": [], "instruments": [], "prices": {},
+               "portfolios": {}, "stop_orders": {}, "operations": {}}
+    figis = {}
+
+    for account in accounts:
+        fixture["accounts"].append({"id": account.id, "name": account.name})
+
+        positions = client.operations.get_portfolio(account_id=account.id).positions
+        fixture["portfolios"][account.id] = [{
+            "figi": position.figi,
+            "instrument_type": position.instrument_type,
+            "quantity": _from_quotation(position.quantity),
+            "average_price": _from_quotation(position.average_position_price),
+            "currency": position.average_position_price.currency,
+        } for position in positions]
+
+        fixture["stop_orders"][account.id] = [{
+            "figi": order.figi,
+            "direction": "sell" if order.direction == StopOrderDirection.STOP_ORDER_DIRECTION_SELL else "buy",
+            "stop_price": _from_quotation(order.stop_price),
+            "currency": order.currency,
+        } for order in client.stop_orders.get_stop_orders(account_id=account.id).stop_orders]
+
+        operations = client.operations.get_operations(
+            account_id=account.id, from_=start_date, to=datetime.now(timezone.utc),
+            state=OperationState.OPERATION_STATE_EXECUTED
+        ).operations
+        fixture["operations"][account.id] = [{
+            "id": operation.id,
+            "parent_operation_id": operation.parent_operation_id,
+            "date": operation.date.isoformat(),
+            "operation_type": OperationType(operation.operation_type).name,
+            "payment": _from_quotation(operation.payment),
+            "price": _from_quotation(operation.price),
+            "currency": operation.currency,
+            "figi": operation.figi,
+            "instrument_type": operation.instrument_type,
+            "quantity": operation.quantity,
+        } for operation in operations]
+
+        for item in list(positions) + list(operations):
+            if item.instrument_type in ("share", "bond", "etf") and item.figi:
+                figis[item.figi] = item.instrument_type
+
+    # Справочник только по встретившимся бумагам
+    methods = {"share": client.instruments.share_by, "bond": client.instruments.bond_by,
+               "etf": client.instruments.etf_by}
+    for figi, instrument_type in figis.items():
+        try:
+            instrument = methods[instrument_type](id_type=1, id=figi).instrument
+        except RequestError as e:
+            logger.warning(f"Не удалось записать инструмент {figi}: {e}")
+            continue
+        fixture["instruments"].append({
+            "figi": instrument.figi, "uid": instrument.uid, "ticker": instrument.ticker, "name": instrument.name,
+            "currency": instrument.currency, "lot": instrument.lot, "type": instrument_type,
+        })
+
+    price_figis = list(figis) + [USD_FIGI, EUR_FIGI, MOEX_FIGI]
+    for price in client.market_data.get_last_prices(figi=price_figis).last_prices:
+        fixture["prices"][price.figi] = _from_quotation(price.price)
+
+    return fixture
+
+
+def save_fixture(fixture: Dict, path: str) -> None:
+    """Сохранение фикстуры в JSON файл"""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(fixture, f, ensure_ascii=False)
+
+
+def main():
+    """Генерация или запись фикстуры из командной строки"""
+    parser = argparse.ArgumentParser(description="Фикстуры для локального API Тинькофф")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    generate = subparsers.add_parser("generate", help="синтетическая фикстура")
+    generate.add_argument("--accounts", type=int, default=4)
+    generate.add_argument("--positions", type=int, default=20)
+    generate.add_argument("--operations", type=int, default=1000)
+    generate.add_argument("--seed", type=int, default=42)
+    generate.add_argument("-o", "--output", default="fake_api_fixture.json")
+
+    record = subparsers.add_parser("record", help="запись с реального API")
+    record.add_argument("--token", required=True)
+    record.add_argument("--account", action="append", dest="accounts")
+    record.add_argument("-o", "--output", default="fake_api_fixture.json")
+
+    args = parser.parse_args()
+    if args.command == "generate":
+        fixture = generate_fixture(args.accounts, args.positions, args.operations, args.seed)
+    else:
+        from tinkoff.invest import Client
+        with Client(args.token) as client:
+            fixture = record_fixture(client, args.accounts)
+
+    save_fixture(fixture, args.output)
+    print(f"Фикстура сохранена: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""Локальный справочник инструментов"""
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+from tinkoff.invest import InstrumentStatus, RequestError
+
+logger = logging.getLogger(__name__)
+
+INSTRUMENT_TYPES = ("share", "bond", "etf")
+
+# Пауза перед повторной загрузкой после неудачного обновления, секунды
+REFRESH_RETRY_INTERVAL = 300
+
+
+class InstrumentCatalog:
+    """Справочник акций, облигаций и фондов с индексами по FIGI и UID.
+
+    Загружается целиком через shares/bonds/etfs, хранится на диске и
+    обновляется в фоне по истечении TTL, поэтому при теплом кэше оценка
+    портфеля не делает ни одного запроса *_by. После неудачного
+    обновления повтор не раньше чем через retry_interval. Инструменты,
+    полученные запросом *_by, записываются на диск пакетом (flush).
+    """
+
+    def __init__(self, client_factory: Callable, cache_path: Optional[str] = None, ttl: int = 86400,
+                 retry_interval: float = REFRESH_RETRY_INTERVAL):
+        self.client_factory = client_factory
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.retry_interval = retry_interval
+        self._retry_at = 0.0  # после неудачного обновления
+        self._dirty = False  # есть несохраненные инструменты
+        self._by_figi: Dict[str, Dict] = {}
+        self._by_uid: Dict[str, Dict] = {}
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # запись файла: фоновое обновление и flush из других потоков
+        self._refresh_thread = None
+        self.metadata_requests = 0  # одиночные запросы *_by при промахе
+        self._load_from_disk()
+
+    def _load_from_disk(self) -> None:
+        """Загрузка справочника из файла"""
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return
+
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                cache_data = json.load(f)
+            self._set_instruments(cache_data.get('instruments', []), cache_data.get('loaded_at', 0.0))
+            logger.info(f"Справочник инструментов загружен с диска: {len(self._by_figi)} шт.")
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать справочник инструментов {self.cache_path}: {e}")
+
+    def _save_to_disk(self) -> None:
+        """Атомарное сохранение справочника в файл"""
+        if not self.cache_path:
+            return
+
+        # Снимок берется под блокировкой записи, поэтому более новый снимок не перезаписывается старым
+        with self._save_lock:
+            with self._lock:
+                cache_data = {
+                    'loaded_at': self._loaded_at,
+                    'instruments': list(self._by_figi.values()),
+                }
+                self._dirty = False
+
+            tmp_path = None
+            try:
+                directory = os.path.dirname(os.path.abspath(self.cache_path))
+                os.makedirs(directory, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".instruments_catalog.", suffix=".tmp")
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(cache_data, f, ensure_ascii=False)
+                os.replace(tmp_path, self.cache_path)
+            except Exception as e:
+                logger.warning(f"Не удалось сохранить справочник инструментов: {e}")
+                self._dirty = True
+                if tmp_path and os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    def _set_instruments(self, instruments: List[Dict], loaded_at: float) -> None:
+        """Замена индексов новым набором инструментов"""
+        by_figi = {}
+        by_uid = {}
+        for info in instruments:
+            by_figi[info['figi']] = info
+            if info.get('uid'):
+                by_uid[info['uid']] = info
+
+        with self._lock:
+            self._by_figi = by_figi
+            self._by_uid = by_uid
+            self._loaded_at = loaded_at
+
+    @staticmethod
+    def _instrument_to_dict(instrument, instrument_type: str) -> Dict:
+        """Сокращенное представление инструмента для справочника"""
+        return {
+            'figi': instrument.figi,
+            'uid': instrument.uid,
+            'ticker': instrument.ticker,
+            'name': instrument.name,
+            'currency': instrument.currency,
+            'lot': instrument.lot,
+            'type': instrument_type,
+        }
+
+    def refresh(self, client=None) -> None:
+        """Полная загрузка справочника через списочные методы API"""
+        if client is None:
+            with self.client_factory() as client:
+                return self.refresh(client)
+
+        start_time = time.time()
+        listings = {
+            'share': client.instruments.shares,
+            'bond': client.instruments.bonds,
+            'etf': client.instruments.etfs,
+        }
+
+        instruments = []
+        for instrument_type, listing in listings.items():
+            response = listing(instrument_status=InstrumentStatus.INSTRUMENT_STATUS_ALL)
+            instruments.extend(self._instrument_to_dict(item, instrument_type) for item in response.instruments)
+
+        self._set_instruments(instruments, time.time())
+        self._save_to_disk()
+        logger.info(f"Справочник инструментов обновлен: {len(instruments)} шт. за {time.time() - start_time:.1f} сек")
+
+    def is_stale(self) -> bool:
+        """Истек ли срок жизни справочника"""
+        return time.time() - self._loaded_at > self.ttl
+
+    def _refresh_failed(self, e: Exception) -> None:
+        """Отсрочка следующей попытки обновления"""
+        self._retry_at = time.time() + self.retry_interval
+        logger.warning(f"Не удалось загрузить справочник инструментов: {e}, "
+                       f"повтор не раньше чем через {self.retry_interval:.0f} сек")
+
+    def ensure_fresh(self, client=None) -> None:
+        """Синхронная загрузка пустого справочника или фоновое обновление устаревшего"""
+        if time.time() < self._retry_at:
+            return
+        if not self._by_figi:
+            try:
+                self.refresh(client)
+            except Exception as e:
+                self._refresh_failed(e)
+        elif self.is_stale():
+            self._start_background_refresh()
+
+    def _start_background_refresh(self) -> None:
+        """Запуск обновления в фоновом потоке (не более одного одновременно)"""
+        with self._lock:
+            if self._refresh_thread and self._refresh_thread.is_alive():
+                return
+            self._refresh_thread = threading.Thread(target=self._background_refresh, daemon=True)
+            self._refresh_thread.start()
+
+    def _background_refresh(self) -> None:
+        """Фоновое обновление справочника"""
+        try:
+            self.refresh()
+        except Exception as e:
+            self._refresh_failed(e)
+
+    def get(self, figi: str) -> Optional[Dict]:
+        """Поиск инструмента по FIGI без обращения к API"""
+        return self._by_figi.get(figi)
+
+    def get_by_uid(self, uid: str) -> Optional[Dict]:
+        """Поиск инструмента по UID без обращения к API"""
+        return self._by_uid.get(uid)
+
+    def lookup(self, figi: str, instrument_type: str, client=None) -> Optional[Dict]:
+        """Поиск инструмента с запросом *_by только при промахе справочника"""
+        self.ensure_fresh(client)
+
+        info = self.get(figi)
+        if info or instrument_type not in INSTRUMENT_TYPES:
+            return info
+
+        instrument = self._fetch_single(figi, instrument_type, client)
+        return self.remember(instrument, instrument_type) if instrument else None
+
+    def remember(self, instrument, instrument_type: str) -> Dict:
+        """Добавление инструмента, полученного одиночным запросом, в справочник
+
+        На диск записывается при flush() (после пакета поисков) или close().
+        """
+        info = self._instrument_to_dict(instrument, instrument_type)
+        with self._lock:
+            self._by_figi[info['figi']] = info
+            if info.get('uid'):
+                self._by_uid[info['uid']] = info
+            self._dirty = True
+        return info
+
+    def flush(self) -> None:
+        """Запись добавленных инструментов на диск (если они есть)"""
+        if self._dirty:
+            self._save_to_disk()
+
+    def close(self) -> None:
+        """Сохранение несохраненных инструментов при остановке"""
+        self.flush()
+
+    def _fetch_single(self, figi: str, instrument_type: str, client=None):
+        """Одиночный запрос инструмента по FIGI"""
+        if client is None:
+            with self.client_factory() as client:
+                return self._fetch_single(figi, instrument_type, client)
+
+        self.metadata_requests += 1
+        try:
+            if instrument_type == "share":
+                instrument_response = client.instruments.share_by(id_type=1, id=figi)
+            elif instrument_type == "bond":
+                instrument_response = client.instruments.bond_by(id_type=1, id=figi)
+            else:
+                instrument_response = client.instruments.etf_by(id_type=1, id=figi)
+            return instrument_response.instrument
+        except RequestError as e:
+            logger.warning(f"Не удалось получить информацию об инструменте {figi}: {e}")
+            return None
@@ -0,0 +1,153 @@
+"""Подписка на последние цены через стрим рыночных данных"""
+import logging
+import queue
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from tinkoff.invest import (
+    Client,
+    LastPriceInstrument,
+    MarketDataRequest,
+    SubscribeLastPriceRequest,
+    SubscriptionAction,
+)
+from .channel_manager import ChannelManager
+from .money import Money
+from .price_table import CURRENCY_FIGIS, MOEX_FIGI
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class LastPriceStream:
+    """Фоновый подписчик на последние цены с потокобезопасной таблицей.
+
+    Подписывается на FIGI из figis_provider (позиции настроенных счетов)
+    плюс USD, EUR и MOEX, периодически обновляет подписку и
+    переподключается при обрыве стрима. Расчеты читают цены через
+    get_fresh() и опрашивают API только по устаревшим инструментам.
+    Стрим держит отдельный канал, чтобы его обрывы не сбрасывали общий.
+    """
+
+    def __init__(self, token: str, figis_provider: Callable[[], Iterable[str]],
+                 client_factory: Callable = Client, resubscribe_interval: int = 900,
+                 reconnect_delay: int = 5):
+        self.token = token
+        self.client_factory = client_factory
+        self.figis_provider = figis_provider
+        self.resubscribe_interval = resubscribe_interval
+        self.reconnect_delay = reconnect_delay
+
+        self._prices: Dict[str, Tuple[Money, float]] = {}
+        self._subscribed: set = set()
+        self._lock = threading.Lock()
+        self._requests: queue.Queue = queue.Queue()
+        self._running = False
+        self._thread = None
+        self._refresh_thread = None
+
+    def start(self) -> None:
+        """Запуск подписки в фоновом потоке"""
+        if self._running:
+            return
+
+        self._running = True
+        self._thread = threading.Thread(target=self._stream_loop, daemon=True, name="price-stream")
+        self._thread.start()
+        self._refresh_thread = threading.Thread(target=self._refresh_loop, daemon=True, name="price-stream-refresh")
+        self._refresh_thread.start()
+        logger.info("Стрим последних цен запущен")
+
+    def stop(self) -> None:
+        """Остановка подписки"""
+        self._running = False
+        self._requests.put(_STOP)
+        if self._thread:
+            self._thread.join(timeout=5)
+        logger.info("Стрим последних цен остановлен")
+
+    def _target_figis(self) -> List[str]:
+        """Инструменты для подписки: позиции счетов, валюты и бенчмарк"""
+        figis = list(CURRENCY_FIGIS.values()) + [MOEX_FIGI]
+        try:
+            figis.extend(self.figis_provider())
+        except Exception as e:
+            logger.warning(f"Не удалось получить список инструментов для стрима: {e}")
+        return list(dict.fromkeys(figis))
+
+    @staticmethod
+    def _subscribe_request(figis: List[str]) -> MarketDataRequest:
+        """Запрос подписки на последние цены"""
+        return MarketDataRequest(
+            subscribe_last_price_request=SubscribeLastPriceRequest(
+                subscription_action=SubscriptionAction.SUBSCRIPTION_ACTION_SUBSCRIBE,
+                instruments=[LastPriceInstrument(figi=figi) for figi in figis],
+            )
+        )
+
+    def _request_iterator(self, initial: List[str], requests: queue.Queue):
+        """Генератор запросов стрима: начальная подписка, затем дозапросы из очереди соединения"""
+        yield self._subscribe_request(initial)
+        while self._running:
+            request = requests.get()
+            if request is _STOP:
+                return
+            yield request
+
+    def _refresh_loop(self) -> None:
+        """Периодическая дописка новых инструментов (например, после покупок)"""
+        while self._running:
+            time.sleep(self.resubscribe_interval)
+            new_figis = [figi for figi in self._target_figis() if figi not in self._subscribed]
+            if new_figis:
+                logger.info(f"Стрим цен: подписка на {len(new_figis)} новых инструментов")
+                self._subscribed.update(new_figis)
+                self._requests.put(self._subscribe_request(new_figis))
+
+    def _stream_loop(self) -> None:
+        """Основной цикл стрима с переподключением"""
+        while self._running:
+            try:
+                figis = self._target_figis()
+                self._subscribed = set(figis)
+                # Очередь дозапросов относится к предыдущему соединению:
+                # его генератор запросов завершается, а не ждет вечно
+                self._requests.put(_STOP)
+                self._requests = queue.Queue()
+
+                with self.client_factory(self.token, options=ChannelManager.KEEPALIVE_OPTIONS) as client:
+                    stream = client.market_data_stream.market_data_stream(self._request_iterator(figis, self._requests))
+                    for marketdata in stream:
+                        if not self._running:
+                            break
+                        last_price = marketdata.last_price
+                        if last_price:
+                            self.update({last_price.figi: Money.from_quotation(last_price.price)})
+
+            except Exception as e:
+                if self._running:
+                    logger.warning(f"Стрим цен прерван, переподключение через {self.reconnect_delay} сек: {e}")
+                    time.sleep(self.reconnect_delay)
+
+    def update(self, prices: Dict[str, Money]) -> None:
+        """Запись цен в таблицу (из стрима или после опроса API)"""
+        now = time.time()
+        with self._lock:
+            for figi, price in prices.items():
+                self._prices[figi] = (price, now)
+
+    def get_fresh(self, figis: Iterable[str], max_age: float) -> Dict[str, Money]:
+        """Цены, обновленные не позднее max_age секунд назад"""
+        threshold = time.time() - max_age
+        with self._lock:
+            return {
+                figi: self._prices[figi][0]
+                for figi in figis
+                if figi in self._prices and self._prices[figi][1] >= threshold
+            }
+
+    def get(self, figi: str) -> Optional[Tuple[Money, float]]:
+        """Цена и время ее получения"""
+        with self._lock:
+            return self._prices.get(figi)
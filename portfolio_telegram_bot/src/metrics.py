@@ -0,0 +1,245 @@
+"""Метрики и трассировка этапов"""
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм задержек, секунды
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _key(name: str, labels: Dict[str, str]) -> LabelKey:
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+class Histogram:
+    """Гистограмма задержек с фиксированными корзинами"""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последняя корзина — +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value: float) -> None:
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, percent: float) -> Optional[float]:
+        """Оценка перцентиля по верхней границе корзины"""
+        if not self.count:
+            return None
+        rank = self.count * percent / 100
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+        return self.max
+
+    def to_dict(self) -> Dict:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "min": self.min,
+            "max": self.max,
+            "avg": round(self.sum / self.count, 6) if self.count else None,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+        }
+
+
+class Span:
+    """Замер одного этапа; elapsed доступен после выхода из контекста"""
+
+    def __init__(self, name: str, labels: Dict[str, str]):
+        self.name = name
+        self.labels = labels
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+        self.error = None
+
+
+class MetricsRegistry:
+    """Потокобезопасный реестр счетчиков и гистограмм"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[LabelKey, float] = {}
+        self._histograms: Dict[LabelKey, Histogram] = {}
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        """Увеличение счетчика"""
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """Добавление значения в гистограмму"""
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def span(self, name: str, **labels):
+        """Замер длительности блока: гистограмма {name}_seconds и счетчики вызовов и ошибок"""
+        span = Span(name, labels)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = e
+            self.inc(f"{name}_errors_total", **labels)
+            raise
+        finally:
+            span.elapsed = time.perf_counter() - span.started
+            self.observe(f"{name}_seconds", span.elapsed, **labels)
+            self.inc(f"{name}_total", **labels)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def snapshot(self) -> Dict:
+        """Текущие значения всех метрик"""
+        with self._lock:
+            counters = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self._counters.items())
+            ]
+            histograms = [
+                {"name": name, "labels": dict(labels), **histogram.to_dict()}
+                for (name, labels), histogram in sorted(self._histograms.items())
+            ]
+        return {"updated_at": datetime.now().isoformat(), "counters": counters, "histograms": histograms}
+
+    def render_prometheus(self) -> str:
+        """Метрики в текстовом формате Prometheus"""
+        def labels_text(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+        lines: List[str] = []
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                lines.append(f"{name}{labels_text(labels)} {value}")
+
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, count in zip(list(histogram.buckets) + ["+Inf"], histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{labels_text(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_sum{labels_text(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{labels_text(labels)} {histogram.count}")
+
+        return "\n".join(lines) + "\n"
+
+
+# Общий реестр процесса
+REGISTRY = MetricsRegistry()
+
+
+def span(name: str, **labels):
+    """Замер этапа в общем реестре"""
+    return REGISTRY.span(name, **labels)
+
+
+class MetricsExporter:
+    """Выгрузка метрик: периодическая запись JSON файла и/или локальный HTTP (/metrics, /metrics.json)"""
+
+    def __init__(self, registry: MetricsRegistry = REGISTRY, file_path: Optional[str] = None,
+                 flush_interval: int = 60, port: int = 0, host: str = "127.0.0.1"):
+        self.registry = registry
+        self.file_path = file_path
+        self.flush_interval = flush_interval
+        self.port = port
+        self.host = host
+        self._stop = threading.Event()
+        self._flush_thread = None
+        self._server = None
+
+    def start(self) -> None:
+        """Запуск фоновой выгрузки"""
+        if self.file_path:
+            self._flush_thread = threading.Thread(target=self._flush_loop, daemon=True, name="metrics-flush")
+            self._flush_thread.start()
+            logger.info(f"Метрики записываются в {self.file_path} каждые {self.flush_interval} сек")
+
+        if self.port:
+            registry = self.registry
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path == "/metrics":
+                        body = registry.render_prometheus().encode("utf-8")
+                        content_type = "text/plain; version=0.0.4"
+                    elif self.path == "/metrics.json":
+                        body = json.dumps(registry.snapshot(), ensure_ascii=False).encode("utf-8")
+                        content_type = "application/json"
+                    else:
+                        self.send_error(404)
+                        return
+                    self.send_response(200)
+                    self.send_header("Content-Type", content_type)
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    pass
+
+            self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+            threading.Thread(target=self._server.serve_forever, daemon=True, name="metrics-http").start()
+            logger.info(f"Метрики доступны на http://{self.host}:{self.port}/metrics")
+
+    def flush(self) -> None:
+        """Атомарная запись снимка метрик в файл"""
+        if not self.file_path:
+            return
+        try:
+            directory = os.path.dirname(self.file_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.file_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.registry.snapshot(), f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.file_path)
+        except Exception as e:
+            logger.warning(f"Не удалось записать метрики: {e}")
+
+    def _flush_loop(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def stop(self) -> None:
+        """Остановка выгрузки с финальной записью"""
+        self._stop.set()
+        self.flush()
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
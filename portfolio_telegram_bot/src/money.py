@@ -0,0 +1,177 @@
+"""Денежные суммы и котировки с фиксированной точкой"""
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Optional, Union
+
+# Нано-единиц в одной единице (точность Quotation/MoneyValue в API)
+NANO = 1_000_000_000
+_HALF_NANO = NANO // 2
+
+
+def to_nano(value) -> int:
+    """Quotation/MoneyValue в целое число нано-единиц (None — ноль)"""
+    if value is None:
+        return 0
+    return value.units * NANO + value.nano
+
+
+def _div_round(numerator: int, denominator: int) -> int:
+    """Целочисленное деление с округлением половины от нуля"""
+    quotient, remainder = divmod(abs(numerator), abs(denominator))
+    if remainder * 2 >= abs(denominator):
+        quotient += 1
+    return quotient if (numerator >= 0) == (denominator > 0) else -quotient
+
+
+class Money:
+    """Сумма, цена или количество в целых нано-единицах (units * 10^9 + nano).
+
+    Сложение и умножение выполняются точно в целых числах, произведение
+    двух значений округляется до нано. В float значение переводится
+    только для отчетов и графиков.
+    """
+
+    __slots__ = ("nano",)
+
+    def __init__(self, nano: int = 0):
+        self.nano = nano
+
+    @classmethod
+    def from_quotation(cls, value) -> "Money":
+        """Из Quotation/MoneyValue"""
+        if value is None:
+            return cls(0)
+        return cls(value.units * NANO + value.nano)
+
+    @classmethod
+    def from_number(cls, value: Union[int, float, str, Decimal, "Money"]) -> "Money":
+        """Из числа, строки или Decimal (float переводится через его строковое представление)"""
+        if isinstance(value, Money):
+            return value
+        if isinstance(value, int):
+            return cls(value * NANO)
+        nano = (Decimal(str(value)) * NANO).to_integral_value(rounding=ROUND_HALF_UP)
+        return cls(int(nano))
+
+    @property
+    def units(self) -> int:
+        """Целая часть (как в Quotation.units)"""
+        units = abs(self.nano) // NANO
+        return units if self.nano >= 0 else -units
+
+    @property
+    def fraction(self) -> int:
+        """Дробная часть в нано (как в Quotation.nano, со знаком целой части)"""
+        return self.nano - self.units * NANO
+
+    def to_decimal(self) -> Decimal:
+        return Decimal(self.nano).scaleb(-9)
+
+    def ratio(self, other: "Money") -> Optional[float]:
+        """Отношение двух сумм для процентов (None при нулевом делителе)"""
+        other_nano = _nano(other)
+        return self.nano / other_nano if other_nano else None
+
+    def __float__(self) -> float:
+        return self.nano / NANO
+
+    def __int__(self) -> int:
+        return self.units
+
+    def __bool__(self) -> bool:
+        return self.nano != 0
+
+    def __add__(self, other) -> "Money":
+        if type(other) is Money:
+            return Money(self.nano + other.nano)
+        if isinstance(other, int):
+            return Money(self.nano + other * NANO)
+        return NotImplemented
+
+    __radd__ = __add__  # sum() начинает с 0
+
+    def __sub__(self, other) -> "Money":
+        if type(other) is Money:
+            return Money(self.nano - other.nano)
+        if isinstance(other, int):
+            return Money(self.nano - other * NANO)
+        return NotImplemented
+
+    def __rsub__(self, other) -> "Money":
+        if isinstance(other, int):
+            return Money(other * NANO - self.nano)
+        return NotImplemented
+
+    def __mul__(self, other) -> "Money":
+        if type(other) is Money:
+            product = self.nano * other.nano
+            if product >= 0:
+                return Money((product + _HALF_NANO) // NANO)
+            return Money(-((_HALF_NANO - product) // NANO))
+        if isinstance(other, int):
+            return Money(self.nano * other)
+        return NotImplemented
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other) -> "Money":
+        if type(other) is Money:
+            return Money(_div_round(self.nano * NANO, other.nano))
+        if isinstance(other, int):
+            return Money(_div_round(self.nano, other))
+        return NotImplemented
+
+    def __neg__(self) -> "Money":
+        return Money(-self.nano)
+
+    def __abs__(self) -> "Money":
+        return Money(abs(self.nano))
+
+    def __eq__(self, other) -> bool:
+        if type(other) is Money:
+            return self.nano == other.nano
+        if isinstance(other, int):
+            return self.nano == other * NANO
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash(self.nano)
+
+    def __lt__(self, other) -> bool:
+        return self.nano < _nano(other)
+
+    def __le__(self, other) -> bool:
+        return self.nano <= _nano(other)
+
+    def __gt__(self, other) -> bool:
+        return self.nano > _nano(other)
+
+    def __ge__(self, other) -> bool:
+        return self.nano >= _nano(other)
+
+    def __str__(self) -> str:
+        sign = "-" if self.nano < 0 else ""
+        units, fraction = divmod(abs(self.nano), NANO)
+        if not fraction:
+            return f"{sign}{units}"
+        return f"{sign}{units}.{fraction:09d}".rstrip("0")
+
+    def __repr__(self) -> str:
+        return f"Money('{self}')"
+
+    def __format__(self, format_spec: str) -> str:
+        if not format_spec:
+            return str(self)
+        return format(float(self), format_spec)
+
+
+ZERO = Money(0)
+ONE = Money(NANO)
+
+
+def _nano(value) -> int:
+    """Значение в нано для сравнения с Money"""
+    if type(value) is Money:
+        return value.nano
+    if isinstance(value, int):
+        return value * NANO
+    return Money.from_number(value).nano
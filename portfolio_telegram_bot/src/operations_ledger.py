@@ -0,0 +1,184 @@
+"""Локальный журнал операций по счетам"""
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Dict, List, Optional
+from tinkoff.invest.schemas import OperationState
+from .money import NANO, to_nano
+
+logger = logging.getLogger(__name__)
+
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def _format_date(value: datetime) -> str:
+    """Дата операции в UTC в сортируемом строковом виде"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).strftime(DATE_FORMAT)
+
+
+def _parse_date(value: str) -> datetime:
+    """Обратное преобразование сохраненной даты"""
+    return datetime.strptime(value, DATE_FORMAT).replace(tzinfo=timezone.utc)
+
+
+class OperationsLedger:
+    """Журнал исполненных операций в SQLite с курсором синхронизации.
+
+    Каждый запуск догружает только операции после последней
+    синхронизации (с небольшим перекрытием), а агрегаты для P&L
+    считаются по локальной базе.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS operations (
+            account_id TEXT NOT NULL,
+            id TEXT NOT NULL,
+            parent_operation_id TEXT,
+            date TEXT NOT NULL,
+            operation_type INTEGER NOT NULL,
+            payment_nano INTEGER NOT NULL,
+            price_nano INTEGER NOT NULL,
+            currency TEXT,
+            figi TEXT,
+            instrument_type TEXT,
+            quantity INTEGER NOT NULL,
+            PRIMARY KEY (account_id, id)
+        );
+        CREATE INDEX IF NOT EXISTS operations_by_date ON operations (account_id, date);
+        CREATE INDEX IF NOT EXISTS operations_by_parent ON operations (account_id, parent_operation_id);
+        CREATE TABLE IF NOT EXISTS sync_state (
+            account_id TEXT PRIMARY KEY,
+            synced_to TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, db_path: str = ":memory:", start_date: datetime = datetime(2020, 1, 1),
+                 overlap: timedelta = timedelta(days=1)):
+        self.db_path = db_path
+        self.start_date = start_date.replace(tzinfo=timezone.utc) if start_date.tzinfo is None else start_date
+        self.overlap = overlap  # перекрытие на случай поздно исполненных операций
+
+        directory = os.path.dirname(db_path) if db_path != ":memory:" else ""
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.executescript(self.SCHEMA)
+
+    def get_synced_to(self, account_id: str) -> Optional[datetime]:
+        """Момент, до которого журнал синхронизирован"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT synced_to FROM sync_state WHERE account_id = ?", (account_id,)
+            ).fetchone()
+        return _parse_date(row[0]) if row else None
+
+    def sync(self, client, account_id: str) -> int:
+        """Догрузка новых исполненных операций, возвращает число полученных записей"""
+        synced_to = self.get_synced_to(account_id)
+        from_date = synced_to - self.overlap if synced_to else self.start_date
+        to_date = datetime.now(timezone.utc)
+
+        operations_response = client.operations.get_operations(
+            account_id=account_id,
+            from_=from_date,
+            to=to_date,
+            state=OperationState.OPERATION_STATE_EXECUTED
+        )
+
+        rows = [
+            (
+                account_id,
+                operation.id,
+                operation.parent_operation_id or None,
+                _format_date(operation.date),
+                int(operation.operation_type),
+                to_nano(operation.payment),
+                to_nano(operation.price),
+                operation.currency,
+                operation.figi,
+                operation.instrument_type,
+                operation.quantity,
+            )
+            for operation in operations_response.operations
+        ]
+
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO operations VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sync_state VALUES (?, ?)", (account_id, _format_date(to_date))
+            )
+
+        logger.info(f"Журнал операций {account_id}: получено {len(rows)} операций с {from_date:%d.%m.%Y}")
+        return len(rows)
+
+    def get_payment_totals(self, account_id: str) -> Dict[int, Dict[str, Decimal]]:
+        """Суммы платежей по типам операций: {тип: {"sum": ..., "abs_sum": ...}}"""
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT operation_type, SUM(payment_nano), SUM(ABS(payment_nano))
+                FROM operations WHERE account_id = ? GROUP BY operation_type
+                """,
+                (account_id,)
+            ).fetchall()
+
+        return {
+            operation_type: {
+                "sum": Decimal(total) / NANO,
+                "abs_sum": Decimal(abs_total) / NANO,
+            }
+            for operation_type, total, abs_total in rows
+        }
+
+    def get_operations(self, account_id: str, since: Optional[datetime] = None,
+                       operation_types: Optional[List[int]] = None) -> List[Dict]:
+        """Операции из журнала (новые первыми) с суммой дочерних комиссий"""
+        query = """
+            SELECT o.id, o.date, o.operation_type, o.payment_nano, o.price_nano, o.currency,
+                   o.figi, o.instrument_type, o.quantity,
+                   (SELECT COALESCE(SUM(ABS(c.payment_nano)), 0) FROM operations c
+                    WHERE c.account_id = o.account_id AND c.parent_operation_id = o.id)
+            FROM operations o WHERE o.account_id = ?
+        """
+        params = [account_id]
+        if since is not None:
+            query += " AND o.date >= ?"
+            params.append(_format_date(since))
+        if operation_types:
+            query += f" AND o.operation_type IN ({', '.join('?' for _ in operation_types)})"
+            params.extend(int(operation_type) for operation_type in operation_types)
+        query += " ORDER BY o.date DESC"
+
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+
+        return [
+            {
+                "id": row[0],
+                "date": _parse_date(row[1]),
+                "operation_type": row[2],
+                "payment": Decimal(row[3]) / NANO,
+                "price": Decimal(row[4]) / NANO,
+                "currency": row[5],
+                "figi": row[6],
+                "instrument_type": row[7],
+                "quantity": row[8],
+                "commission": Decimal(row[9]) / NANO,
+            }
+            for row in rows
+        ]
+
+    def close(self) -> None:
+        """Закрытие базы"""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,101 @@
+"""Оценка позиций по биржевому стакану"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+from .money import ZERO, Money
+
+logger = logging.getLogger(__name__)
+
+# Методы оценки: последняя сделка, лучший бид, середина спреда, продажа в стакан
+PRICING_POLICIES = ("last", "bid", "mid", "liquidation")
+
+# Максимальная глубина стакана в API
+MAX_ORDER_BOOK_DEPTH = 50
+
+
+def _best_bid(order_book) -> Optional[Money]:
+    """Лучшая цена покупки"""
+    return Money.from_quotation(order_book.bids[0].price) if order_book.bids else None
+
+
+def _mid_price(order_book) -> Optional[Money]:
+    """Середина спреда (или доступная сторона стакана)"""
+    bid = _best_bid(order_book)
+    ask = Money.from_quotation(order_book.asks[0].price) if order_book.asks else None
+    if bid is not None and ask is not None:
+        return (bid + ask) / 2
+    return bid if bid is not None else ask
+
+
+def _liquidation_price(order_book, quantity: Money, lot: int) -> Optional[Money]:
+    """Средняя цена продажи всей позиции в биды стакана.
+
+    Объем уровней в стакане указан в лотах. Если глубины не хватает,
+    остаток оценивается по самому глубокому биду.
+    """
+    if not order_book.bids:
+        return None
+
+    remaining = quantity
+    proceeds = ZERO
+    price = None
+    for level in order_book.bids:
+        price = Money.from_quotation(level.price)
+        filled = min(remaining, Money.from_number(level.quantity * lot))
+        proceeds += filled * price
+        remaining -= filled
+        if remaining <= 0:
+            break
+
+    if remaining > 0:
+        proceeds += remaining * price
+
+    return proceeds / quantity
+
+
+class OrderBookPricer:
+    """Параллельная загрузка стаканов и оценка позиций по выбранному методу.
+
+    Запросы GetOrderBook выполняются в пуле из max_workers потоков на одном
+    клиенте API. Метод "last" стаканы не запрашивает.
+    """
+
+    def __init__(self, policy: str = "bid", depth: int = 20, max_workers: int = 8):
+        if policy not in PRICING_POLICIES:
+            raise ValueError(f"Неизвестный метод оценки: {policy} (доступны: {', '.join(PRICING_POLICIES)})")
+
+        self.policy = policy
+        self.depth = min(depth, MAX_ORDER_BOOK_DEPTH) if policy == "liquidation" else 1
+        self.max_workers = max_workers
+
+    def _price(self, client, figi: str, quantity: Money, lot: int) -> Optional[Money]:
+        """Цена одной позиции по стакану"""
+        order_book = client.market_data.get_order_book(figi=figi, depth=self.depth)
+        if self.policy == "bid":
+            return _best_bid(order_book)
+        if self.policy == "mid":
+            return _mid_price(order_book)
+        return _liquidation_price(order_book, quantity, lot)
+
+    def fetch_prices(self, client, positions: Dict[str, Dict]) -> Dict[str, Money]:
+        """Цены по стакану для позиций {figi: {"quantity": Money, "lot": int}}
+
+        В результат попадают только инструменты с непустым стаканом, для
+        остальных вызывающий код использует цену последней сделки.
+        """
+        if self.policy == "last" or not positions:
+            return {}
+
+        def price_position(item):
+            figi, position = item
+            try:
+                return figi, self._price(client, figi, position["quantity"], position.get("lot") or 1)
+            except Exception as e:
+                logger.warning(f"Не удалось получить стакан {figi}: {e}")
+                return figi, None
+
+        workers = max(1, min(self.max_workers, len(positions)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(price_position, positions.items())
+
+        return {figi: price for figi, price in results if price is not None}
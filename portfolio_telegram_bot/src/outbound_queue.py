@@ -0,0 +1,126 @@
+"""Очередь исходящих сообщений Telegram"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, Optional
+from .metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+
+class OutboundQueue:
+    """Исходящие сообщения с отдельным потоком отправки.
+
+    put() возвращается сразу, отправка (с ожиданием лимитов Telegram и
+    retry_after) идет в потоке очереди. Сообщения отправляются одним
+    потоком в порядке постановки, поэтому порядок сообщений в каждом
+    чате сохраняется. put() возвращает Future с результатом отправки,
+    flush() ждет отправки всего поставленного.
+    """
+
+    def __init__(self, deliver: Callable[[Dict], bool], max_size: int = 1000):
+        self.deliver = deliver
+        self._queue: queue.Queue = queue.Queue(maxsize=max_size)
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._worker, name="telegram-sender", daemon=True)
+        self._thread.start()
+        logger.info("Очередь исходящих сообщений запущена")
+
+    def put(self, item: Dict) -> Optional[Future]:
+        """Постановка сообщения в очередь
+
+        Возвращает Future, который получает результат отправки (True/False),
+        или None, если очередь переполнена.
+        """
+        item["enqueued"] = time.monotonic()
+        item["result"] = Future()
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            REGISTRY.inc("telegram_queue_dropped_total", kind=item.get("kind", ""))
+            logger.error(f"Очередь исходящих сообщений переполнена, сообщение отброшено ({item.get('kind')})")
+            return None
+        REGISTRY.inc("telegram_queue_enqueued_total", kind=item.get("kind", ""))
+        return item["result"]
+
+    def _worker(self) -> None:
+        while not self._stopping.is_set():
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                kind = item.get("kind", "")
+                REGISTRY.observe("telegram_queue_wait_seconds", time.monotonic() - item["enqueued"], kind=kind)
+                delivered = self.deliver(item)
+                if not delivered:
+                    REGISTRY.inc("telegram_queue_failed_total", kind=kind)
+                item["result"].set_result(bool(delivered))
+            except Exception as e:
+                logger.error(f"Ошибка отправки из очереди: {e}")
+                if not item["result"].done():
+                    item["result"].set_result(False)
+            finally:
+                self._queue.task_done()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Ожидание отправки всех сообщений (False по таймауту)"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def stop(self, timeout: float = 30) -> None:
+        """Отправка оставшихся сообщений и остановка потока
+
+        Если за timeout очередь не опустела, поток останавливается после
+        текущего сообщения, а неотправленные сообщения отбрасываются.
+        """
+        if not self.running:
+            return
+        if not self.flush(timeout):
+            logger.warning(f"Не все сообщения отправлены за {timeout} сек")
+        # Поток завершается после текущего сообщения; None будит ожидающий get()
+        self._stopping.set()
+        try:
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass
+        self._thread.join(timeout=5)
+        self._thread = None
+        self._drop_pending()
+        logger.info("Очередь исходящих сообщений остановлена")
+
+    def _drop_pending(self) -> None:
+        """Отбрасывание неотправленных сообщений (ожидающие получают False)"""
+        dropped = 0
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                dropped += 1
+                REGISTRY.inc("telegram_queue_dropped_total", kind=item.get("kind", ""))
+                item["result"].set_result(False)
+            self._queue.task_done()
+        if dropped:
+            logger.error(f"При остановке отброшено неотправленных сообщений: {dropped}")
+
+    def __len__(self) -> int:
+        return self._queue.qsize()
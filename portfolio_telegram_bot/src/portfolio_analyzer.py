@@ -1,108 +1,124 @@
 """Анализ отдельного портфеля"""
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from decimal import Decimal
-from typing import Dict, List
-from tinkoff.invest import Client, RequestError
-from tinkoff.invest.schemas import OperationState, OperationType
+from typing import Dict, List, Optional
+from tinkoff.invest import RequestError
+from tinkoff.invest.schemas import OperationType
+from .operations_ledger import OperationsLedger
 from .tinkoff_client import TinkoffClient
 
 logger = logging.getLogger(__name__)
 
+class PortfolioSnapshot:
+    """Оценка портфеля, выполняемая один раз на отчет"""
+    
+    def __init__(self, tinkoff_client: TinkoffClient, account_id: str):
+        self.client = tinkoff_client
+        self.account_id = account_id
+        self._data = None
+    
+    @property
+    def data(self) -> Dict:
+        """Данные портфеля (запрашиваются при первом обращении)"""
+        if self._data is None:
+            self._data = self.client.get_portfolio_data(self.account_id)
+        return self._data
+
 class PortfolioAnalyzer:
-    def __init__(self, tinkoff_client: TinkoffClient):
+    def __init__(self, tinkoff_client: TinkoffClient, ledger: Optional[OperationsLedger] = None):
         self.client = tinkoff_client
+        self.ledger = ledger or OperationsLedger()
+    
+    def _sync_ledger(self, account_id: str) -> None:
+        """Догрузка новых операций; при сбое используются уже сохраненные"""
+        try:
+            with self.client.services() as client:
+                self.ledger.sync(client, account_id)
+        except RequestError as e:
+            if self.ledger.get_synced_to(account_id) is None:
+                raise
+            logger.warning(f"Журнал операций {account_id} не обновлен, используются сохраненные данные: {e}")
     
     def generate_portfolio_report(self, account_id: str) -> Dict:
         """Генерация отчета по портфелю"""
+        channels_before = self.client.get_channel_stats()["channels_opened"]
         try:
-            # Получаем базовые данные портфеля
-            portfolio_data = self.client.get_portfolio_data(account_id)
+            # Получаем базовые данные портфеля (одна оценка на весь отчет)
+            snapshot = PortfolioSnapshot(self.client, account_id)
+            portfolio_data = snapshot.data
             
             # Добавляем дополнительную аналитику
             portfolio_data["analysis"] = {
-                "total_pnl_from_inception": self.calculate_total_pnl_from_inception(account_id),
-                "positions_near_stop_loss": self.get_positions_near_stop_loss(account_id),
+                "total_pnl_from_inception": self.calculate_total_pnl_from_inception(account_id, snapshot),
+                "positions_near_stop_loss": self.get_positions_near_stop_loss(account_id, snapshot=snapshot),
                 "best_position": self._get_best_position(portfolio_data["positions"]),
                 "worst_position": self._get_worst_position(portfolio_data["positions"]),
             }
             
+            channels_opened = self.client.get_channel_stats()["channels_opened"] - channels_before
+            logger.info(f"Отчет по портфелю {account_id}: открыто gRPC-каналов: {channels_opened}")
+            
             return portfolio_data
             
         except Exception as e:
             logger.error(f"Ошибка генерации отчета по портфелю {account_id}: {e}")
             raise
     
-    def calculate_total_pnl_from_inception(self, account_id: str) -> Dict[str, float]:
+    def calculate_total_pnl_from_inception(self, account_id: str,
+                                           snapshot: Optional[PortfolioSnapshot] = None) -> Dict[str, float]:
         """Расчет общей прибыли с момента открытия счета"""
+        if snapshot is None:
+            snapshot = PortfolioSnapshot(self.client, account_id)
+        
         try:
-            with Client(self.client.token) as client:
-                # Получаем операции с самого начала (максимально доступный период)
-                end_date = datetime.now()
-                start_date = datetime(2020, 1, 1)  # Начинаем с 2020 года
-                
-                operations_response = client.operations.get_operations(
-                    account_id=account_id,
-                    from_=start_date,
-                    to=end_date,
-                    state=OperationState.OPERATION_STATE_EXECUTED
-                )
-                
-                total_money_in = Decimal("0")     # Общие пополнения
-                total_money_out = Decimal("0")    # Общие выводы
-                total_dividends = Decimal("0")    # Дивиденды и купоны
-                total_commissions = Decimal("0")  # Комиссии
-                
-                # Анализируем все операции
-                for operation in operations_response.operations:
-                    payment = self.client.money_value_to_decimal(operation.payment)
-                    
-                    if operation.operation_type == OperationType.OPERATION_TYPE_INPUT:
-                        # Пополнение счета
-                        total_money_in += payment
-                        
-                    elif operation.operation_type == OperationType.OPERATION_TYPE_OUTPUT:
-                        # Вывод средств
-                        total_money_out += abs(payment)
-                        
-                    elif operation.operation_type in [
-                        OperationType.OPERATION_TYPE_DIVIDEND,
-                        OperationType.OPERATION_TYPE_COUPON
-                    ]:
-                        # Дивиденды и купоны
-                        total_dividends += payment
-                        
-                    elif operation.operation_type in [
-                        OperationType.OPERATION_TYPE_BROKER_FEE,
-                        OperationType.OPERATION_TYPE_SERVICE_FEE
-                    ]:
-                        # Комиссии и сборы
-                        total_commissions += abs(payment)
-                
-                # Получаем текущую стоимость портфеля
-                portfolio_data = self.client.get_portfolio_data(account_id)
-                current_equity = Decimal(str(portfolio_data["summary"]["total_equity"]))
-                
-                # Правильная формула P&L:
-                # P&L = Текущая стоимость + Выведенные средства + Дивиденды - Вложенные средства - Комиссии
-                net_invested = total_money_in - total_money_out
-                total_pnl = current_equity + total_money_out + total_dividends - total_money_in - total_commissions
-                
-                return {
-                    "total_pnl": float(total_pnl),
-                    "money_invested": float(total_money_in),
-                    "money_withdrawn": float(total_money_out),
-                    "dividends_received": float(total_dividends),
-                    "commissions_paid": float(total_commissions),
-                    "current_equity": float(current_equity),
-                    "net_invested": float(net_invested)
-                }
-                
+            # Догружаем только новые операции, агрегаты считаем по журналу
+            self._sync_ledger(account_id)
+            totals = self.ledger.get_payment_totals(account_id)
+            
+            def total(operation_types: List[OperationType], key: str = "sum") -> Decimal:
+                return sum((totals[t][key] for t in operation_types if t in totals), Decimal("0"))
+            
+            # Пополнения и выводы счета
+            total_money_in = total([OperationType.OPERATION_TYPE_INPUT])
+            total_money_out = total([OperationType.OPERATION_TYPE_OUTPUT], "abs_sum")
+            
+            # Дивиденды и купоны
+            total_dividends = total([
+                OperationType.OPERATION_TYPE_DIVIDEND,
+                OperationType.OPERATION_TYPE_COUPON
+            ])
+            
+            # Комиссии и сборы
+            total_commissions = total([
+                OperationType.OPERATION_TYPE_BROKER_FEE,
+                OperationType.OPERATION_TYPE_SERVICE_FEE
+            ], "abs_sum")
+            
+            # Получаем текущую стоимость портфеля
+            portfolio_data = snapshot.data
+            current_equity = Decimal(str(portfolio_data["summary"]["total_equity"]))
+            
+            # Правильная формула P&L:
+            # P&L = Текущая стоимость + Выведенные средства + Дивиденды - Вложенные средства - Комиссии
+            net_invested = total_money_in - total_money_out
+            total_pnl = current_equity + total_money_out + total_dividends - total_money_in - total_commissions
+            
+            return {
+                "total_pnl": float(total_pnl),
+                "money_invested": float(total_money_in),
+                "money_withdrawn": float(total_money_out),
+                "dividends_received": float(total_dividends),
+                "commissions_paid": float(total_commissions),
+                "current_equity": float(current_equity),
+                "net_invested": float(net_invested)
+            }
+            
         except Exception as e:
             logger.warning(f"Не удалось рассчитать P&L с открытия для {account_id}: {e}")
             # Fallback к текущему P&L из позиций
             try:
-                portfolio_data = self.client.get_portfolio_data(account_id)
+                portfolio_data = snapshot.data
                 return {
                     "total_pnl": portfolio_data["summary"]["total_pnl"],
                     "money_invested": 0,
@@ -126,71 +142,61 @@ class PortfolioAnalyzer:
     def get_trading_history(self, account_id: str, days: int = 30) -> List[Dict]:
         """Получение истории торговых операций"""
         try:
-            with Client(self.client.token) as client:
-                end_date = datetime.now()
-                start_date = end_date - timedelta(days=days)
-                
-                operations_response = client.operations.get_operations(
-                    account_id=account_id,
-                    from_=start_date,
-                    to=end_date,
-                    state=OperationState.OPERATION_STATE_EXECUTED
-                )
-                
-                trading_operations = []
-                
-                for operation in operations_response.operations:
-                    if operation.operation_type in [
-                        OperationType.OPERATION_TYPE_BUY,
-                        OperationType.OPERATION_TYPE_SELL
-                    ]:
-                        # Получаем информацию об инструменте
-                        instrument_name = "Unknown"
-                        ticker = "UNKNOWN"
-                        
-                        try:
-                            if operation.instrument_type == "share":
-                                instrument = client.instruments.share_by(id_type=1, id=operation.figi)
-                            elif operation.instrument_type == "bond":
-                                instrument = client.instruments.bond_by(id_type=1, id=operation.figi)
-                            elif operation.instrument_type == "etf":
-                                instrument = client.instruments.etf_by(id_type=1, id=operation.figi)
-                            else:
-                                continue
-                            
-                            instrument_name = instrument.instrument.name
-                            ticker = instrument.instrument.ticker
-                        except:
-                            pass
-                        
-                        payment = self.client.money_value_to_decimal(operation.payment)
-                        quantity = operation.quantity
-                        price = abs(payment) / quantity if quantity > 0 else 0
-                        
-                        trading_operations.append({
-                            "date": operation.date.strftime('%d.%m.%Y %H:%M'),
-                            "operation_type": "Покупка" if operation.operation_type == OperationType.OPERATION_TYPE_BUY else "Продажа",
-                            "ticker": ticker,
-                            "instrument_name": instrument_name,
-                            "quantity": int(quantity),
-                            "price": float(price),
-                            "amount": float(abs(payment)),
-                            "currency": operation.currency
-                        })
-                
-                # Сортируем по дате (новые первыми)
-                trading_operations.sort(key=lambda x: datetime.strptime(x["date"], '%d.%m.%Y %H:%M'), reverse=True)
+            self._sync_ledger(account_id)
+            
+            operations = self.ledger.get_operations(
+                account_id,
+                since=datetime.now(timezone.utc) - timedelta(days=days),
+                operation_types=[OperationType.OPERATION_TYPE_BUY, OperationType.OPERATION_TYPE_SELL]
+            )
+            
+            trading_operations = []
+            
+            for operation in operations:
+                # Получаем информацию об инструменте
+                instrument_name = "Unknown"
+                ticker = "UNKNOWN"
                 
-                return trading_operations
+                if operation["instrument_type"] not in ["share", "bond", "etf"]:
+                    continue
                 
+                instrument = self.client.instrument_catalog.lookup(operation["figi"], operation["instrument_type"])
+                if instrument:
+                    instrument_name = instrument['name']
+                    ticker = instrument['ticker']
+                
+                payment = operation["payment"]
+                quantity = operation["quantity"]
+                price = abs(payment) / quantity if quantity > 0 else 0
+                
+                trading_operations.append({
+                    "date": operation["date"].strftime('%d.%m.%Y %H:%M'),
+                    "operation_type": "Покупка" if operation["operation_type"] == OperationType.OPERATION_TYPE_BUY else "Продажа",
+                    "ticker": ticker,
+                    "instrument_name": instrument_name,
+                    "quantity": int(quantity),
+                    "price": float(price),
+                    "amount": float(abs(payment)),
+                    "currency": operation["currency"]
+                })
+            
+            self.client.instrument_catalog.flush()
+            
+            # Журнал уже отдает операции по дате (новые первыми)
+            return trading_operations
+            
         except Exception as e:
             logger.error(f"Ошибка получения истории операций: {e}")
             return []
     
-    def get_positions_near_stop_loss(self, account_id: str, threshold_percent: float = 5.0) -> List[Dict]:
+    def get_positions_near_stop_loss(self, account_id: str, threshold_percent: float = 5.0,
+                                     snapshot: Optional[PortfolioSnapshot] = None) -> List[Dict]:
         """Получение позиций близко к стоп-лоссу"""
+        if snapshot is None:
+            snapshot = PortfolioSnapshot(self.client, account_id)
+        
         try:
-            portfolio_data = self.client.get_portfolio_data(account_id)
+            portfolio_data = snapshot.data
             near_stop_loss = []
             
             for position in portfolio_data["positions"]:
@@ -0,0 +1,301 @@
+"""Общий расчет стоимости портфелей для бота и скриптов"""
+import copy
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+from tinkoff.invest import RequestError
+from .instrument_catalog import InstrumentCatalog
+from .metrics import REGISTRY, span
+from .money import Money
+from .order_book_pricing import OrderBookPricer
+from .price_table import PriceFetchPlanner, PriceTable
+from .valuation_engine import VALUED_TYPES, Valuation, ValuationEngine
+
+logger = logging.getLogger(__name__)
+
+# Курсы по умолчанию, если API недоступен и кэш пуст
+DEFAULT_CURRENCY_RATES = {"RUB": 1.0, "USD": 90.0, "EUR": 100.0}
+
+
+def instrument_info(figi: str, instrument_type: str, instrument: Optional[Dict]) -> Dict:
+    """Сведения об инструменте для отчета (с заглушкой, если инструмент не найден)"""
+    if instrument:
+        return {
+            'ticker': instrument['ticker'],
+            'name': instrument['name'],
+            'currency': instrument['currency'],
+            'type': instrument_type,
+            'lot': instrument.get('lot', 1),
+        }
+    return {
+        'ticker': f"UNKNOWN_{figi[:8]}",
+        'name': "Unknown instrument",
+        'currency': 'RUB',
+        'type': instrument_type,
+        'lot': 1,
+    }
+
+
+class PriceCache:
+    """Последние полученные цены с временем получения.
+
+    Интерфейс совпадает с LastPriceStream (update/get_fresh), поэтому
+    PriceFetchPlanner.fetch запрашивает только цены старше max_age.
+    """
+
+    def __init__(self):
+        self._prices: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def update(self, prices: Dict[str, Money]) -> None:
+        now = time.time()
+        with self._lock:
+            for figi, price in prices.items():
+                self._prices[figi] = (price, now)
+
+    def get_fresh(self, figis: Iterable[str], max_age: float) -> Dict[str, Money]:
+        threshold = time.time() - max_age
+        with self._lock:
+            return {
+                figi: self._prices[figi][0]
+                for figi in figis
+                if figi in self._prices and self._prices[figi][1] >= threshold
+            }
+
+
+class PortfolioValuator:
+    """Оценка портфелей: пакетная загрузка цен, кэш цен и курсов, метрики этапов.
+
+    Используется ботом (TinkoffClient) и скриптами portfolio_checker и
+    portfolio_race_tracker. services — фабрика контекста с клиентом API
+    (`ChannelManager.services` или `lambda: nullcontext(client)`).
+    """
+
+    def __init__(self, services: Callable, catalog: InstrumentCatalog, price_cache_ttl: float = 0,
+                 pricer: Optional[OrderBookPricer] = None, rates_cache_ttl: int = 3600):
+        self.services = services
+        self.catalog = catalog
+        self.pricer = pricer
+
+        # Источник свежих цен: кэш опроса или стрим (attach_price_stream)
+        self.price_source = PriceCache()
+        self.price_max_age = price_cache_ttl
+
+        self.rates_cache_ttl = rates_cache_ttl
+        self._currency_cache: Dict[str, float] = {}
+        self._currency_cache_expiry = 0.0
+
+    def with_services(self, services: Callable) -> "PortfolioValuator":
+        """Тот же расчет (справочник, кэш цен, оценка по стакану) на другом канале"""
+        valuator = copy.copy(self)
+        valuator.services = services
+        return valuator
+
+    def attach_price_stream(self, stream, max_age: float = 60) -> None:
+        """Свежие цены берутся из стрима вместо кэша опроса"""
+        self.price_source = stream
+        self.price_max_age = max_age
+
+    @property
+    def rates_cached(self) -> bool:
+        """Есть ли действующие курсы в кэше"""
+        return bool(self._currency_cache) and self._currency_cache_expiry > time.time()
+
+    def split_prices(self, planner: PriceFetchPlanner):
+        """Свежие цены из кэша или стрима и пакеты FIGI для запроса"""
+        if self.price_max_age <= 0:
+            return planner.split()
+        prices, chunks = planner.split(self.price_source, self.price_max_age)
+        REGISTRY.inc("price_cache_hits_total", len(prices))
+        REGISTRY.inc("price_cache_misses_total", len(planner.figis) - len(prices))
+        return prices, chunks
+
+    def build_price_table(self, planner: PriceFetchPlanner, prices: Dict[str, Money], responses) -> PriceTable:
+        """Таблица цен по плану; полученные цены попадают в кэш"""
+        return planner.build(prices, responses, self.price_source if self.price_max_age > 0 else None)
+
+    def fetch_prices(self, planner: PriceFetchPlanner, client) -> PriceTable:
+        """Загрузка цен по плану (свежие — из кэша или стрима)"""
+        with span("valuation_stage", stage="prices"):
+            prices, chunks = self.split_prices(planner)
+            responses = [client.market_data.get_last_prices(figi=chunk) for chunk in chunks]
+            return self.build_price_table(planner, prices, responses)
+
+    def price_table(self, account_positions: Iterable[List], client, benchmark: bool = False) -> PriceTable:
+        """Цены бумаг всех счетов и курсы валют (и индекс MOEX) одним планом"""
+        planner = PriceFetchPlanner().add_currencies()
+        if benchmark:
+            planner.add_benchmark()
+        for positions in account_positions:
+            planner.add_positions(positions)
+        return self.fetch_prices(planner, client)
+
+    def currency_rates(self, price_table: PriceTable) -> Dict[str, float]:
+        """Курсы валют из таблицы цен; недостающие — из кэша или значений по умолчанию"""
+        rates = price_table.currency_rates()
+        if "USD" in rates and "EUR" in rates:
+            self._currency_cache = rates.copy()
+            self._currency_cache_expiry = time.time() + self.rates_cache_ttl
+            return rates
+
+        fallback = self._currency_cache or DEFAULT_CURRENCY_RATES
+        for currency in ("USD", "EUR"):
+            rates.setdefault(currency, fallback[currency])
+        return rates
+
+    def cached_currency_rates(self) -> Dict[str, float]:
+        """Последние известные курсы (или значения по умолчанию)"""
+        return (self._currency_cache or DEFAULT_CURRENCY_RATES).copy()
+
+    def lookup_instruments(self, positions: List, client) -> Dict[str, Dict]:
+        """Сведения об инструментах позиций из справочника"""
+        instruments_info = {}
+        for position in positions:
+            if position.instrument_type in VALUED_TYPES and position.quantity.units > 0:
+                figi = position.figi
+                instrument = self.catalog.lookup(figi, position.instrument_type, client)
+                instruments_info[figi] = instrument_info(figi, position.instrument_type, instrument)
+        self.catalog.flush()
+        return instruments_info
+
+    @staticmethod
+    def stop_orders_from(response) -> Dict[str, Money]:
+        """Цены стоп-заявок на продажу по FIGI из ответа GetStopOrders"""
+        return {
+            order.figi: Money.from_quotation(order.stop_price)
+            for order in response.stop_orders
+            if order.direction.name == "STOP_ORDER_DIRECTION_SELL"
+        }
+
+    @staticmethod
+    def account_names_from(response) -> Dict[str, str]:
+        """Названия счетов по ID из ответа GetAccounts"""
+        return {account.id: account.name for account in response.accounts}
+
+    def get_stop_orders(self, account_id: str, client) -> Dict[str, Money]:
+        """Цены стоп-заявок на продажу по FIGI"""
+        try:
+            return self.stop_orders_from(client.stop_orders.get_stop_orders(account_id=account_id))
+        except RequestError as e:
+            logger.warning(f"Не удалось получить стоп-заявки {account_id}: {e}")
+            return {}
+
+    def get_account_names(self, client) -> Dict[str, str]:
+        """Названия счетов по ID"""
+        try:
+            return self.account_names_from(client.users.get_accounts())
+        except RequestError as e:
+            logger.warning(f"Не удалось получить список счетов: {e}")
+            return {}
+
+    @staticmethod
+    def order_book_positions(account_positions: Dict[str, List],
+                             instruments_info: Dict[str, Dict[str, Dict]]) -> Dict[str, Dict]:
+        """Суммарное количество и лот бумаг всех счетов для оценки по стакану"""
+        positions_by_figi = {}
+        for account_id, positions in account_positions.items():
+            for position in positions:
+                info = instruments_info[account_id].get(position.figi)
+                if info is not None:
+                    entry = positions_by_figi.setdefault(position.figi, {"quantity": Money(0), "lot": info["lot"]})
+                    entry["quantity"] = entry["quantity"] + Money.from_quotation(position.quantity)
+        return positions_by_figi
+
+    def assemble(self, account_positions: Dict[str, List], instruments_info: Dict[str, Dict[str, Dict]],
+                 price_table: PriceTable, account_names: Optional[Dict[str, str]] = None,
+                 stop_orders: Optional[Dict[str, Dict[str, Money]]] = None,
+                 order_book_prices: Optional[Dict[str, Money]] = None) -> Valuation:
+        """Расчет по уже полученным данным (без запросов к API)
+
+        Общий для синхронного (value) и асинхронного клиентов.
+        """
+        account_names = account_names or {}
+        stop_orders = stop_orders or {}
+
+        engine = ValuationEngine()
+        for account_id, positions in account_positions.items():
+            engine.add_account(
+                account_id, positions, instruments_info[account_id],
+                account_names.get(account_id, "Unknown Account"), stop_orders.get(account_id)
+            )
+
+        current_prices = price_table.prices
+        if order_book_prices:
+            current_prices = {**current_prices, **order_book_prices}
+
+        with span("valuation_stage", stage="value"):
+            return engine.value(current_prices, self.currency_rates(price_table))
+
+    def value(self, account_positions: Dict[str, List], client, price_table: Optional[PriceTable] = None,
+              account_names: Optional[Dict[str, str]] = None,
+              stop_orders: Optional[Dict[str, Dict[str, Money]]] = None) -> Valuation:
+        """Оценка нескольких счетов за один проход
+
+        Если цена не передана, цены всех счетов и курсы загружаются одним
+        планом. При заданном методе оценки по стакану цены последних
+        сделок заменяются ценами стакана (по суммарному количеству во
+        всех счетах).
+        """
+        with span("valuation", accounts=len(account_positions)):
+            if price_table is None:
+                try:
+                    price_table = self.price_table(account_positions.values(), client)
+                except RequestError as e:
+                    logger.warning(f"Не удалось получить текущие цены и курсы валют: {e}")
+                    price_table = PriceTable()
+
+            with span("valuation_stage", stage="instruments"):
+                instruments_info = {
+                    account_id: self.lookup_instruments(positions, client)
+                    for account_id, positions in account_positions.items()
+                }
+
+            order_book_prices = {}
+            if self.pricer is not None:
+                with span("valuation_stage", stage="order_book"):
+                    order_book_prices = self.pricer.fetch_prices(
+                        client, self.order_book_positions(account_positions, instruments_info)
+                    )
+
+            return self.assemble(account_positions, instruments_info, price_table,
+                                 account_names, stop_orders, order_book_prices)
+
+    def portfolio_data(self, account_id: str, positions: Optional[List] = None,
+                       price_table: Optional[PriceTable] = None, details: bool = True) -> Dict:
+        """Полные данные портфеля счета
+
+        Args:
+            account_id: ID счета
+            positions: Уже полученные позиции (если None, запрашиваются)
+            price_table: Общая таблица цен (если None, загружается одним запросом)
+            details: Загружать стоп-заявки и название счета
+        """
+        with self.services() as client:
+            if positions is None:
+                positions = client.operations.get_portfolio(account_id=account_id).positions
+
+            account_names, stop_orders = {}, {}
+            if details:
+                stop_orders[account_id] = self.get_stop_orders(account_id, client)
+                account_names = self.get_account_names(client)
+
+            valuation = self.value({account_id: positions}, client, price_table, account_names, stop_orders)
+        return valuation.portfolio_data(account_id)
+
+    def portfolio_values(self, account_positions: Dict[str, List],
+                         price_table: Optional[PriceTable] = None) -> Dict[str, Dict]:
+        """Итоговая стоимость нескольких портфелей (для гонки)"""
+        with self.services() as client:
+            valuation = self.value(account_positions, client, price_table)
+
+        values = {}
+        for account_id in account_positions:
+            summary = valuation.summary(account_id)
+            values[account_id] = {
+                "total_equity": summary["total_equity"],
+                "positions_value": summary["total_positions_value"],
+                "cash_balance": summary["cash_balance_rub"],
+                "positions_count": summary["positions_count"],
+            }
+        return values
@@ -0,0 +1,119 @@
+"""Пакетная загрузка последних цен"""
+import logging
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+from .money import Money
+
+logger = logging.getLogger(__name__)
+
+# FIGI валют и бенчмарка
+USD_FIGI = "BBG0013HGFT4"
+EUR_FIGI = "BBG0013HJJ31"
+MOEX_FIGI = "BBG004730ZJ9"
+CURRENCY_FIGIS = {"USD": USD_FIGI, "EUR": EUR_FIGI}
+
+# Ограничение API на число инструментов в одном GetLastPrices
+MAX_FIGIS_PER_REQUEST = 1000
+
+
+class PriceTable:
+    """Таблица последних цен, общая для всех расчетов одного отчета"""
+
+    def __init__(self, prices: Optional[Dict[str, Money]] = None, fetched_at: Optional[float] = None):
+        self.prices = prices or {}
+        self.fetched_at = fetched_at or time.time()
+
+    def get(self, figi: str, default: Optional[Money] = None) -> Optional[Money]:
+        """Цена инструмента"""
+        return self.prices.get(figi, default)
+
+    def __contains__(self, figi: str) -> bool:
+        return figi in self.prices
+
+    def __len__(self) -> int:
+        return len(self.prices)
+
+    def currency_rates(self) -> Dict[str, float]:
+        """Курсы валют к рублю из таблицы (только найденные)"""
+        rates = {"RUB": 1.0}
+        for currency, figi in CURRENCY_FIGIS.items():
+            if figi in self.prices:
+                rates[currency] = float(self.prices[figi])
+        return rates
+
+    def moex_index(self) -> Optional[float]:
+        """Значение индекса MOEX из таблицы"""
+        price = self.prices.get(MOEX_FIGI)
+        return float(price) if price is not None else None
+
+
+class PriceFetchPlanner:
+    """Сбор всех нужных FIGI в один дедуплицированный пакетный запрос.
+
+    Позиции всех счетов, валюты и бенчмарк добавляются в план, после чего
+    fetch() делает по одному GetLastPrices на каждые MAX_FIGIS_PER_REQUEST
+    инструментов.
+    """
+
+    def __init__(self, chunk_size: int = MAX_FIGIS_PER_REQUEST):
+        self.chunk_size = chunk_size
+        self._figis: Dict[str, None] = {}  # упорядоченное множество
+
+    def add(self, figis: Iterable[str]) -> "PriceFetchPlanner":
+        """Добавление инструментов в план"""
+        for figi in figis:
+            if figi:
+                self._figis[figi] = None
+        return self
+
+    def add_currencies(self) -> "PriceFetchPlanner":
+        """Добавление курсов USD и EUR"""
+        return self.add(CURRENCY_FIGIS.values())
+
+    def add_benchmark(self) -> "PriceFetchPlanner":
+        """Добавление индекса MOEX"""
+        return self.add([MOEX_FIGI])
+
+    def add_positions(self, positions: Iterable) -> "PriceFetchPlanner":
+        """Добавление бумаг из позиций портфеля"""
+        return self.add(
+            position.figi for position in positions
+            if position.instrument_type in ["share", "bond", "etf"] and position.quantity.units > 0
+        )
+
+    @property
+    def figis(self):
+        return list(self._figis)
+
+    def split(self, live_prices=None, max_age: float = 60) -> Tuple[Dict[str, Money], List[List[str]]]:
+        """Свежие цены из источника и пакеты FIGI, которые нужно запросить"""
+        prices = {}
+        if live_prices is not None:
+            prices.update(live_prices.get_fresh(self._figis, max_age))
+        figis = [figi for figi in self._figis if figi not in prices]
+        return prices, [figis[start:start + self.chunk_size] for start in range(0, len(figis), self.chunk_size)]
+
+    def build(self, prices: Dict[str, Money], responses: Iterable, live_prices=None) -> PriceTable:
+        """Таблица цен из свежих цен и ответов GetLastPrices"""
+        polled = {}
+        for response in responses:
+            for price in response.last_prices:
+                polled[price.figi] = Money.from_quotation(price.price)
+
+        if live_prices is not None and polled:
+            live_prices.update(polled)
+        requested = len(self._figis) - len(prices)
+        prices = {**prices, **polled}
+
+        logger.debug(f"Получены цены {len(prices)}/{len(self._figis)} инструментов (запрошено {requested})")
+        return PriceTable(prices)
+
+    def fetch(self, client, live_prices=None, max_age: float = 60) -> PriceTable:
+        """Загрузка цен по плану пакетами
+
+        Если передан стрим последних цен (LastPriceStream), свежие цены
+        берутся из него, а запрашиваются только устаревшие.
+        """
+        prices, chunks = self.split(live_prices, max_age)
+        responses = [client.market_data.get_last_prices(figi=chunk) for chunk in chunks]
+        return self.build(prices, responses, live_prices)
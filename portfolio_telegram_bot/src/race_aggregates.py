@@ -0,0 +1,202 @@
+"""Накопительные итоги гонки портфелей"""
+import copy
+import json
+import logging
+import math
+import os
+import threading
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних дней истории мест хранится в итогах (полная история — в столбцах RaceHistoryStore)
+RANK_HISTORY_DAYS = 90
+
+# Поля состояния, которые запоминаются перед применением строки
+_UNDO_FIELDS = ("start_date", "end_date", "days", "portfolio_names", "portfolios", "moex")
+
+
+def _value(data: Dict, key: str) -> Optional[float]:
+    """Числовое значение столбца (None для пропусков)"""
+    value = data.get(key)
+    if value is None or value == '':
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(value) else value
+
+
+def _percent(current: Optional[float], base: Optional[float]) -> Optional[float]:
+    if current is None or not base:
+        return None
+    return ((current - base) / base) * 100
+
+
+def _portfolio_keys(data: Dict) -> List[str]:
+    """Номера портфелей по столбцам portfolio_N_value"""
+    keys = []
+    for key in data:
+        if key.startswith('portfolio_') and key.endswith('_value'):
+            number = key[len('portfolio_'):-len('_value')]
+            if number.isdigit():
+                keys.append(number)
+    return keys
+
+
+class RaceAggregates:
+    """Итоги гонки, обновляемые при записи каждой дневной строки.
+
+    Для каждого портфеля хранятся база (первая строка), текущее и
+    предыдущее значения, максимум и просадка от него, место и число
+    дней в лидерах; для MOEX — база, текущее и предыдущее значения.
+    Отчет читает готовую сводку без прохода по истории. История мест
+    ограничена последними RANK_HISTORY_DAYS днями, поэтому размер файла
+    итогов не растет со временем.
+
+    Перед применением строки запоминается прежнее состояние, поэтому
+    повторный запуск за тот же день заменяет последний шаг. Строка с
+    более ранней датой не применяется (apply возвращает False), итоги
+    в этом случае пересчитываются по всей истории (rebuild).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.RLock()
+        self._state = self._empty()
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self._state = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Не удалось прочитать итоги гонки {path}: {e}")
+
+    @staticmethod
+    def _empty() -> Dict:
+        return {
+            "start_date": None,
+            "end_date": None,
+            "days": 0,
+            "portfolio_names": "",
+            "portfolios": {},
+            "moex": {"base": None, "current": None, "previous": None},
+            "rank_history": [],
+            "undo": None,
+        }
+
+    def _save(self) -> None:
+        """Атомарная запись состояния"""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._state, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def matches(self, days: int, end_date: Optional[str]) -> bool:
+        """Соответствуют ли итоги истории (число строк и последняя дата)"""
+        with self._lock:
+            return self._state["days"] == days and self._state["end_date"] == end_date
+
+    # Обновление
+
+    def apply(self, data: Dict) -> bool:
+        """Учет строки за день; False, если нужен пересчет по всей истории"""
+        with self._lock:
+            state = self._state
+            end_date = state["end_date"]
+            if end_date is not None and data["date"] <= end_date:
+                if data["date"] != end_date or state["undo"] is None:
+                    return False
+                # Повторный запуск за тот же день: откат последнего шага
+                state.update(state["undo"])
+                if state["rank_history"]:
+                    state["rank_history"].pop()
+
+            self._apply(data)
+            self._save()
+            return True
+
+    def rebuild(self, rows: List[Dict]) -> None:
+        """Пересчет итогов по всей истории"""
+        with self._lock:
+            self._state = self._empty()
+            for row in rows:
+                self._apply(row)
+            self._save()
+        logger.info(f"Итоги гонки пересчитаны по {len(rows)} строкам")
+
+    def _apply(self, data: Dict) -> None:
+        state = self._state
+        state["undo"] = {field: copy.deepcopy(state[field]) for field in _UNDO_FIELDS}
+
+        first = state["days"] == 0
+        if first:
+            state["start_date"] = data["date"]
+        state["end_date"] = data["date"]
+        state["days"] += 1
+        state["portfolio_names"] = data.get('portfolio_names') or ''
+
+        portfolios = state["portfolios"]
+        for key in _portfolio_keys(data):
+            if key not in portfolios:
+                portfolios[key] = {
+                    # Портфель, которого не было в первой строке, в рейтинге не участвует
+                    "base": _value(data, f'portfolio_{key}_value') if first else None,
+                    "current": None,
+                    "previous": None,
+                    "peak": None,
+                    "change_percent": None,
+                    "drawdown_percent": 0.0,
+                    "max_drawdown_percent": 0.0,
+                    "rank": None,
+                    "previous_rank": None,
+                    "days_in_lead": 0,
+                }
+
+        changes = {}
+        for key, entry in portfolios.items():
+            value = _value(data, f'portfolio_{key}_value')
+            entry["previous"] = entry["current"]
+            entry["current"] = value
+            if value is not None:
+                if entry["peak"] is None or value > entry["peak"]:
+                    entry["peak"] = value
+                drawdown = _percent(value, entry["peak"]) or 0.0
+                entry["drawdown_percent"] = drawdown
+                entry["max_drawdown_percent"] = min(entry["max_drawdown_percent"], drawdown)
+            entry["change_percent"] = _percent(value, entry["base"])
+            if entry["change_percent"] is not None:
+                changes[key] = entry["change_percent"]
+
+        # Места по изменению от базы; при равенстве выше портфель с меньшим номером
+        ranking = sorted(sorted(changes, key=int), key=lambda key: changes[key], reverse=True)
+        for key, entry in portfolios.items():
+            entry["previous_rank"] = entry["rank"]
+            entry["rank"] = ranking.index(key) + 1 if key in changes else None
+        if ranking:
+            portfolios[ranking[0]]["days_in_lead"] += 1
+        state["rank_history"].append([data["date"], ranking])
+        del state["rank_history"][:-RANK_HISTORY_DAYS]
+
+        moex = state["moex"]
+        value = _value(data, 'moex_index')
+        if first:
+            moex["base"] = value
+        moex["previous"] = moex["current"]
+        moex["current"] = value
+
+    # Чтение
+
+    def summary(self) -> Dict:
+        """Сводка для отчета (без истории мест)"""
+        with self._lock:
+            return {
+                field: copy.deepcopy(self._state[field])
+                for field in _UNDO_FIELDS
+            }
+
+    def rank_history(self, limit: Optional[int] = None) -> List[List]:
+        """История мест: [дата, [номера портфелей по местам]], последние limit дней (не больше RANK_HISTORY_DAYS)"""
+        with self._lock:
+            history = self._state["rank_history"]
+            return copy.deepcopy(history[-limit:] if limit else history)
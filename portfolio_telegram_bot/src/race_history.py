@@ -0,0 +1,317 @@
+"""Колоночное хранилище истории гонки"""
+import csv
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import date, datetime
+from typing import Dict, List, Optional
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DATE_FORMAT = '%Y-%m-%d'
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# Начальная емкость файлов столбцов, строк (дальше удваивается)
+INITIAL_CAPACITY = 1024
+
+# Служебные столбцы: дата (дни от 1970-01-01) и номер набора имен портфелей
+DATE_COLUMN = "date"
+NAMES_COLUMN = "portfolio_names"
+
+
+def _date_to_day(value: str) -> int:
+    return datetime.strptime(value, DATE_FORMAT).date().toordinal() - EPOCH_ORDINAL
+
+
+def _day_to_date(day: int) -> str:
+    return date.fromordinal(int(day) + EPOCH_ORDINAL).strftime(DATE_FORMAT)
+
+
+class RaceHistoryStore:
+    """История гонки: по файлу на столбец (memmap) и индекс по дате.
+
+    Строки хранятся в порядке дат. Числовые столбцы — float64 (NaN для
+    пропусков), дата — int32, имена портфелей — номер в словаре из
+    meta.json. Новая дата дописывается в конец на месте, а число строк
+    фиксируется в meta.json после записи значений. Замена строки за ту
+    же дату и вставка более ранней даты пишутся в копии столбцов нового
+    поколения, на которые meta.json переключается атомарно. Поэтому
+    прерванная запись любого вида не оставляет неполной строки.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.meta_path = os.path.join(directory, "meta.json")
+        self._lock = threading.RLock()
+        self._columns: Dict[str, np.memmap] = {}
+        self._meta = {"rows": 0, "capacity": 0, "columns": [], "names": [], "generation": 0}
+        self._garbage: List[str] = []  # файлы прошлого поколения (удаляются после записи meta.json)
+        os.makedirs(directory, exist_ok=True)
+        self._open()
+
+    # Файлы
+
+    def _column_path(self, name: str) -> str:
+        generation = self._meta.get("generation", 0)
+        suffix = f".g{generation}" if generation else ""
+        return os.path.join(self.directory, f"{name}{suffix}.bin")
+
+    @staticmethod
+    def _dtype(name: str):
+        if name == DATE_COLUMN or name == NAMES_COLUMN:
+            return np.int32
+        return np.float64
+
+    def _map(self, name: str) -> np.memmap:
+        """Отображение файла столбца на всю емкость"""
+        dtype = self._dtype(name)
+        path = self._column_path(name)
+        size = self._meta["capacity"] * np.dtype(dtype).itemsize
+        old_size = os.path.getsize(path) if os.path.exists(path) else 0
+        if old_size < size:
+            with open(path, 'ab') as f:
+                f.truncate(size)
+
+        column = np.memmap(path, dtype=dtype, mode='r+', shape=(self._meta["capacity"],))
+        if old_size < size and dtype is np.float64:
+            # Новое место числовых столбцов заполняется пропусками
+            column[old_size // column.itemsize:] = np.nan
+        return column
+
+    def _open(self) -> None:
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                self._meta = json.load(f)
+        else:
+            self._meta["capacity"] = INITIAL_CAPACITY
+            self._meta["columns"] = [DATE_COLUMN, NAMES_COLUMN]
+
+        for name in self._meta["columns"]:
+            self._columns[name] = self._map(name)
+        self._remove_stale_files()
+
+    def _remove_stale_files(self) -> None:
+        """Удаление файлов столбцов, на которые не ссылается meta.json (после прерванной записи)"""
+        current = {os.path.basename(self._column_path(name)) for name in self._meta["columns"]}
+        for filename in os.listdir(self.directory):
+            if filename.endswith(".bin") and filename not in current:
+                try:
+                    os.remove(os.path.join(self.directory, filename))
+                except OSError as e:
+                    logger.warning(f"Не удалось удалить старый файл истории {filename}: {e}")
+
+    def _save_meta(self) -> None:
+        """Атомарная запись meta.json"""
+        tmp_path = f"{self.meta_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._meta, f, ensure_ascii=False)
+        os.replace(tmp_path, self.meta_path)
+
+    def _flush(self) -> None:
+        for column in self._columns.values():
+            column.flush()
+
+    def _commit(self) -> None:
+        """Сброс столбцов на диск, запись meta.json и удаление файлов прошлого поколения"""
+        self._flush()
+        self._save_meta()
+        for path in self._garbage:
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"Не удалось удалить старый файл истории {path}: {e}")
+        self._garbage = []
+
+    def _new_generation(self) -> None:
+        """Копия строк всех столбцов в файлы нового поколения
+
+        Зафиксированные в meta.json файлы не меняются до записи нового
+        meta.json, поэтому замена и сдвиг строк идут в копиях.
+        """
+        rows = self._meta["rows"]
+        old_columns = self._columns
+        self._garbage.extend(self._column_path(name) for name in old_columns)
+        self._meta["generation"] = self._meta.get("generation", 0) + 1
+        self._columns = {}
+        for name, old_column in old_columns.items():
+            path = self._column_path(name)
+            if os.path.exists(path):
+                os.remove(path)  # остаток прерванной записи
+            column = self._map(name)
+            column[:rows] = old_column[:rows]
+            self._columns[name] = column
+
+    def _grow(self, rows: int) -> None:
+        """Увеличение емкости всех столбцов"""
+        if rows <= self._meta["capacity"]:
+            return
+        capacity = self._meta["capacity"]
+        while capacity < rows:
+            capacity *= 2
+        self._flush()
+        self._columns = {}
+        self._meta["capacity"] = capacity
+        for name in self._meta["columns"]:
+            self._columns[name] = self._map(name)
+
+    def _add_column(self, name: str) -> None:
+        """Новый столбец (например, пятый портфель): старые строки остаются пустыми"""
+        self._meta["columns"].append(name)
+        self._columns[name] = self._map(name)
+        logger.info(f"В историю гонки добавлен столбец {name}")
+
+    # Запись
+
+    def _names_id(self, names: str) -> int:
+        if names not in self._meta["names"]:
+            self._meta["names"].append(names)
+        return self._meta["names"].index(names)
+
+    def _write_row(self, index: int, data: Dict) -> None:
+        # Значения, которых нет в data, — пропуски
+        for name in self._meta["columns"]:
+            if self._dtype(name) is np.float64:
+                self._columns[name][index] = np.nan
+        self._columns[DATE_COLUMN][index] = _date_to_day(data[DATE_COLUMN])
+        self._columns[NAMES_COLUMN][index] = self._names_id(data.get(NAMES_COLUMN) or '')
+        for name, value in data.items():
+            if name in (DATE_COLUMN, NAMES_COLUMN):
+                continue
+            if name not in self._columns:
+                self._add_column(name)
+            self._columns[name][index] = np.nan if value is None or value == '' else float(value)
+
+    def upsert(self, data: Dict) -> None:
+        """Запись строки за день: замена существующей даты или добавление"""
+        with self._lock:
+            self._upsert(data)
+            self._commit()
+
+    def _upsert(self, data: Dict) -> None:
+        """Запись строки без сброса на диск"""
+        rows = self._meta["rows"]
+        day = _date_to_day(data[DATE_COLUMN])
+        dates = self._columns[DATE_COLUMN][:rows]
+        index = int(np.searchsorted(dates, day))
+
+        if index < rows and dates[index] == day:
+            # Повторный запуск за тот же день: значения заменяются целиком (в копии столбцов)
+            self._new_generation()
+            self._write_row(index, data)
+        elif index == rows:
+            # Новая дата: запись за последней строкой, видна после записи meta.json
+            self._grow(rows + 1)
+            self._write_row(rows, data)
+            self._meta["rows"] = rows + 1
+        else:
+            # Дата раньше последней: сдвиг хвоста в копии столбцов (только при импорте старых данных)
+            self._new_generation()
+            self._grow(rows + 1)
+            for column in self._columns.values():
+                column[index + 1:rows + 1] = column[index:rows].copy()
+            self._write_row(index, data)
+            self._meta["rows"] = rows + 1
+
+    def import_csv(self, csv_path: str) -> int:
+        """Разовый импорт истории из CSV, возвращает число строк"""
+        imported = 0
+        with open(csv_path, 'r', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                if not row.get(DATE_COLUMN):
+                    continue
+                data = {}
+                for key, value in row.items():
+                    if key is None:
+                        continue
+                    if key in (DATE_COLUMN, NAMES_COLUMN):
+                        data[key] = value
+                    else:
+                        try:
+                            data[key] = float(value) if value else None
+                        except ValueError:
+                            data[key] = None
+                with self._lock:
+                    self._upsert(data)
+                imported += 1
+
+        with self._lock:
+            self._commit()
+        logger.info(f"История гонки импортирована из {csv_path}: {imported} строк")
+        return imported
+
+    # Чтение
+
+    def __len__(self) -> int:
+        return self._meta["rows"]
+
+    @property
+    def value_columns(self) -> List[str]:
+        return [name for name in self._meta["columns"] if name not in (DATE_COLUMN, NAMES_COLUMN)]
+
+    def row(self, index: int) -> Optional[Dict]:
+        """Строка по номеру (отрицательные — с конца) в формате словаря CSV"""
+        with self._lock:
+            rows = self._meta["rows"]
+            if index < 0:
+                index += rows
+            if not 0 <= index < rows:
+                return None
+
+            data = {DATE_COLUMN: _day_to_date(self._columns[DATE_COLUMN][index])}
+            for name in self.value_columns:
+                value = float(self._columns[name][index])
+                data[name] = None if np.isnan(value) else value
+            data[NAMES_COLUMN] = self._meta["names"][int(self._columns[NAMES_COLUMN][index])]
+            return data
+
+    def first(self) -> Optional[Dict]:
+        return self.row(0)
+
+    def latest(self) -> Optional[Dict]:
+        return self.row(-1)
+
+    def previous(self) -> Optional[Dict]:
+        """Строка перед последней"""
+        return self.row(-2)
+
+    def find(self, day: str) -> Optional[Dict]:
+        """Строка за дату"""
+        with self._lock:
+            rows = self._meta["rows"]
+            target = _date_to_day(day)
+            index = int(np.searchsorted(self._columns[DATE_COLUMN][:rows], target))
+            if index < rows and self._columns[DATE_COLUMN][index] == target:
+                return self.row(index)
+            return None
+
+    def column(self, name: str) -> np.ndarray:
+        """Копия столбца (float64 с NaN вместо пропусков; для несуществующего — все NaN)"""
+        with self._lock:
+            rows = self._meta["rows"]
+            if name not in self._columns:
+                return np.full(rows, np.nan)
+            return np.array(self._columns[name][:rows])
+
+    def dates(self) -> List[date]:
+        """Даты всех строк"""
+        with self._lock:
+            days = self._columns[DATE_COLUMN][:self._meta["rows"]]
+            return [date.fromordinal(int(day) + EPOCH_ORDINAL) for day in days]
+
+    def digest(self) -> str:
+        """Хэш содержимого истории (меняется при любой записи строки)"""
+        with self._lock:
+            rows = self._meta["rows"]
+            digest = hashlib.sha256(json.dumps(
+                [rows, self._meta["columns"], self._meta["names"]], ensure_ascii=False
+            ).encode('utf-8'))
+            for name in self._meta["columns"]:
+                digest.update(self._columns[name][:rows].tobytes())
+            return digest.hexdigest()
+
+    def rows(self) -> List[Dict]:
+        """Все строки в формате словарей (для совместимости)"""
+        return [self.row(index) for index in range(len(self))]
@@ -1,13 +1,24 @@
 """Отслеживание гонки портфелей"""
-import csv
 import os
+import glob
+import hashlib
+import json
 import logging
-from datetime import date, datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
 from typing import Dict, List
+import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 from matplotlib.ticker import FuncFormatter
 import seaborn as sns
+import grpc
+from tinkoff.invest import RequestError
+from .metrics import REGISTRY
+from .price_table import PriceFetchPlanner
+from .race_aggregates import RaceAggregates
+from .race_history import RaceHistoryStore
 from .tinkoff_client import TinkoffClient
 
 logger = logging.getLogger(__name__)
@@ -16,122 +27,215 @@ logger = logging.getLogger(__name__)
 plt.style.use('seaborn-v0_8')
 sns.set_palette("husl")
 
+# Параметры графика гонки (входят в ключ кэша готовых PNG)
+CHART_PARAMS = {"version": 1, "figsize": [14, 8], "dpi": 300, "style": "seaborn-v0_8", "portfolios": 4}
+
+# Сколько последних графиков хранится в кэше
+CHART_CACHE_FILES = 10
+
+
+def _is_timeout(error: Exception) -> bool:
+    """Ошибка — истечение срока ответа запроса"""
+    return isinstance(error, RequestError) and error.code == grpc.StatusCode.DEADLINE_EXCEEDED
+
+
 class RaceTracker:
-    def __init__(self, tinkoff_client: TinkoffClient, data_dir: str = "./data"):
-        self.client = tinkoff_client
+    def __init__(self, tinkoff_client: TinkoffClient, data_dir: str = "./data",
+                 max_workers: int = 5, account_timeout: float = 60.0):
+        # Отдельный канал: сроки запросов гонки не действуют на отчеты и команды
+        self.client = tinkoff_client.dedicated(call_timeout=account_timeout)
         self.data_dir = data_dir
         self.history_file = os.path.join(data_dir, "portfolio_race_history.csv")
+        self.max_workers = max_workers
+        self.account_timeout = account_timeout  # срок ответа каждого запроса гонки, секунд
+        self._chart_lock = threading.Lock()  # pyplot не потокобезопасен
         os.makedirs(data_dir, exist_ok=True)
+        
+        # История в колоночном хранилище; CSV прежних версий импортируется один раз
+        self.history = RaceHistoryStore(os.path.join(data_dir, "race_history"))
+        if not len(self.history) and os.path.exists(self.history_file):
+            self.history.import_csv(self.history_file)
+        
+        # Итоги гонки обновляются при записи каждой строки
+        self.aggregates = RaceAggregates(os.path.join(self.history.directory, "aggregates.json"))
+        self._sync_aggregates()
     
-    def update_daily_data(self, portfolio_accounts: Dict[str, str]) -> None:
-        """Обновление ежедневных данных"""
+    def update_daily_data(self, portfolio_accounts: Dict[str, str]) -> Dict:
+        """Обновление ежедневных данных
+        
+        Позиции всех счетов запрашиваются параллельно, затем цены всех
+        бумаг, валют и индекса MOEX загружаются одним пакетным запросом.
+        Запросы идут по отдельному каналу гонки, где каждый запрос ограничен
+        account_timeout, и не затрагивают общий канал бота.
+        Возвращает сводку с перечнем неудачных счетов; строка сохраняется,
+        если получен хотя бы один портфель.
+        """
         try:
             today = date.today().strftime('%Y-%m-%d')
-            daily_data = {"date": today}
-            
-            # Получение данных портфелей
-            portfolio_names = []
-            for i, (name, account_id) in enumerate(portfolio_accounts.items(), 1):
-                logger.info(f"Загрузка данных для {name}...")
-                portfolio_value = self.client.get_portfolio_value(account_id)
+            accounts = list(portfolio_accounts.items())
+            
+            # Каждый запрос канала гонки ограничен account_timeout, поэтому задачи завершаются сами
+            with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="race") as executor:
+                logger.info(f"Загрузка позиций {len(accounts)} портфелей...")
+                account_futures = {
+                    name: executor.submit(self.client.fetch_positions, account_id) for name, account_id in accounts
+                }
+                
+                # Сбор позиций
+                account_positions = {}
+                failed = []
+                for name, future in account_futures.items():
+                    try:
+                        account_positions[name] = future.result()
+                    except Exception as e:
+                        if _is_timeout(e):
+                            logger.error(f"Превышено время ожидания данных для {name} ({self.account_timeout} сек)")
+                            REGISTRY.inc("race_account_timeouts_total", stage="positions")
+                        else:
+                            logger.error(f"Не удалось получить данные для {name}: {e}")
+                        failed.append(name)
                 
-                if portfolio_value:
-                    daily_data[f'portfolio_{i}_value'] = portfolio_value['total_equity']
-                    daily_data[f'portfolio_{i}_positions'] = portfolio_value['positions_count']
-                    portfolio_names.append(name)
-                else:
-                    logger.error(f"Не удалось получить данные для {name}")
-                    return
-            
-            # Получение данных MOEX
-            logger.info("Загрузка индекса MOEX...")
-            moex_price = self.client.get_moex_index_price()
-            if moex_price:
-                daily_data['moex_index'] = moex_price
+                # Цены всех счетов, валют и MOEX одним запросом и оценка за один проход
+                loaded = [(name, account_id) for name, account_id in accounts if name in account_positions]
+                price_table, batch_values = self._value_batch(
+                    {account_id: account_positions[name] for name, account_id in loaded}
+                )
+                
+                # Оценка по счетам, не оцененным пакетом (параллельно)
+                fallback = {
+                    name: executor.submit(self.client.get_portfolio_value, account_id, price_table,
+                                          account_positions[name])
+                    for name, account_id in loaded if account_id not in batch_values
+                }
+                
+                portfolio_values = {}
+                for name, account_id in loaded:
+                    portfolio_value = fallback[name].result() if name in fallback else batch_values[account_id]
+                    if portfolio_value:
+                        portfolio_values[name] = portfolio_value
+                    else:
+                        logger.error(f"Не удалось оценить портфель {name}")
+                        failed.append(name)
+            
+            moex_price = self.client.get_moex_index_price(price_table)
+            if moex_price is None:
+                logger.error("Не удалось получить индекс MOEX")
+            
+            result = {
+                "date": today,
+                "saved": False,
+                "failed": failed,
+                "moex_loaded": moex_price is not None,
+            }
+            
+            if not portfolio_values:
+                logger.error("Не получено данных ни по одному портфелю, строка не сохранена")
+                return result
+            
+            # Фиксированный набор колонок: неудачные счета остаются пустыми
+            daily_data = {"date": today}
+            for i, (name, _) in enumerate(accounts, 1):
+                portfolio_value = portfolio_values.get(name)
+                daily_data[f'portfolio_{i}_value'] = portfolio_value['total_equity'] if portfolio_value else None
+                daily_data[f'portfolio_{i}_positions'] = portfolio_value['positions_count'] if portfolio_value else None
+            daily_data['moex_index'] = moex_price
             
             # Сохранение имен портфелей
-            daily_data['portfolio_names'] = '|'.join(portfolio_names)
+            daily_data['portfolio_names'] = '|'.join(name for name, _ in accounts)
             
             # Сохранение данных
             self._save_daily_data(daily_data)
+            result["saved"] = True
+            
+            return result
             
         except Exception as e:
             logger.error(f"Ошибка обновления данных гонки: {e}")
             raise
     
+    def _value_batch(self, account_positions: Dict[str, List]):
+        """Общая таблица цен (счета, валюты, MOEX) и пакетная оценка; (None, {}) при ошибке цен"""
+        planner = PriceFetchPlanner().add_currencies().add_benchmark()
+        for positions in account_positions.values():
+            planner.add_positions(positions)
+        
+        try:
+            logger.info(f"Загрузка цен {len(planner.figis)} инструментов и индекса MOEX...")
+            price_table = self.client.build_price_table(planner)
+        except Exception as e:
+            logger.error(f"Ошибка пакетной загрузки цен, цены будут запрошены по счетам: {e}")
+            return None, {}
+        
+        try:
+            return price_table, self.client.get_portfolio_values(account_positions, price_table)
+        except Exception as e:
+            logger.error(f"Ошибка пакетной оценки портфелей, оценка по счетам: {e}")
+            return price_table, {}
+    
+    def close(self) -> None:
+        """Закрытие канала гонки"""
+        self.client.channel.close()
+    
     def generate_race_report(self) -> Dict:
-        """Генерация отчета о гонке"""
+        """Генерация отчета о гонке по накопленным итогам (без чтения истории)"""
         try:
-            historical_data = self.load_historical_data()
-            
-            if not historical_data:
+            self._sync_aggregates()
+            summary = self.aggregates.summary()
+            days = summary["days"]
+            if not days:
                 return {"error": "Нет данных для отчета"}
             
-            latest_data = historical_data[-1]
-            base_data = historical_data[0]
-            
             # Получение имен портфелей
-            portfolio_names = latest_data.get('portfolio_names', '').split('|')
+            portfolio_names = summary["portfolio_names"].split('|')
             if len(portfolio_names) < 4:
                 portfolio_names = [f"Портфель {i+1}" for i in range(4)]
             
-            # Расчет производительности
+            # Производительность от базы и изменения за последний день
             portfolio_performance = []
             for i in range(4):
-                name = portfolio_names[i] if i < len(portfolio_names) else f"Портфель {i+1}"
-                
-                try:
-                    base_value = float(base_data[f'portfolio_{i+1}_value'])
-                    current_value = float(latest_data[f'portfolio_{i+1}_value'])
-                    change_percent = ((current_value - base_value) / base_value) * 100
-                    
-                    portfolio_performance.append({
-                        'name': name,
-                        'current_value': current_value,
-                        'change_percent': change_percent,
-                        'index': i
-                    })
-                except (KeyError, ValueError, ZeroDivisionError):
+                entry = summary["portfolios"].get(str(i + 1))
+                if not entry or entry["change_percent"] is None:
                     continue
+                name = portfolio_names[i] if i < len(portfolio_names) else f"Портфель {i+1}"
+                portfolio_performance.append({
+                    'name': name,
+                    'current_value': entry["current"],
+                    'change_percent': entry["change_percent"],
+                    'drawdown_percent': entry["drawdown_percent"],
+                    'max_drawdown_percent': entry["max_drawdown_percent"],
+                    'days_in_lead': entry["days_in_lead"],
+                    'rank': entry["rank"],
+                    'previous_rank': entry["previous_rank"],
+                    'index': i
+                })
             
             # Сортировка по производительности
             portfolio_performance.sort(key=lambda x: x['change_percent'], reverse=True)
             
             # MOEX для сравнения
+            moex = summary["moex"]
             moex_change = None
-            if latest_data.get('moex_index') and base_data.get('moex_index'):
-                try:
-                    base_moex = float(base_data['moex_index'])
-                    current_moex = float(latest_data['moex_index'])
-                    moex_change = ((current_moex - base_moex) / base_moex) * 100
-                except (ValueError, ZeroDivisionError):
-                    pass
+            if moex["current"] and moex["base"]:
+                moex_change = ((moex["current"] - moex["base"]) / moex["base"]) * 100
             
             # Изменения за последний день
             daily_changes = []
-            if len(historical_data) >= 2:
-                prev_data = historical_data[-2]
+            if days >= 2:
                 for portfolio in portfolio_performance:
-                    try:
-                        idx = portfolio['index']
-                        prev_value = float(prev_data[f'portfolio_{idx+1}_value'])
-                        current_value = portfolio['current_value']
-                        daily_change = ((current_value - prev_value) / prev_value) * 100
-                        daily_changes.append({
-                            'name': portfolio['name'],
-                            'change_percent': daily_change
-                        })
-                    except (KeyError, ValueError, ZeroDivisionError):
-                        daily_changes.append({
-                            'name': portfolio['name'],
-                            'change_percent': 0
-                        })
+                    prev_value = summary["portfolios"][str(portfolio['index'] + 1)]["previous"]
+                    daily_change = 0
+                    if prev_value:
+                        daily_change = ((portfolio['current_value'] - prev_value) / prev_value) * 100
+                    daily_changes.append({
+                        'name': portfolio['name'],
+                        'change_percent': daily_change
+                    })
             
             return {
                 "period": {
-                    "start_date": base_data['date'],
-                    "end_date": latest_data['date'],
-                    "days": len(historical_data)
+                    "start_date": summary["start_date"],
+                    "end_date": summary["end_date"],
+                    "days": days
                 },
                 "portfolio_performance": portfolio_performance,
                 "moex_change": moex_change,
@@ -145,65 +249,73 @@ class RaceTracker:
     
     def create_performance_chart(self) -> str:
         """Создание графика производительности, возвращает путь к PNG"""
-        try:
-            historical_data = self.load_historical_data()
+        # График строится и в ежедневном прогоне, и по команде /chart
+        with self._chart_lock:
+            try:
+                chart_filename = self._chart_path()
+            except Exception as e:
+                logger.error(f"Ошибка расчета ключа графика: {e}")
+                return None
             
-            if len(historical_data) < 2:
+            # История не менялась с прошлого построения — готовый файл
+            if len(self.history) >= 2 and os.path.exists(chart_filename):
+                REGISTRY.inc("chart_cache_hits_total")
+                logger.info(f"График взят из кэша: {chart_filename}")
+                return chart_filename
+            
+            REGISTRY.inc("chart_cache_misses_total")
+            return self._create_performance_chart(chart_filename)
+    
+    def _chart_path(self) -> str:
+        """Путь к PNG по хэшу содержимого истории и параметров графика"""
+        params = json.dumps(CHART_PARAMS, sort_keys=True)
+        key = hashlib.sha256(f"{self.history.digest()}:{params}".encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.data_dir, "charts", f"portfolio_race_chart_{key}.png")
+    
+    def _prune_chart_cache(self, charts_dir: str) -> None:
+        """Удаление старых графиков сверх CHART_CACHE_FILES"""
+        charts = sorted(glob.glob(os.path.join(charts_dir, "portfolio_race_chart_*.png")),
+                        key=os.path.getmtime, reverse=True)
+        for path in charts[CHART_CACHE_FILES:]:
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"Не удалось удалить старый график {path}: {e}")
+    
+    def _create_performance_chart(self, chart_filename: str) -> str:
+        """Построение и сохранение графика"""
+        try:
+            if len(self.history) < 2:
                 logger.warning("Недостаточно данных для построения графика")
                 return None
             
             # Получение имен портфелей
-            latest_data = historical_data[-1]
+            latest_data = self.history.latest()
             portfolio_names = latest_data.get('portfolio_names', '').split('|')
             if len(portfolio_names) < 4:
                 portfolio_names = [f"Портфель {i+1}" for i in range(4)]
             
-            # Подготовка данных
-            dates = [datetime.strptime(row['date'], '%Y-%m-%d').date() for row in historical_data]
+            # Подготовка данных по столбцам хранилища
+            dates = self.history.dates()
             
-            # Базовые значения (первый день)
-            base_data = historical_data[0]
-            base_portfolios = []
+            # Процентные изменения относительно первого дня (пропуски — 0%)
+            portfolio_changes = []
             for i in range(4):
-                try:
-                    base_portfolios.append(float(base_data[f'portfolio_{i+1}_value']))
-                except (KeyError, ValueError):
-                    base_portfolios.append(1.0)  # Fallback
-            
-            base_moex = None
-            try:
-                if base_data.get('moex_index'):
-                    base_moex = float(base_data['moex_index'])
-            except (ValueError, TypeError):
-                pass
-            
-            # Расчет процентных изменений
-            portfolio_changes = [[] for _ in range(4)]
-            moex_changes = []
-            
-            for row in historical_data:
-                # Портфели
-                for i in range(4):
-                    try:
-                        current_value = float(row[f'portfolio_{i+1}_value'])
-                        change_percent = ((current_value - base_portfolios[i]) / base_portfolios[i]) * 100
-                        portfolio_changes[i].append(change_percent)
-                    except (KeyError, ValueError, ZeroDivisionError):
-                        portfolio_changes[i].append(0)
-                
-                # MOEX
-                if row.get('moex_index') and base_moex:
-                    try:
-                        current_moex = float(row['moex_index'])
-                        moex_change = ((current_moex - base_moex) / base_moex) * 100
-                        moex_changes.append(moex_change)
-                    except (ValueError, ZeroDivisionError):
-                        moex_changes.append(None)
-                else:
-                    moex_changes.append(None)
+                values = self.history.column(f'portfolio_{i+1}_value')
+                base = values[0] if not np.isnan(values[0]) and values[0] != 0 else 1.0  # Fallback
+                changes = (values - base) / base * 100
+                portfolio_changes.append(np.nan_to_num(changes, nan=0.0))
+            
+            # MOEX (пропуски не рисуются)
+            moex = self.history.column('moex_index')
+            base_moex = moex[0]
+            if np.isnan(base_moex) or base_moex == 0:
+                moex_changes = np.full(len(moex), np.nan)
+            else:
+                moex_changes = (moex - base_moex) / base_moex * 100
             
             # Создание графика
-            plt.figure(figsize=(14, 8))
+            plt.figure(figsize=tuple(CHART_PARAMS["figsize"]))
             
             # Цвета для портфелей
             colors = ['#FF6B6B', '#4ECDC4', '#45B7D1', '#96CEB4']
@@ -219,7 +331,7 @@ class RaceTracker:
                         markersize=4)
             
             # График MOEX
-            if any(x is not None for x in moex_changes):
+            if not np.all(np.isnan(moex_changes)):
                 plt.plot(dates, moex_changes, 
                         label='Индекс MOEX', 
                         linewidth=2, 
@@ -256,12 +368,14 @@ class RaceTracker:
             # Плотная компоновка
             plt.tight_layout()
             
-            # Сохранение
-            charts_dir = os.path.join(self.data_dir, "charts")
+            # Сохранение (через временный файл: в кэше не бывает недописанных PNG)
+            charts_dir = os.path.dirname(chart_filename)
             os.makedirs(charts_dir, exist_ok=True)
-            chart_filename = os.path.join(charts_dir, f"portfolio_race_chart_{datetime.now().strftime('%Y%m%d')}.png")
-            plt.savefig(chart_filename, dpi=300, bbox_inches='tight')
+            tmp_filename = f"{chart_filename}.tmp"
+            plt.savefig(tmp_filename, dpi=CHART_PARAMS["dpi"], bbox_inches='tight', format='png')
             plt.close()  # Закрываем фигуру для освобождения памяти
+            os.replace(tmp_filename, chart_filename)
+            self._prune_chart_cache(charts_dir)
             
             logger.info(f"График сохранен: {chart_filename}")
             return chart_filename
@@ -271,43 +385,31 @@ class RaceTracker:
             return None
     
     def load_historical_data(self) -> List[Dict]:
-        """Загрузка исторических данных"""
-        if not os.path.exists(self.history_file):
-            return []
-        
-        data = []
+        """Загрузка исторических данных (все строки в виде словарей)"""
         try:
-            with open(self.history_file, 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    # Конвертируем строковые значения обратно в числа
-                    for key in row:
-                        if key not in ['date', 'portfolio_names']:
-                            try:
-                                row[key] = float(row[key]) if row[key] else None
-                            except (ValueError, TypeError):
-                                row[key] = None
-                    data.append(row)
+            return self.history.rows()
         except Exception as e:
             logger.error(f"Ошибка загрузки исторических данных: {e}")
             return []
-        
-        return data
     
     def _save_daily_data(self, data: Dict) -> None:
-        """Сохранение данных за день"""
-        file_exists = os.path.exists(self.history_file)
-        
+        """Сохранение данных за день (повторный запуск за ту же дату заменяет строку)"""
         try:
-            with open(self.history_file, 'a', newline='', encoding='utf-8') as f:
-                writer = csv.DictWriter(f, fieldnames=data.keys())
-                
-                if not file_exists:
-                    writer.writeheader()
-                
-                writer.writerow(data)
-            
-            logger.info(f"Данные сохранены в {self.history_file}")
+            self.history.upsert(data)
+            logger.info(f"Данные сохранены в {self.history.directory}")
         except Exception as e:
             logger.error(f"Ошибка сохранения данных: {e}")
-            raise
\ No newline at end of file
+            raise
+        
+        try:
+            if not self.aggregates.apply(data):
+                self.aggregates.rebuild(self.history.rows())
+        except Exception as e:
+            logger.error(f"Ошибка обновления итогов гонки: {e}")
+    
+    def _sync_aggregates(self) -> None:
+        """Пересчет итогов, если они не соответствуют истории"""
+        latest = self.history.latest()
+        end_date = latest['date'] if latest else None
+        if not self.aggregates.matches(len(self.history), end_date):
+            self.aggregates.rebuild(self.history.rows())
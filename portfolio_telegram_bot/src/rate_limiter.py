@@ -0,0 +1,209 @@
+"""Ограничение частоты запросов к API Тинькофф"""
+import logging
+import threading
+import time
+from typing import Callable, Dict, Optional
+import grpc
+from tinkoff.invest import RequestError
+from .metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Лимиты unary-запросов в минуту по сервисам (с запасом от лимитов API)
+DEFAULT_RATE_LIMITS = {
+    "users": 100,
+    "operations": 200,
+    "instruments": 200,
+    "market_data": 600,
+    "stop_orders": 50,
+    "orders": 100,
+}
+
+# Сервисы, которые не ограничиваются (долгоживущие стримы)
+UNTHROTTLED_SERVICES = ("market_data_stream", "operations_stream", "orders_stream")
+
+
+class TokenBucket:
+    """Маркерная корзина с резервированием: каждый вызов получает время ожидания своей очереди"""
+
+    def __init__(self, per_minute: int, capacity: Optional[int] = None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or max(1, per_minute // 10)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+        # Метрики
+        self.calls = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.throttled = 0
+
+    def reserve(self) -> float:
+        """Резервирование маркера, возвращает время ожидания в секундах"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            delay = max(delay, self._paused_until - now)
+
+            self.calls += 1
+            self.total_wait += delay
+            self.max_wait = max(self.max_wait, delay)
+            return delay
+
+    def acquire(self) -> float:
+        """Блокирующее ожидание маркера"""
+        delay = self.reserve()
+        if delay > 0:
+            self.enter_queue()
+            try:
+                time.sleep(delay)
+            finally:
+                self.leave_queue()
+        return delay
+
+    def enter_queue(self) -> None:
+        with self._lock:
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+
+    def leave_queue(self) -> None:
+        with self._lock:
+            self.waiting -= 1
+
+    def pause(self, seconds: float) -> None:
+        """Остановка выдачи маркеров до сброса лимита на сервере"""
+        with self._lock:
+            now = time.monotonic()
+            self._paused_until = max(self._paused_until, now + seconds)
+            self._tokens = min(self._tokens, 0.0)
+            self._updated = now
+            self.throttled += 1
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "queue_depth": self.waiting,
+                "max_queue_depth": self.max_waiting,
+                "total_wait": round(self.total_wait, 3),
+                "max_wait": round(self.max_wait, 3),
+                "avg_wait": round(self.total_wait / self.calls, 3) if self.calls else 0.0,
+                "throttled": self.throttled,
+            }
+
+
+class RateLimiter:
+    """Корзины по сервисам API и обработка RESOURCE_EXHAUSTED.
+
+    Вызовы сверх лимита ждут в очереди, а при ответе сервера о
+    превышении лимита сервис приостанавливается до ratelimit_reset
+    и запрос повторяется.
+    """
+
+    def __init__(self, limits: Optional[Dict[str, int]] = None, max_retries: int = 3,
+                 default_reset: float = 5.0):
+        self.limits = {**DEFAULT_RATE_LIMITS, **(limits or {})}
+        self.max_retries = max_retries
+        self.default_reset = default_reset
+        self.buckets = {service: TokenBucket(limit) for service, limit in self.limits.items()}
+
+    def bucket(self, service: str) -> Optional[TokenBucket]:
+        if service in UNTHROTTLED_SERVICES:
+            return None
+        return self.buckets.get(service)
+
+    def reset_delay(self, error: Exception) -> Optional[float]:
+        """Время до сброса лимита, если ошибка — превышение лимита"""
+        if not isinstance(error, RequestError) or error.code != grpc.StatusCode.RESOURCE_EXHAUSTED:
+            return None
+        reset = getattr(error.metadata, "ratelimit_reset", None)
+        return float(reset) if reset else self.default_reset
+
+    def call(self, service: str, method, *args, **kwargs):
+        """Вызов метода API через корзину сервиса с повтором после превышения лимита"""
+        bucket = self.bucket(service)
+        if bucket is None:
+            return method(*args, **kwargs)
+
+        attempt = 0
+        while True:
+            REGISTRY.observe("tinkoff_queue_wait_seconds", bucket.acquire(), service=service)
+            try:
+                return method(*args, **kwargs)
+            except RequestError as e:
+                delay = self.reset_delay(e)
+                if delay is None or attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                bucket.pause(delay)
+                REGISTRY.inc("tinkoff_rate_limited_total", service=service)
+                logger.warning(f"Превышен лимит запросов {service}, повтор через {delay:.0f} сек")
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Метрики очередей по сервисам"""
+        return {service: bucket.stats() for service, bucket in self.buckets.items() if bucket.calls}
+
+
+class _ThrottledService:
+    """Прокси сервиса API: каждый метод вызывается через RateLimiter
+
+    Ошибки вызовов передаются в on_error (даже если вызывающий код их
+    перехватывает), чтобы владелец канала мог заметить его поломку.
+    """
+
+    def __init__(self, service, name: str, limiter: Optional[RateLimiter],
+                 on_error: Optional[Callable[[Exception], None]] = None):
+        self._service = service
+        self._name = name
+        self._limiter = limiter
+        self._on_error = on_error
+
+    def __getattr__(self, method_name: str):
+        method = getattr(self._service, method_name)
+        if not callable(method):
+            return method
+
+        def reported(*args, **kwargs):
+            try:
+                return method(*args, **kwargs)
+            except (RequestError, grpc.RpcError) as e:
+                if self._on_error is not None:
+                    self._on_error(e)
+                raise
+
+        if self._limiter is None or self._limiter.bucket(self._name) is None:
+            return reported
+
+        def timed(*args, **kwargs):
+            with REGISTRY.span("tinkoff_rpc", service=self._name, method=method_name):
+                return reported(*args, **kwargs)
+
+        def throttled(*args, **kwargs):
+            return self._limiter.call(self._name, timed, *args, **kwargs)
+
+        return throttled
+
+
+class ThrottledServices:
+    """Прокси сервисов клиента (`client.instruments`, `client.market_data`, ...)"""
+
+    def __init__(self, services, limiter: Optional[RateLimiter],
+                 on_error: Optional[Callable[[Exception], None]] = None):
+        self._services = services
+        self._limiter = limiter
+        self._on_error = on_error
+
+    def __getattr__(self, name: str):
+        service = getattr(self._services, name)
+        throttled = self._limiter is not None and self._limiter.bucket(name) is not None
+        if not throttled and self._on_error is None:
+            return service
+        return _ThrottledService(service, name, self._limiter, self._on_error)
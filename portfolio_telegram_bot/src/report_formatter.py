@@ -175,7 +175,20 @@ class ReportFormatter:
                         name = name[:12] + "..."
                     
                     medal = medals[i] if i < len(medals) else "🔹"
-                    report.append(f"{medal} {name}: {change_percent:+.2f}%")
+                    line = f"{medal} {name}: {change_percent:+.2f}%"
+                    days_in_lead = portfolio.get("days_in_lead", 0)
+                    if days_in_lead:
+                        line += f" (👑 {days_in_lead} дн.)"
+                    report.append(line)
+                
+                # Наибольшая просадка от максимума среди портфелей
+                deepest = min(portfolio_performance, key=lambda x: x.get("max_drawdown_percent", 0))
+                max_drawdown = deepest.get("max_drawdown_percent", 0)
+                if max_drawdown < 0:
+                    deepest_name = deepest.get("name", "N/A")
+                    if len(deepest_name) > 15:
+                        deepest_name = deepest_name[:12] + "..."
+                    report.append(f"⚠️ Макс. просадка: {deepest_name} {max_drawdown:.2f}%")
                 
                 report.append("")
             
@@ -0,0 +1,121 @@
+"""Кэш результатов интерактивных команд"""
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional, Tuple
+from .metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Время жизни результатов по командам, секунды (0 — без кэша)
+DEFAULT_RESPONSE_TTLS = {
+    "/portfolio": 300,
+    "/race": 3600,
+    "/pnl": 600,
+    "/status": 30,
+}
+
+
+def _cacheable(value: Any) -> bool:
+    """Ошибки и пустые результаты не кэшируются"""
+    if value is None:
+        return False
+    return not (isinstance(value, dict) and "error" in value)
+
+
+def format_as_of(created_at: float) -> str:
+    """Отметка времени данных для сообщения"""
+    return f"🕒 _Данные на {datetime.fromtimestamp(created_at).strftime('%H:%M')}_"
+
+
+class ResponseCache:
+    """Результаты команд по (команда, счет) с временем жизни.
+
+    Одновременные запросы одного ключа ждут одного расчета. Кэш
+    сбрасывается явно (invalidate), когда планировщик записывает новые
+    данные гонки. Попадания и промахи считаются по командам.
+    """
+
+    def __init__(self, ttls: Optional[Dict[str, float]] = None):
+        self.ttls = {**DEFAULT_RESPONSE_TTLS, **(ttls or {})}
+        self._entries: Dict[Tuple[str, str], Tuple[Any, float]] = {}
+        self._key_locks: Dict[Tuple[str, str], threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits: Dict[str, int] = {}
+        self.misses: Dict[str, int] = {}
+
+    def _key_lock(self, key: Tuple[str, str]) -> threading.Lock:
+        with self._lock:
+            lock = self._key_locks.get(key)
+            if lock is None:
+                lock = self._key_locks[key] = threading.Lock()
+            return lock
+
+    def _fresh(self, key: Tuple[str, str], ttl: float) -> Optional[Tuple[Any, float]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and time.time() - entry[1] < ttl:
+                return entry
+            return None
+
+    def _count(self, command: str, hit: bool) -> None:
+        with self._lock:
+            counters = self.hits if hit else self.misses
+            counters[command] = counters.get(command, 0) + 1
+        REGISTRY.inc("response_cache_hits_total" if hit else "response_cache_misses_total", command=command)
+
+    def get(self, command: str, account: str, compute: Callable[[], Any],
+            on_miss: Optional[Callable[[], None]] = None) -> Tuple[Any, float]:
+        """Результат команды и время его расчета (time.time())
+
+        При промахе вызывается on_miss (например, сообщение «Генерирую
+        отчет...»), затем compute.
+        """
+        ttl = self.ttls.get(command, 0)
+        if ttl <= 0:
+            self._count(command, hit=False)
+            if on_miss:
+                on_miss()
+            return compute(), time.time()
+
+        key = (command, str(account))
+        with self._key_lock(key):
+            entry = self._fresh(key, ttl)
+            if entry:
+                self._count(command, hit=True)
+                return entry
+
+            self._count(command, hit=False)
+            if on_miss:
+                on_miss()
+            with self._lock:
+                generation = self._generation
+            created_at = time.time()
+            value = compute()
+
+            with self._lock:
+                # Результат, рассчитанный до сброса кэша, не сохраняется
+                if _cacheable(value) and generation == self._generation:
+                    self._entries[key] = (value, created_at)
+            return value, created_at
+
+    def invalidate(self, command: Optional[str] = None) -> None:
+        """Сброс результатов команды (или всех команд)"""
+        with self._lock:
+            self._generation += 1
+            if command is None:
+                self._entries.clear()
+            else:
+                for key in [key for key in self._entries if key[0] == command]:
+                    del self._entries[key]
+        logger.info(f"Кэш ответов сброшен: {command or 'все команды'}")
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Попадания и промахи по командам"""
+        with self._lock:
+            return {
+                command: {"hits": self.hits.get(command, 0), "misses": self.misses.get(command, 0)}
+                for command in sorted(set(self.hits) | set(self.misses))
+            }
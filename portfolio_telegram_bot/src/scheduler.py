@@ -1,12 +1,17 @@
 """Планировщик задач"""
+import os
 import schedule
 import time
 import logging
-import traceback
 from datetime import datetime
 import pytz
 from .config import Config
 from .tinkoff_client import TinkoffClient
+from .async_tinkoff_client import SyncTinkoffClient
+from .market_data_stream import LastPriceStream
+from .metrics import MetricsExporter, span
+from .task_graph import TaskGraph
+from .operations_ledger import OperationsLedger
 from .portfolio_analyzer import PortfolioAnalyzer
 from .race_tracker import RaceTracker
 from .telegram_bot import TelegramBot
@@ -15,15 +20,79 @@ from .command_handler import CommandHandler
 
 logger = logging.getLogger(__name__)
 
+# Таймауты этапов ежедневных отчетов, секунды (переопределяются stage_timeouts)
+DEFAULT_STAGE_TIMEOUTS = {
+    "portfolio_report": 300,
+    "race_update": 300,
+    "race_report": 120,
+    "race_chart_render": 120,
+    "race_chart_send": 120,
+}
+
 class Scheduler:
     def __init__(self, config: Config):
         self.config = config
         
         # Инициализация компонентов
-        self.tinkoff_client = TinkoffClient(config.TINKOFF_TOKEN)
-        self.portfolio_analyzer = PortfolioAnalyzer(self.tinkoff_client)
-        self.race_tracker = RaceTracker(self.tinkoff_client, config.DATA_DIRECTORY)
-        self.telegram_bot = TelegramBot(config.TELEGRAM_TOKEN, config.CHAT_ID)
+        client_factories = {}
+        self.fake_api = None
+        if config.FAKE_API_FIXTURE:
+            # Работа без сети: локальная замена API на фикстуре (только для разработки и бенчмарков)
+            from .fake_invest_api import FakeInvestApi
+            self.fake_api = FakeInvestApi.from_file(
+                config.FAKE_API_FIXTURE,
+                latency=config.FAKE_API_LATENCY,
+                error_rate=config.FAKE_API_ERROR_RATE
+            )
+            client_factories["client_factory"] = self.fake_api.client
+            if config.USE_ASYNC_CLIENT:
+                client_factories["async_client_factory"] = self.fake_api.async_client
+            logger.warning(f"Используется локальная замена API Тинькофф: {config.FAKE_API_FIXTURE}")
+        
+        # Асинхронный слой данных подключается через синхронный фасад
+        client_class = SyncTinkoffClient if config.USE_ASYNC_CLIENT else TinkoffClient
+        self.tinkoff_client = client_class(
+            config.TINKOFF_TOKEN,
+            data_dir=config.DATA_DIRECTORY,
+            catalog_ttl=config.INSTRUMENT_CATALOG_TTL,
+            rate_limits=config.API_RATE_LIMITS,
+            price_cache_ttl=config.PRICE_CACHE_TTL,
+            **client_factories
+        )
+        
+        # Стрим последних цен вместо опроса get_last_prices на каждый отчет
+        self.price_stream = None
+        if config.MARKET_DATA_STREAM:
+            self.price_stream = LastPriceStream(
+                config.TINKOFF_TOKEN,
+                self._held_figis,
+                resubscribe_interval=config.STREAM_RESUBSCRIBE_INTERVAL,
+                **{key: factory for key, factory in client_factories.items() if key == "client_factory"}
+            )
+            self.tinkoff_client.attach_price_stream(self.price_stream, config.STREAM_MAX_PRICE_AGE)
+        
+        self.operations_ledger = OperationsLedger(
+            os.path.join(config.DATA_DIRECTORY, "operations_ledger.sqlite3")
+        )
+        self.portfolio_analyzer = PortfolioAnalyzer(self.tinkoff_client, self.operations_ledger)
+        self.race_tracker = RaceTracker(
+            self.tinkoff_client,
+            config.DATA_DIRECTORY,
+            max_workers=config.RACE_MAX_WORKERS,
+            account_timeout=config.RACE_ACCOUNT_TIMEOUT
+        )
+        self.telegram_bot = TelegramBot(
+            config.TELEGRAM_TOKEN, config.CHAT_ID,
+            file_ids_path=os.path.join(config.DATA_DIRECTORY, "telegram_file_ids.json"),
+            rate_limits=config.TELEGRAM_RATE_LIMITS
+        )
+        
+        # Выгрузка метрик этапов, запросов к API и Telegram
+        self.metrics_exporter = MetricsExporter(
+            file_path=config.METRICS_FILE or os.path.join(config.LOGS_DIRECTORY, "metrics.json"),
+            flush_interval=config.METRICS_FLUSH_INTERVAL,
+            port=config.METRICS_PORT
+        )
         self.report_formatter = ReportFormatter()
         
         # Инициализация обработчика команд
@@ -40,41 +109,88 @@ class Scheduler:
         
         logger.info("Планировщик инициализирован")
     
+    def _held_figis(self) -> list:
+        """FIGI бумаг на всех настроенных счетах (для подписки стрима цен)"""
+        account_ids = list(self.config.PORTFOLIO_ACCOUNTS.values())
+        if self.config.BOT_TRADER_ACCOUNT_ID:
+            account_ids.append(self.config.BOT_TRADER_ACCOUNT_ID)
+        
+        figis = []
+        for account_id in dict.fromkeys(account_ids):
+            try:
+                positions = self.tinkoff_client.fetch_positions(account_id)
+                figis.extend(
+                    position.figi for position in positions
+                    if position.instrument_type in ["share", "bond", "etf"]
+                )
+            except Exception as e:
+                logger.warning(f"Не удалось получить позиции счета {account_id} для стрима цен: {e}")
+        return figis
+    
     def run_daily_reports(self) -> None:
-        """Запуск ежедневных отчетов"""
+        """Запуск ежедневных отчетов
+        
+        Этапы выполняются графом задач: отчет по портфелю не зависит от
+        гонки, а построение графика идет параллельно с отправкой отчета о
+        гонке. Ошибка этапа пропускает только зависящие от него этапы.
+        """
         start_time = datetime.now()
         logger.info("=" * 60)
         logger.info("ЗАПУСК ЕЖЕДНЕВНЫХ ОТЧЕТОВ")
         logger.info("=" * 60)
+        channels_before = self.tinkoff_client.get_channel_stats()["channels_opened"]
         
-        try:
-            # 1. Отчет по портфелю "Бот-трейдер"
-            self._send_portfolio_report()
-            
-            # 2. Обновление данных гонки портфелей
-            self._update_race_data()
-            
-            # 3. Отчет о гонке портфелей
-            self._send_race_report()
-            
-            # 4. График гонки портфелей
-            self._send_race_chart()
-            
+        timeouts = {**DEFAULT_STAGE_TIMEOUTS, **self.config.STAGE_TIMEOUTS}
+        
+        def stage(name: str, func):
+            def run():
+                with span("scheduler_stage", stage=name):
+                    return func()
+            return run
+        
+        graph = TaskGraph(max_workers=4)
+        graph.add("portfolio_report", stage("portfolio_report", self._send_portfolio_report),
+                  timeout=timeouts["portfolio_report"])
+        graph.add("race_update", stage("race_update", self._update_race_data),
+                  timeout=timeouts["race_update"])
+        graph.add("race_report", stage("race_report", self._send_race_report),
+                  depends_on=["race_update"], timeout=timeouts["race_report"])
+        graph.add("race_chart_render", stage("race_chart_render", self._render_race_chart),
+                  depends_on=["race_update"], timeout=timeouts["race_chart_render"])
+        graph.add("race_chart_send",
+                  stage("race_chart_send", lambda: self._send_race_chart(graph.value("race_chart_render"))),
+                  depends_on=["race_chart_render", "race_report"], timeout=timeouts["race_chart_send"])
+        
+        with span("scheduler_run"):
+            results = graph.run()
+        
+        elapsed_time = (datetime.now() - start_time).total_seconds()
+        channel_stats = self.tinkoff_client.get_channel_stats()
+        logger.info(
+            f"gRPC-каналы: открыто {channel_stats['channels_opened'] - channels_before} за прогон, "
+            f"переподключений всего {channel_stats['reconnects']}"
+        )
+        for service, stats in self.tinkoff_client.get_rate_limit_stats().items():
+            logger.info(
+                f"Лимиты API {service}: запросов {stats['calls']}, макс. очередь {stats['max_queue_depth']}, "
+                f"ожидание ср. {stats['avg_wait']:.2f} / макс. {stats['max_wait']:.2f} сек, "
+                f"превышений {stats['throttled']}"
+            )
+        logger.info("Этапы: " + "; ".join(result.describe() for result in results.values()))
+        
+        failed = [result for result in results.values() if not result.ok]
+        if not failed:
             # Итоговое сообщение об успехе
-            elapsed_time = (datetime.now() - start_time).total_seconds()
             success_message = f"✅ *ОТЧЕТЫ ОТПРАВЛЕНЫ*\n\nВремя выполнения: {elapsed_time:.1f} сек"
             self.telegram_bot.send_message(success_message)
-            
             logger.info(f"Все отчеты отправлены успешно за {elapsed_time:.1f} сек")
-            
-        except Exception as e:
-            error_msg = f"Критическая ошибка в ежедневных отчетах: {e}"
-            logger.error(error_msg)
-            logger.error(traceback.format_exc())
+        else:
+            error_msg = "; ".join(result.describe() for result in failed)
+            logger.error(f"Ежедневные отчеты выполнены с ошибками: {error_msg}")
             
             # Отправляем уведомление об ошибке
             error_report = self.report_formatter.format_error_report(
-                error=str(e),
+                error=error_msg,
                 context="Ежедневные отчеты"
             )
             self.telegram_bot.send_message(error_report)
@@ -96,7 +212,7 @@ class Scheduler:
             portfolio_report = self.report_formatter.format_portfolio_report(portfolio_data)
             
             # Отправляем
-            if self.telegram_bot.send_message(portfolio_report):
+            if self.telegram_bot.send_message(portfolio_report, wait=True):
                 logger.info("Отчет по портфелю отправлен успешно")
             else:
                 raise Exception("Не удалось отправить отчет по портфелю")
@@ -119,8 +235,23 @@ class Scheduler:
                 raise ValueError(f"Недостаточно портфелей для гонки: {len(self.config.PORTFOLIO_ACCOUNTS)}")
             
             # Обновляем данные
-            self.race_tracker.update_daily_data(self.config.PORTFOLIO_ACCOUNTS)
-            logger.info("Данные гонки обновлены успешно")
+            result = self.race_tracker.update_daily_data(self.config.PORTFOLIO_ACCOUNTS)
+            
+            if not result["saved"]:
+                raise Exception("Не получено данных ни по одному портфелю")
+            
+            # Новые данные гонки: ответы команд рассчитываются заново
+            self.command_handler.responses.invalidate()
+            
+            if result["failed"] or not result["moex_loaded"]:
+                missing = list(result["failed"])
+                if not result["moex_loaded"]:
+                    missing.append("MOEX")
+                warning = f"Данные гонки сохранены частично, нет данных: {', '.join(missing)}"
+                logger.warning(warning)
+                self.telegram_bot.send_error_notification(warning)
+            else:
+                logger.info("Данные гонки обновлены успешно")
             
         except Exception as e:
             error_msg = f"Ошибка обновления данных гонки: {e}"
@@ -140,7 +271,7 @@ class Scheduler:
             race_report = self.report_formatter.format_race_report(race_data)
             
             # Отправляем
-            if self.telegram_bot.send_message(race_report):
+            if self.telegram_bot.send_message(race_report, wait=True):
                 logger.info("Отчет о гонке отправлен успешно")
             else:
                 raise Exception("Не удалось отправить отчет о гонке")
@@ -151,18 +282,18 @@ class Scheduler:
             self.telegram_bot.send_error_notification(error_msg)
             raise
     
-    def _send_race_chart(self) -> None:
+    def _render_race_chart(self):
+        """Построение графика гонки, возвращает путь к PNG (None, если данных мало)"""
+        logger.info("Создание графика гонки...")
+        return self.race_tracker.create_performance_chart()
+    
+    def _send_race_chart(self, chart_path) -> None:
         """Отправка графика гонки портфелей"""
         try:
-            logger.info("Создание графика гонки...")
-            
-            # Создаем график
-            chart_path = self.race_tracker.create_performance_chart()
-            
             if chart_path:
                 # Отправляем график
                 caption = "📈 График гонки портфелей"
-                if self.telegram_bot.send_photo(chart_path, caption):
+                if self.telegram_bot.send_photo(chart_path, caption, wait=True):
                     logger.info("График гонки отправлен успешно")
                 else:
                     raise Exception("Не удалось отправить график")
@@ -246,8 +377,16 @@ class Scheduler:
         logger.info(f"Планировщик запущен")
         logger.info(f"Отчеты будут отправляться ежедневно в {self.config.REPORT_TIME} ({self.config.TIMEZONE})")
         
+        # Сообщения отправляются из очереди, команды и отчеты не ждут Telegram
+        self.telegram_bot.start_sender()
+        
         # Запуск обработчика команд
-        self.command_handler.start_polling()
+        self.command_handler.start()
+        
+        if self.price_stream:
+            self.price_stream.start()
+        
+        self.metrics_exporter.start()
         
         # Отправляем уведомление о запуске
         startup_message = [
@@ -274,8 +413,16 @@ class Scheduler:
                 
             except KeyboardInterrupt:
                 logger.info("Получен сигнал остановки")
-                self.command_handler.stop_polling()
+                self.command_handler.stop()
+                if self.price_stream:
+                    self.price_stream.stop()
                 self.telegram_bot.send_message("🛑 *БОТ ОСТАНОВЛЕН*")
+                self.telegram_bot.stop_sender()
+                self.telegram_bot.close()
+                self.race_tracker.close()
+                self.tinkoff_client.close()
+                self.operations_ledger.close()
+                self.metrics_exporter.stop()
                 break
                 
             except Exception as e:
@@ -0,0 +1,145 @@
+"""Выполнение задач с зависимостями"""
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Статусы задач
+OK = "ok"
+FAILED = "failed"
+TIMEOUT = "timeout"
+SKIPPED = "skipped"
+
+
+class TaskResult:
+    """Итог выполнения задачи"""
+
+    def __init__(self, name: str, status: str, value: Any = None, error: Optional[BaseException] = None,
+                 elapsed: float = 0.0):
+        self.name = name
+        self.status = status
+        self.value = value
+        self.error = error
+        self.elapsed = elapsed
+
+    @property
+    def ok(self) -> bool:
+        return self.status == OK
+
+    def describe(self) -> str:
+        if self.status == FAILED:
+            return f"{self.name}: ошибка ({self.error})"
+        if self.status == TIMEOUT:
+            return f"{self.name}: превышено время ожидания"
+        if self.status == SKIPPED:
+            return f"{self.name}: пропущен ({self.error})"
+        return f"{self.name}: выполнен за {self.elapsed:.1f} сек"
+
+
+class _Task:
+    def __init__(self, name: str, func: Callable[[], Any], depends_on: List[str], timeout: Optional[float]):
+        self.name = name
+        self.func = func
+        self.depends_on = depends_on
+        self.timeout = timeout
+
+
+class TaskGraph:
+    """Граф задач: независимые задачи выполняются параллельно.
+
+    Задача запускается, когда все ее зависимости выполнены успешно. У
+    каждой задачи свой таймаут; при ошибке или таймауте пропускаются
+    только зависящие от нее задачи. Поток задачи с истекшим таймаутом
+    не прерывается, но ее результат больше не ожидается.
+    """
+
+    def __init__(self, max_workers: int = 4):
+        self.max_workers = max_workers
+        self._tasks: Dict[str, _Task] = {}
+        self.results: Dict[str, TaskResult] = {}
+
+    def add(self, name: str, func: Callable[[], Any], depends_on: Iterable[str] = (),
+            timeout: Optional[float] = None) -> "TaskGraph":
+        """Добавление задачи (зависимости должны быть добавлены раньше)"""
+        if name in self._tasks:
+            raise ValueError(f"Задача {name} уже добавлена")
+        depends_on = list(depends_on)
+        for dependency in depends_on:
+            if dependency not in self._tasks:
+                raise ValueError(f"Неизвестная зависимость {dependency} у задачи {name}")
+        self._tasks[name] = _Task(name, func, depends_on, timeout)
+        return self
+
+    def value(self, name: str) -> Any:
+        """Результат выполненной задачи"""
+        return self.results[name].value
+
+    def _run_task(self, task: _Task):
+        start_time = time.perf_counter()
+        try:
+            return TaskResult(task.name, OK, value=task.func(), elapsed=time.perf_counter() - start_time)
+        except Exception as e:
+            return TaskResult(task.name, FAILED, error=e, elapsed=time.perf_counter() - start_time)
+
+    def _skip_blocked(self, pending: Dict[str, _Task]) -> None:
+        """Пропуск задач, у которых зависимость завершилась неуспешно"""
+        changed = True
+        while changed:
+            changed = False
+            for name, task in list(pending.items()):
+                failed = [dep for dep in task.depends_on if dep in self.results and not self.results[dep].ok]
+                if failed:
+                    self.results[name] = TaskResult(name, SKIPPED, error=f"не выполнено: {', '.join(failed)}")
+                    logger.warning(f"Задача {name} пропущена: не выполнено {', '.join(failed)}")
+                    del pending[name]
+                    changed = True
+
+    def run(self) -> Dict[str, TaskResult]:
+        """Выполнение всех задач, возвращает результаты по именам"""
+        self.results = {}
+        pending = dict(self._tasks)
+        running = {}  # future -> (задача, срок)
+
+        executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="task")
+        try:
+            while pending or running:
+                # Запуск готовых задач
+                for name, task in list(pending.items()):
+                    if all(dep in self.results and self.results[dep].ok for dep in task.depends_on):
+                        deadline = time.monotonic() + task.timeout if task.timeout else None
+                        running[executor.submit(self._run_task, task)] = (task, deadline)
+                        del pending[name]
+
+                if not running:
+                    # Остались только задачи с неуспешными зависимостями
+                    self._skip_blocked(pending)
+                    break
+
+                deadlines = [deadline for _, deadline in running.values() if deadline is not None]
+                wait_timeout = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+                done, _ = wait(list(running), timeout=wait_timeout, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    task, _ = running.pop(future)
+                    result = future.result()
+                    self.results[task.name] = result
+                    if result.ok:
+                        logger.info(f"Задача {task.name} выполнена за {result.elapsed:.1f} сек")
+                    else:
+                        logger.error(f"Задача {task.name} завершилась с ошибкой: {result.error}",
+                                     exc_info=result.error)
+
+                now = time.monotonic()
+                for future, (task, deadline) in list(running.items()):
+                    if deadline is not None and now >= deadline and not future.done():
+                        running.pop(future)
+                        self.results[task.name] = TaskResult(task.name, TIMEOUT, elapsed=task.timeout)
+                        logger.error(f"Задача {task.name} не уложилась в {task.timeout} сек")
+
+                self._skip_blocked(pending)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        return self.results
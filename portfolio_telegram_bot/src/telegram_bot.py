@@ -1,36 +1,127 @@
 """Telegram бот"""
+import json
 import logging
+import os
+import threading
 import time
-from typing import List
+from typing import Dict, List, Optional
 import requests
+from requests.adapters import HTTPAdapter
+from .metrics import REGISTRY, span
+from .outbound_queue import OutboundQueue
+from .rate_limiter import TokenBucket
 
 logger = logging.getLogger(__name__)
 
+# Размеры пулов соединений: отправка (несколько потоков) и long polling
+SEND_POOL_SIZE = 4
+POLL_POOL_SIZE = 1
+
+# Лимиты отправки Telegram в минуту: личный чат, группа (отрицательный chat_id) и всего
+DEFAULT_TELEGRAM_RATE_LIMITS = {"chat": 60, "group": 20, "global": 1800}
+
+# Допустимые серии сообщений подряд без ожидания
+TELEGRAM_BURSTS = {"chat": 3, "group": 1, "global": 30}
+
+# Сколько file_id фото хранить (как и графиков в кэше RaceTracker)
+FILE_IDS_LIMIT = 10
+
+
+def _session(pool_size: int) -> requests.Session:
+    """Сессия с keep-alive и пулом соединений заданного размера"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
 class TelegramBot:
-    def __init__(self, token: str, chat_id: int):
+    def __init__(self, token: str, chat_id: int, file_ids_path: Optional[str] = None,
+                 rate_limits: Optional[Dict[str, int]] = None, queue_size: int = 1000):
         self.token = token
         self.chat_id = chat_id
         self.api_url = f"https://api.telegram.org/bot{token}"
         self.max_message_length = 4096
         self.max_retries = 3
         self.retry_delay = 2  # секунды
+        self.max_rate_limited = 5  # повторов после ответа 429 (не входят в max_retries)
+        
+        # Отдельные пулы: долгий getUpdates не занимает соединения отправки
+        self._sessions = {"send": _session(SEND_POOL_SIZE), "poll": _session(POLL_POOL_SIZE)}
+        self._opened = {"send": 0, "poll": 0}
+        self._requests = {"send": 0, "poll": 0}
+        self._stats_lock = threading.Lock()
+        
+        # file_id загруженных фото: повторная отправка без загрузки файла
+        self.file_ids_path = file_ids_path
+        self._file_ids_lock = threading.Lock()
+        self._file_ids = self._load_file_ids()
+        
+        # Темп отправки по чатам и общий; очередь включается start_sender()
+        self.rate_limits = {**DEFAULT_TELEGRAM_RATE_LIMITS, **(rate_limits or {})}
+        self._global_bucket = TokenBucket(self.rate_limits["global"], TELEGRAM_BURSTS["global"])
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._buckets_lock = threading.Lock()
+        self.outbound = OutboundQueue(self._deliver, queue_size)
+    
+    def _call(self, method: str, data: dict = None, files: dict = None) -> Optional[Dict]:
+        """Запрос к Telegram API с замером длительности, возвращает ответ (None при ошибке)"""
+        with span("telegram_request", method=method):
+            result = self._request_with_retries(method, data, files)
+        if result is None:
+            REGISTRY.inc("telegram_request_failures_total", method=method)
+        return result
     
     def _make_request(self, method: str, data: dict = None, files: dict = None) -> bool:
-        """Выполнение запроса к Telegram API с retry механизмом"""
+        """Выполнение запроса к Telegram API"""
+        return self._call(method, data, files) is not None
+    
+    def _request_with_retries(self, method: str, data: dict = None, files: dict = None) -> Optional[Dict]:
+        """Выполнение запроса к Telegram API с retry механизмом
+        
+        Ответы 429 не расходуют попытки max_retries: после ожидания
+        retry_after запрос повторяется, но не больше max_rate_limited раз.
+        """
         url = f"{self.api_url}/{method}"
+        chat_id = (data or {}).get('chat_id')
+        attempt = 0
+        rate_limited = 0
         
-        for attempt in range(self.max_retries):
+        while attempt < self.max_retries:
             try:
+                if chat_id is not None:
+                    self._pace(chat_id)
+                
                 if files:
-                    response = requests.post(url, data=data, files=files, timeout=30)
+                    for file in files.values():
+                        file.seek(0)  # повторная попытка отправляет файл с начала
+                    response = self._request("send", "post", url, data=data, files=files, timeout=30)
                 else:
-                    response = requests.post(url, json=data, timeout=30)
+                    response = self._request("send", "post", url, json=data, timeout=30)
+                
+                if response.status_code == 429:
+                    # Сервер сообщает, через сколько секунд можно повторить
+                    rate_limited += 1
+                    retry_after = self._retry_after(response)
+                    REGISTRY.inc("telegram_rate_limited_total", method=method)
+                    if rate_limited > self.max_rate_limited:
+                        logger.error(f"Лимит Telegram ({method}) превышен {rate_limited} раз, сообщение не отправлено")
+                        return None
+                    logger.warning(f"Превышен лимит Telegram ({method}), повтор через {retry_after:.0f} сек")
+                    self._pause(chat_id, retry_after)
+                    continue
+                
+                if 400 <= response.status_code < 500:
+                    # Запрос отклонен (например, устаревший file_id): повтор не поможет
+                    REGISTRY.inc("telegram_rejected_total", method=method)
+                    logger.warning(f"Telegram отклонил {method}: {response.status_code} {self._description(response)}")
+                    return None
                 
                 response.raise_for_status()
                 
                 result = response.json()
                 if result.get('ok'):
-                    return True
+                    return result
                 else:
                     logger.warning(f"Telegram API error: {result.get('description')}")
                     
@@ -38,27 +129,109 @@ class TelegramBot:
                 logger.warning(f"Attempt {attempt + 1}/{self.max_retries} failed: {e}")
                 
                 if attempt < self.max_retries - 1:
-                    time.sleep(self.retry_delay * (attempt + 1))  # Exponential backoff
+                    time.sleep(self.retry_delay * 2 ** attempt)  # Exponential backoff
                 else:
                     logger.error(f"All {self.max_retries} attempts failed for {method}")
-                    return False
+                    return None
             
             except Exception as e:
                 logger.error(f"Unexpected error in Telegram API call: {e}")
-                return False
+                return None
+            
+            attempt += 1
         
-        return False
+        return None
+    
+    @staticmethod
+    def _description(response: requests.Response) -> str:
+        try:
+            return str(response.json().get('description', ''))
+        except (ValueError, AttributeError):
+            return ""
+    
+    def _retry_after(self, response: requests.Response) -> float:
+        try:
+            return float(response.json().get('parameters', {}).get('retry_after', self.retry_delay))
+        except (ValueError, TypeError, AttributeError):
+            return float(self.retry_delay)
+    
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        with self._buckets_lock:
+            bucket = self._chat_buckets.get(chat_id)
+            if bucket is None:
+                kind = "group" if int(chat_id) < 0 else "chat"
+                bucket = self._chat_buckets[chat_id] = TokenBucket(self.rate_limits[kind], TELEGRAM_BURSTS[kind])
+            return bucket
+    
+    def _pace(self, chat_id: int) -> None:
+        """Ожидание очереди отправки по лимитам чата и общему"""
+        delay = max(self._chat_bucket(chat_id).reserve(), self._global_bucket.reserve())
+        if delay > 0:
+            REGISTRY.observe("telegram_pacing_wait_seconds", delay)
+            time.sleep(delay)
+    
+    def _pause(self, chat_id: Optional[int], seconds: float) -> None:
+        """Приостановка отправки в чат (и всей отправки без чата) по retry_after"""
+        if chat_id is None:
+            self._global_bucket.pause(seconds)
+        else:
+            self._chat_bucket(chat_id).pause(seconds)
     
-    def send_message(self, text: str, parse_mode='Markdown') -> bool:
-        """Отправка сообщения"""
+    def _request(self, pool: str, http_method: str, url: str, **kwargs) -> requests.Response:
+        """HTTP-запрос через сессию пула с учетом новых соединений"""
+        try:
+            return self._sessions[pool].request(http_method, url, **kwargs)
+        finally:
+            self._count_connections(pool)
+    
+    def _count_connections(self, pool: str) -> None:
+        """Учет запросов и новых соединений пула (по счетчикам urllib3)"""
+        adapter = self._sessions[pool].get_adapter(self.api_url)
+        pools = adapter.poolmanager.pools
+        opened = sum(pools[key].num_connections for key in pools.keys())
+        with self._stats_lock:
+            new_connections = max(0, opened - self._opened[pool])
+            self._opened[pool] = max(opened, self._opened[pool])
+            self._requests[pool] += 1
+        REGISTRY.inc("telegram_http_requests_total", pool=pool)
+        if new_connections:
+            REGISTRY.inc("telegram_connections_opened_total", new_connections, pool=pool)
+    
+    def connection_stats(self) -> Dict[str, Dict[str, int]]:
+        """Запросы, открытые и повторно использованные соединения по пулам"""
+        with self._stats_lock:
+            return {
+                pool: {
+                    "requests": self._requests[pool],
+                    "connections_opened": self._opened[pool],
+                    "connections_reused": max(0, self._requests[pool] - self._opened[pool]),
+                }
+                for pool in self._sessions
+            }
+    
+    def close(self) -> None:
+        """Закрытие соединений"""
+        for session in self._sessions.values():
+            session.close()
+    
+    def send_message(self, text: str, parse_mode='Markdown', wait: bool = False) -> bool:
+        """Отправка сообщения
+        
+        При запущенной очереди сообщение ставится в очередь; с wait=True
+        вызов ждет отправки и возвращает ее результат.
+        """
         if not text.strip():
             logger.warning("Попытка отправить пустое сообщение")
             return False
         
         # Если сообщение слишком длинное, разбиваем его
         if len(text) > self.max_message_length:
-            return self.send_long_message(text, parse_mode)
+            return self.send_long_message(text, parse_mode, wait)
         
+        return self._submit({"kind": "message", "text": text, "parse_mode": parse_mode}, wait)
+    
+    def _send_text(self, text: str, parse_mode='Markdown') -> bool:
+        """Отправка одного сообщения (не длиннее max_message_length)"""
         data = {
             'chat_id': self.chat_id,
             'text': text,
@@ -73,24 +246,83 @@ class TelegramBot:
         
         return success
     
-    def send_photo(self, photo_path: str, caption: str = "") -> bool:
-        """Отправка фото"""
+    def _load_file_ids(self) -> Dict[str, str]:
+        if not self.file_ids_path or not os.path.exists(self.file_ids_path):
+            return {}
+        try:
+            with open(self.file_ids_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Не удалось прочитать file_id фото {self.file_ids_path}: {e}")
+            return {}
+    
+    def _save_file_ids(self) -> None:
+        """Атомарная запись file_id (вызывается под _file_ids_lock)"""
+        if not self.file_ids_path:
+            return
+        tmp_path = f"{self.file_ids_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._file_ids, f, ensure_ascii=False)
+        os.replace(tmp_path, self.file_ids_path)
+    
+    def _remember_file_id(self, key: str, file_id: Optional[str]) -> None:
+        """Запись file_id; хранятся только последние FILE_IDS_LIMIT существующих файлов"""
+        with self._file_ids_lock:
+            self._file_ids.pop(key, None)
+            if file_id:
+                self._file_ids[key] = file_id
+            for stale in [k for k in self._file_ids if not os.path.exists(k.rsplit(':', 2)[0])]:
+                del self._file_ids[stale]
+            for stale in list(self._file_ids)[:-FILE_IDS_LIMIT]:
+                del self._file_ids[stale]
+            self._save_file_ids()
+    
+    @staticmethod
+    def _photo_key(photo_path: str) -> str:
+        """Ключ файла: путь, размер и время изменения (измененный файл загружается заново)"""
+        stat = os.stat(photo_path)
+        return f"{os.path.abspath(photo_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+    
+    def send_photo(self, photo_path: str, caption: str = "", wait: bool = False) -> bool:
+        """Отправка фото (через очередь, если она запущена)"""
+        if not os.path.exists(photo_path):
+            logger.error(f"Файл не найден: {photo_path}")
+            return False
+        return self._submit({"kind": "photo", "photo_path": photo_path, "caption": caption}, wait)
+    
+    def _send_photo(self, photo_path: str, caption: str = "") -> bool:
+        """Отправка фото (повторно — по file_id, без загрузки файла)"""
         try:
+            data = {
+                'chat_id': self.chat_id,
+                'caption': caption[:1024] if caption else "",  # Ограничение Telegram
+                'parse_mode': 'Markdown'
+            }
+            key = self._photo_key(photo_path)
+            
+            file_id = self._file_ids.get(key)
+            if file_id:
+                if self._make_request('sendPhoto', {**data, 'photo': file_id}):
+                    REGISTRY.inc("telegram_photo_reuses_total")
+                    logger.info(f"Фото отправлено по file_id: {photo_path}")
+                    return True
+                logger.warning(f"file_id не принят, фото будет загружено заново: {photo_path}")
+                self._remember_file_id(key, None)
+            
             with open(photo_path, 'rb') as photo:
-                files = {'photo': photo}
-                data = {
-                    'chat_id': self.chat_id,
-                    'caption': caption[:1024] if caption else "",  # Ограничение Telegram
-                    'parse_mode': 'Markdown'
-                }
-                
-                success = self._make_request('sendPhoto', data, files)
-                if success:
-                    logger.info(f"Фото отправлено: {photo_path}")
-                else:
-                    logger.error(f"Не удалось отправить фото: {photo_path}")
-                
-                return success
+                result = self._call('sendPhoto', data, {'photo': photo})
+            
+            if result is None:
+                logger.error(f"Не удалось отправить фото: {photo_path}")
+                return False
+            
+            REGISTRY.inc("telegram_photo_uploads_total")
+            # Последний размер в ответе — оригинал
+            sizes = (result.get('result') or {}).get('photo') or []
+            if sizes:
+                self._remember_file_id(key, sizes[-1].get('file_id'))
+            logger.info(f"Фото отправлено: {photo_path}")
+            return True
                 
         except FileNotFoundError:
             logger.error(f"Файл не найден: {photo_path}")
@@ -99,27 +331,67 @@ class TelegramBot:
             logger.error(f"Ошибка отправки фото: {e}")
             return False
     
-    def send_long_message(self, text: str, parse_mode='Markdown') -> bool:
-        """Отправка длинного сообщения с корректной разбивкой"""
+    def send_long_message(self, text: str, parse_mode='Markdown', wait: bool = False) -> bool:
+        """Отправка длинного сообщения с корректной разбивкой
+        
+        Все части ставятся в очередь одним элементом, поэтому части двух
+        отчетов, отправляемых одновременно, не перемешиваются в чате.
+        """
         if len(text) <= self.max_message_length:
-            return self.send_message(text, parse_mode)
+            return self.send_message(text, parse_mode, wait)
         
         parts = self._split_message(text)
+        return self._submit({"kind": "parts", "parts": parts, "parse_mode": parse_mode}, wait)
+    
+    def _send_parts(self, parts: List[str], parse_mode='Markdown') -> bool:
+        """Отправка частей длинного сообщения по порядку"""
         all_sent = True
         
         for i, part in enumerate(parts):
             logger.info(f"Отправка части {i+1}/{len(parts)}")
             
-            if not self.send_message(part, parse_mode):
+            # Темп между частями задают лимиты отправки (_pace)
+            if not self._send_text(part, parse_mode):
                 all_sent = False
                 logger.error(f"Не удалось отправить часть {i+1}")
-            
-            # Небольшая задержка между сообщениями
-            if i < len(parts) - 1:
-                time.sleep(1)
         
         return all_sent
     
+    # Очередь исходящих сообщений
+    
+    def start_sender(self) -> None:
+        """Запуск потока отправки: send_message/send_photo ставят сообщения в очередь"""
+        self.outbound.start()
+    
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Ожидание отправки всех сообщений из очереди"""
+        return self.outbound.flush(timeout)
+    
+    def stop_sender(self, timeout: float = 30) -> None:
+        """Отправка оставшихся сообщений и остановка потока отправки"""
+        self.outbound.stop(timeout)
+    
+    def _submit(self, item: Dict, wait: bool = False) -> bool:
+        """Отправка через очередь, если она запущена, иначе сразу
+        
+        Без wait результат из очереди — только факт постановки.
+        """
+        if not self.outbound.running:
+            return self._deliver(item)
+        
+        result = self.outbound.put(item)
+        if result is None:
+            return False
+        return result.result() if wait else True
+    
+    def _deliver(self, item: Dict) -> bool:
+        """Отправка сообщения из очереди"""
+        if item["kind"] == "photo":
+            return self._send_photo(item["photo_path"], item["caption"])
+        if item["kind"] == "parts":
+            return self._send_parts(item["parts"], item["parse_mode"])
+        return self._send_text(item["text"], item["parse_mode"])
+    
     def _split_message(self, text: str) -> List[str]:
         """Умная разбивка длинного текста на части"""
         if len(text) <= self.max_message_length:
@@ -196,7 +468,7 @@ class TelegramBot:
                 'allowed_updates': ['message']
             }
             
-            response = requests.get(url, params=params, timeout=timeout + 5)
+            response = self._request("poll", "get", url, params=params, timeout=timeout + 5)
             response.raise_for_status()
             
             return response.json()
@@ -205,6 +477,17 @@ class TelegramBot:
             logger.error(f"Ошибка получения обновлений: {e}")
             return {'ok': False, 'result': []}
     
+    def set_webhook(self, url: str, secret_token: str = "") -> bool:
+        """Регистрация webhook: Telegram будет присылать обновления на url"""
+        data = {'url': url, 'allowed_updates': ['message']}
+        if secret_token:
+            data['secret_token'] = secret_token
+        return self._make_request('setWebhook', data)
+    
+    def delete_webhook(self) -> bool:
+        """Удаление webhook (после этого снова работает getUpdates)"""
+        return self._make_request('deleteWebhook', {'drop_pending_updates': False})
+    
     def set_commands(self, commands: list) -> bool:
         """Установка списка команд бота"""
         try:
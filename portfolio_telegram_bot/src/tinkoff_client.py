@@ -1,263 +1,177 @@
 """Работа с API Тинькофф"""
 import logging
-import time
-from datetime import datetime, timedelta
-from decimal import Decimal
-from typing import Dict, List, Optional
+import os
+from datetime import timedelta
+from typing import Callable, Dict, List, Optional
 from tinkoff.invest import Client, RequestError
-from tinkoff.invest.schemas import MoneyValue, Quotation
+from .channel_manager import ChannelManager
+from .instrument_catalog import InstrumentCatalog
+from .money import Money
+from .portfolio_valuation import PortfolioValuator
+from .price_table import PriceFetchPlanner, PriceTable
+from .rate_limiter import RateLimiter
+from .valuation_engine import ValuationEngine
 
 logger = logging.getLogger(__name__)
 
 class TinkoffClient:
-    def __init__(self, token: str):
+    def __init__(self, token: str, data_dir: Optional[str] = None, catalog_ttl: int = 86400,
+                 rate_limits: Optional[Dict[str, int]] = None, client_factory: Callable = Client,
+                 price_cache_ttl: float = 0):
         self.token = token
-        self._currency_cache = {}
-        self._cache_expiry = {}
         self.cache_duration = 3600  # 60 минут
+        
+        # Общий gRPC-канал для всех методов клиента, запросы идут через лимиты по сервисам
+        self.rate_limiter = RateLimiter(rate_limits)
+        self.channel = ChannelManager(token, client_factory=client_factory, rate_limiter=self.rate_limiter)
+        
+        # Справочник инструментов вместо запросов *_by на каждую позицию
+        catalog_path = os.path.join(data_dir, "instruments_catalog.json") if data_dir else None
+        self.instrument_catalog = InstrumentCatalog(self.services, catalog_path, catalog_ttl)
+        
+        # Общий расчет стоимости (тот же, что в скриптах), с кэшем цен и курсов
+        self.valuator = PortfolioValuator(
+            self.services, self.instrument_catalog, price_cache_ttl, rates_cache_ttl=self.cache_duration
+        )
+        
+        # Стрим последних цен (опционально, см. attach_price_stream)
+        self.price_stream = None
+        self.stream_max_age = 60
+    
+    def services(self):
+        """Сервисы API на общем канале (замена `with Client(token)`)"""
+        return self.channel.services()
     
-    def quotation_to_decimal(self, quotation: Quotation) -> Decimal:
-        """Конвертация Quotation в Decimal"""
-        return Decimal(str(quotation.units)) + Decimal(str(quotation.nano)) / Decimal("1000000000")
+    def attach_price_stream(self, stream, max_age: float = 60) -> None:
+        """Подключение стрима последних цен: свежие цены берутся из него без запроса"""
+        self.price_stream = stream
+        self.stream_max_age = max_age
+        self.valuator.attach_price_stream(stream, max_age)
     
-    def money_value_to_decimal(self, money: MoneyValue) -> Decimal:
-        """Конвертация MoneyValue в Decimal"""
-        return Decimal(str(money.units)) + Decimal(str(money.nano)) / Decimal("1000000000")
+    def _fetch_prices(self, planner: PriceFetchPlanner, client) -> PriceTable:
+        """Загрузка цен по плану с учетом стрима или кэша цен"""
+        return self.valuator.fetch_prices(planner, client)
     
-    def get_currency_rates(self) -> Dict[str, float]:
-        """Получение курсов валют с кэшированием"""
-        now = time.time()
+    def get_channel_stats(self) -> Dict[str, int]:
+        """Счетчики gRPC-канала"""
+        return self.channel.stats()
+    
+    def get_rate_limit_stats(self) -> Dict[str, Dict[str, float]]:
+        """Очереди и ожидание запросов по сервисам API"""
+        return self.rate_limiter.stats()
+    
+    def dedicated(self, call_timeout: Optional[float] = None) -> "TinkoffClient":
+        """Клиент на отдельном gRPC-канале с общими лимитами, справочником и кэшем цен
         
-        # Проверяем кэш
-        if (self._currency_cache and 
-            self._cache_expiry.get('currency', 0) > now):
-            return self._currency_cache.copy()
+        Срок ответа call_timeout действует только на запросы этого канала
+        и не затрагивает остальных пользователей общего канала.
+        """
+        client = TinkoffClient.__new__(TinkoffClient)
+        client.token = self.token
+        client.cache_duration = self.cache_duration
+        client.rate_limiter = self.rate_limiter
+        client.channel = ChannelManager(self.token, client_factory=self.channel.client_factory,
+                                        rate_limiter=self.rate_limiter, call_timeout=call_timeout)
+        client.instrument_catalog = self.instrument_catalog
+        client.valuator = self.valuator.with_services(client.services)
+        client.price_stream = self.price_stream
+        client.stream_max_age = self.stream_max_age
+        return client
+    
+    def close(self) -> None:
+        """Закрытие канала при остановке бота"""
+        self.instrument_catalog.close()
+        self.channel.close()
+    
+    def get_currency_rates(self, price_table: Optional[PriceTable] = None) -> Dict[str, float]:
+        """Получение курсов валют с кэшированием
         
-        rates = {"RUB": 1.0}
+        Если передана таблица цен, курсы берутся из нее без отдельного запроса.
+        """
+        if price_table is not None:
+            # Недостающие курсы берутся из кэша или дефолтных значений
+            return self.valuator.currency_rates(price_table)
+        
+        # Проверяем кэш (со стримом курсы и так берутся из памяти)
+        if self.price_stream is None and self.valuator.rates_cached:
+            return self.valuator.cached_currency_rates()
         
         try:
-            with Client(self.token) as client:
-                # USD/RUB
-                try:
-                    usd_response = client.market_data.get_last_prices(figi=["BBG0013HGFT4"])
-                    if usd_response.last_prices:
-                        rates["USD"] = float(self.quotation_to_decimal(usd_response.last_prices[0].price))
-                except RequestError:
-                    rates["USD"] = 90.0  # Fallback
-                
-                # EUR/RUB
-                try:
-                    eur_response = client.market_data.get_last_prices(figi=["BBG0013HJJ31"])
-                    if eur_response.last_prices:
-                        rates["EUR"] = float(self.quotation_to_decimal(eur_response.last_prices[0].price))
-                except RequestError:
-                    rates["EUR"] = 100.0  # Fallback
-                
-                # Обновляем кэш
-                self._currency_cache = rates.copy()
-                self._cache_expiry['currency'] = now + self.cache_duration
+            with self.services() as client:
+                # USD/RUB и EUR/RUB одним запросом
+                price_table = self._fetch_prices(PriceFetchPlanner().add_currencies(), client)
+            return self.get_currency_rates(price_table)
                 
         except Exception as e:
             logger.warning(f"Ошибка получения курсов валют: {e}")
             # Возвращаем кэш или дефолтные значения
-            if self._currency_cache:
-                return self._currency_cache.copy()
-            rates.update({"USD": 90.0, "EUR": 100.0})
-        
-        return rates
+            return self.valuator.cached_currency_rates()
     
-    def get_moex_index_price(self) -> Optional[float]:
+    def get_moex_index_price(self, price_table: Optional[PriceTable] = None) -> Optional[float]:
         """Получение текущего значения индекса MOEX"""
+        if price_table is not None:
+            return price_table.moex_index()
+        
         try:
-            with Client(self.token) as client:
-                moex_figi = "BBG004730ZJ9"
-                response = client.market_data.get_last_prices(figi=[moex_figi])
-                
-                if response.last_prices:
-                    return float(self.quotation_to_decimal(response.last_prices[0].price))
+            with self.services() as client:
+                return self._fetch_prices(PriceFetchPlanner().add_benchmark(), client).moex_index()
                 
         except RequestError as e:
             logger.error(f"Ошибка получения индекса MOEX: {e}")
         
         return None
     
-    def get_portfolio_data(self, account_id: str) -> Dict:
-        """Получение полных данных портфеля"""
+    def fetch_positions(self, account_id: str) -> List:
+        """Получение позиций портфеля (без оценки)"""
+        with self.services() as client:
+            return client.operations.get_portfolio(account_id=account_id).positions
+    
+    def build_price_table(self, planner: PriceFetchPlanner) -> PriceTable:
+        """Загрузка цен по плану одним пакетным запросом"""
+        with self.services() as client:
+            return self._fetch_prices(planner, client)
+    
+    def get_portfolio_data(self, account_id: str, price_table: Optional[PriceTable] = None,
+                           positions: Optional[List] = None, details: bool = True) -> Dict:
+        """Получение полных данных портфеля
+        
+        Args:
+            account_id: ID счета
+            price_table: Общая таблица цен (если None, цены позиций и валют загружаются одним запросом)
+            positions: Уже полученные позиции (если None, запрашиваются)
+            details: Загружать стоп-заявки и название счета
+        """
         try:
-            with Client(self.token) as client:
-                # Получение портфеля
-                portfolio_response = client.operations.get_portfolio(account_id=account_id)
-                positions = portfolio_response.positions
-                
-                # Получение курсов валют
-                currency_rates = self.get_currency_rates()
-                
-                # Получение информации об инструментах
-                instruments_info = {}
-                figis_for_prices = []
-                
-                for position in positions:
-                    if position.instrument_type in ["share", "bond", "etf"] and position.quantity.units > 0:
-                        figi = position.figi
-                        figis_for_prices.append(figi)
-                        
-                        try:
-                            if position.instrument_type == "share":
-                                instrument_response = client.instruments.share_by(id_type=1, id=figi)
-                            elif position.instrument_type == "bond":
-                                instrument_response = client.instruments.bond_by(id_type=1, id=figi)
-                            elif position.instrument_type == "etf":
-                                instrument_response = client.instruments.etf_by(id_type=1, id=figi)
-                            
-                            instruments_info[figi] = {
-                                'ticker': instrument_response.instrument.ticker,
-                                'name': instrument_response.instrument.name,
-                                'currency': instrument_response.instrument.currency,
-                                'type': position.instrument_type,
-                            }
-                        except RequestError:
-                            instruments_info[figi] = {
-                                'ticker': f"UNKNOWN_{figi[:8]}",
-                                'name': "Unknown instrument", 
-                                'currency': 'RUB',
-                                'type': position.instrument_type,
-                            }
-                
-                # Получение текущих цен
-                current_prices = {}
-                if figis_for_prices:
-                    try:
-                        prices_response = client.market_data.get_last_prices(figi=figis_for_prices)
-                        for price in prices_response.last_prices:
-                            current_prices[price.figi] = self.quotation_to_decimal(price.price)
-                    except RequestError:
-                        pass
-                
-                # Получение стоп-заявок
-                stop_orders = {}
-                try:
-                    stop_orders_response = client.stop_orders.get_stop_orders(account_id=account_id)
-                    for order in stop_orders_response.stop_orders:
-                        if order.direction.name == "STOP_ORDER_DIRECTION_SELL":
-                            stop_orders[order.figi] = self.quotation_to_decimal(order.stop_price)
-                except RequestError:
-                    pass
-                
-                # Получение информации о счете
-                account_name = "Unknown Account"
-                try:
-                    accounts_response = client.users.get_accounts()
-                    for account in accounts_response.accounts:
-                        if account.id == account_id:
-                            account_name = account.name
-                            break
-                except RequestError:
-                    pass
-                
-                # Обработка позиций
-                portfolio_positions = []
-                total_value_rub = Decimal("0")
-                total_pnl_rub = Decimal("0")
-                cash_balances = {}
-                
-                for position in positions:
-                    figi = position.figi
-                    instrument_type = position.instrument_type
-                    quantity = self.quotation_to_decimal(position.quantity)
-                    
-                    if instrument_type == "currency":
-                        # Валютные позиции (наличные)
-                        if figi == "RUB000UTSTOM":
-                            cash_balances["RUB"] = quantity
-                        elif figi == "USD000UTSTOM":
-                            cash_balances["USD"] = quantity
-                        elif figi == "EUR000UTSTOM":
-                            cash_balances["EUR"] = quantity
-                        continue
-                    
-                    if quantity <= 0 or instrument_type not in ["share", "bond", "etf"]:
-                        continue
-                    
-                    instrument_info = instruments_info.get(figi, {})
-                    ticker = instrument_info.get('ticker', 'UNKNOWN')
-                    currency = instrument_info.get('currency', 'RUB')
-                    
-                    # Средняя цена покупки
-                    avg_price = self.money_value_to_decimal(position.average_position_price)
-                    
-                    # Текущая цена
-                    current_price = current_prices.get(figi, Decimal("0"))
-                    
-                    # Конвертация в рубли
-                    rate = Decimal(str(currency_rates.get(currency, 1.0)))
-                    avg_price_rub = avg_price * rate if currency != "RUB" else avg_price
-                    current_price_rub = current_price * rate if currency != "RUB" else current_price
-                    
-                    total_position_value = current_price_rub * quantity
-                    position_pnl = total_position_value - (avg_price_rub * quantity)
-                    
-                    total_value_rub += total_position_value
-                    total_pnl_rub += position_pnl
-                    
-                    stop_loss = stop_orders.get(figi)
-                    
-                    position_data = {
-                        "ticker": ticker,
-                        "figi": figi,
-                        "instrument_type": instrument_type,
-                        "name": instrument_info.get('name', 'Unknown'),
-                        "currency": currency,
-                        "shares": float(quantity),
-                        "cost_basis": float(avg_price),
-                        "cost_basis_rub": float(avg_price_rub),
-                        "stop_loss": float(stop_loss) if stop_loss else None,
-                        "current_price": float(current_price),
-                        "current_price_rub": float(current_price_rub),
-                        "total_value": float(total_position_value),
-                        "pnl": float(position_pnl),
-                        "pnl_percent": float((position_pnl / (avg_price_rub * quantity)) * 100) if avg_price_rub * quantity > 0 else 0
-                    }
-                    
-                    portfolio_positions.append(position_data)
-                
-                # Подсчет общего баланса наличных в рублях
-                total_cash_rub = Decimal("0")
-                for curr, amount in cash_balances.items():
-                    rate = Decimal(str(currency_rates.get(curr, 1.0)))
-                    total_cash_rub += amount * rate
-                
-                total_equity = total_value_rub + total_cash_rub
-                
-                return {
-                    "date": datetime.now().isoformat(),
-                    "account_id": account_id,
-                    "account_name": account_name,
-                    "currency_rates": currency_rates,
-                    "positions": portfolio_positions,
-                    "summary": {
-                        "total_positions_value": float(total_value_rub),
-                        "total_pnl": float(total_pnl_rub),
-                        "cash_balance_rub": float(total_cash_rub),
-                        "cash_balances": {k: float(v) for k, v in cash_balances.items()},
-                        "total_equity": float(total_equity),
-                        "positions_count": len(portfolio_positions),
-                    }
-                }
-                
+            return self.valuator.portfolio_data(account_id, positions, price_table, details)
         except Exception as e:
             logger.error(f"Ошибка получения портфеля {account_id}: {e}")
             raise
     
-    def get_portfolio_value(self, account_id: str) -> Dict:
+    @staticmethod
+    def _build_portfolio_data(account_id: str, account_name: str, positions: List,
+                              instruments_info: Dict, current_prices: Dict[str, Money],
+                              stop_orders: Dict[str, Money], currency_rates: Dict[str, float]) -> Dict:
+        """Расчет стоимости и P&L по уже полученным данным API"""
+        engine = ValuationEngine().add_account(account_id, positions, instruments_info, account_name, stop_orders)
+        return engine.value(current_prices, currency_rates).portfolio_data(account_id)
+    
+    def get_portfolio_value(self, account_id: str, price_table: Optional[PriceTable] = None,
+                            positions: Optional[List] = None) -> Dict:
         """Упрощенное получение стоимости портфеля для гонки"""
         try:
-            portfolio_data = self.get_portfolio_data(account_id)
-            return {
-                "total_equity": portfolio_data["summary"]["total_equity"],
-                "positions_value": portfolio_data["summary"]["total_positions_value"], 
-                "cash_balance": portfolio_data["summary"]["cash_balance_rub"],
-                "positions_count": portfolio_data["summary"]["positions_count"]
-            }
+            if positions is None:
+                positions = self.fetch_positions(account_id)
+            return self.get_portfolio_values({account_id: positions}, price_table)[account_id]
         except Exception as e:
             logger.error(f"Ошибка получения стоимости портфеля {account_id}: {e}")
-            return None
\ No newline at end of file
+            return None
+    
+    def get_portfolio_values(self, account_positions: Dict[str, List],
+                             price_table: Optional[PriceTable] = None) -> Dict[str, Dict]:
+        """Стоимость нескольких портфелей за один проход оценки
+        
+        Args:
+            account_positions: Позиции по ID счетов
+            price_table: Общая таблица цен (если None, загружается одним запросом для всех счетов)
+        """
+        return self.valuator.portfolio_values(account_positions, price_table)
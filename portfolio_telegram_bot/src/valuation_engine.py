@@ -0,0 +1,221 @@
+"""Пакетная оценка позиций в столбцах NumPy"""
+import logging
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+import numpy as np
+from .money import NANO, Money, to_nano
+
+logger = logging.getLogger(__name__)
+
+# Типы инструментов, которые оцениваются по рыночной цене
+VALUED_TYPES = ("share", "bond", "etf")
+
+# Валютные позиции (наличные) по FIGI
+CASH_FIGIS = {"RUB000UTSTOM": "RUB", "USD000UTSTOM": "USD", "EUR000UTSTOM": "EUR"}
+
+
+def _nano_column(values: List[int]) -> np.ndarray:
+    """Столбец нано-значений в float64 (единицы)"""
+    return np.array(values, dtype=np.int64).astype(np.float64) / NANO
+
+
+class ValuationEngine:
+    """Оценка позиций одного или многих счетов за один проход.
+
+    Позиции загружаются в столбцы (количество, средняя цена, последняя
+    цена, индекс валюты), стоимость, P&L и итоги по счетам считаются
+    векторными операциями. Исходные значения читаются из Quotation в
+    целых нано, в float64 переводятся один раз при загрузке.
+    """
+
+    def __init__(self):
+        self._accounts: List[Dict] = []
+        self._account_index: Dict[str, int] = {}
+        self._currencies: Dict[str, int] = {"RUB": 0}
+
+        # Строки позиций до построения столбцов
+        self._rows_account: List[int] = []
+        self._figis: List[str] = []
+        self._types: List[str] = []
+        self._quantity: List[int] = []
+        self._avg_price: List[int] = []
+        self._currency: List[int] = []
+        self._infos: List[Dict] = []
+
+        # Наличные
+        self._cash_account: List[int] = []
+        self._cash_currency: List[int] = []
+        self._cash_amount: List[int] = []
+
+    def _currency_index(self, currency: str) -> int:
+        index = self._currencies.get(currency)
+        if index is None:
+            index = self._currencies[currency] = len(self._currencies)
+        return index
+
+    def add_account(self, account_id: str, positions: Iterable, instruments_info: Optional[Dict] = None,
+                    account_name: str = "Unknown Account",
+                    stop_orders: Optional[Dict[str, Money]] = None) -> "ValuationEngine":
+        """Добавление позиций счета"""
+        instruments_info = instruments_info or {}
+        account = len(self._accounts)
+        self._account_index[account_id] = account
+        self._accounts.append({
+            "account_id": account_id,
+            "account_name": account_name,
+            "stop_orders": stop_orders or {},
+            "cash": {},
+        })
+
+        for position in positions:
+            figi = position.figi
+            instrument_type = position.instrument_type
+            quantity = to_nano(position.quantity)
+
+            if instrument_type == "currency":
+                currency = CASH_FIGIS.get(figi)
+                cash = self._accounts[account]["cash"]
+                if currency in cash:
+                    self._cash_amount[cash[currency]] = quantity
+                elif currency:
+                    self._cash_account.append(account)
+                    self._cash_currency.append(self._currency_index(currency))
+                    self._cash_amount.append(quantity)
+                    cash[currency] = len(self._cash_amount) - 1
+                continue
+
+            if quantity <= 0 or instrument_type not in VALUED_TYPES:
+                continue
+
+            instrument_info = instruments_info.get(figi, {})
+            self._rows_account.append(account)
+            self._figis.append(figi)
+            self._types.append(instrument_type)
+            self._quantity.append(quantity)
+            self._avg_price.append(to_nano(position.average_position_price))
+            self._currency.append(self._currency_index(instrument_info.get('currency', 'RUB')))
+            self._infos.append(instrument_info)
+
+        return self
+
+    def value(self, current_prices: Dict[str, Money], currency_rates: Dict[str, float]) -> "Valuation":
+        """Оценка всех загруженных счетов по таблице цен и курсам"""
+        rates = np.ones(len(self._currencies), dtype=np.float64)
+        for currency, index in self._currencies.items():
+            if currency != "RUB":
+                rates[index] = currency_rates.get(currency) or 1.0
+
+        account = np.array(self._rows_account, dtype=np.int64)
+        currency = np.array(self._currency, dtype=np.int64)
+        quantity = _nano_column(self._quantity)
+        avg_price = _nano_column(self._avg_price)
+        last_price = _nano_column([
+            current_prices[figi].nano if figi in current_prices else 0 for figi in self._figis
+        ])
+
+        rate = rates[currency]
+        avg_price_rub = avg_price * rate
+        last_price_rub = last_price * rate
+        value_rub = last_price_rub * quantity
+        cost_rub = avg_price_rub * quantity
+        pnl = value_rub - cost_rub
+        pnl_percent = np.divide(pnl * 100, cost_rub, out=np.zeros_like(pnl), where=cost_rub > 0)
+
+        accounts_count = len(self._accounts)
+        cash_account = np.array(self._cash_account, dtype=np.int64)
+        cash_amount = _nano_column(self._cash_amount)
+        cash_rub = cash_amount * rates[np.array(self._cash_currency, dtype=np.int64)]
+
+        return Valuation(
+            engine=self,
+            currency_rates=currency_rates,
+            columns={
+                "quantity": quantity,
+                "avg_price": avg_price,
+                "avg_price_rub": avg_price_rub,
+                "last_price": last_price,
+                "last_price_rub": last_price_rub,
+                "value_rub": value_rub,
+                "pnl": pnl,
+                "pnl_percent": pnl_percent,
+                "cash_amount": cash_amount,
+            },
+            totals={
+                "positions_value": np.bincount(account, weights=value_rub, minlength=accounts_count),
+                "pnl": np.bincount(account, weights=pnl, minlength=accounts_count),
+                "positions_count": np.bincount(account, minlength=accounts_count),
+                "cash_rub": np.bincount(cash_account, weights=cash_rub, minlength=accounts_count),
+            },
+            account_rows=account,
+        )
+
+
+class Valuation:
+    """Результат оценки: столбцы по позициям и итоги по счетам"""
+
+    def __init__(self, engine: ValuationEngine, currency_rates: Dict[str, float], columns: Dict[str, np.ndarray],
+                 totals: Dict[str, np.ndarray], account_rows: np.ndarray):
+        self.engine = engine
+        self.currency_rates = currency_rates
+        self.columns = columns
+        self.totals = totals
+        self.account_rows = account_rows
+
+    def summary(self, account_id: str) -> Dict:
+        """Итоги счета в формате portfolio_data["summary"]"""
+        account = self.engine._account_index[account_id]
+        cash = self.engine._accounts[account]["cash"]
+        cash_amount = self.columns["cash_amount"]
+        positions_value = float(self.totals["positions_value"][account])
+        cash_rub = float(self.totals["cash_rub"][account])
+        return {
+            "total_positions_value": positions_value,
+            "total_pnl": float(self.totals["pnl"][account]),
+            "cash_balance_rub": cash_rub,
+            "cash_balances": {currency: float(cash_amount[row]) for currency, row in cash.items()},
+            "total_equity": positions_value + cash_rub,
+            "positions_count": int(self.totals["positions_count"][account]),
+        }
+
+    def positions(self, account_id: str) -> List[Dict]:
+        """Позиции счета в виде словарей для отчетов"""
+        engine = self.engine
+        account = engine._account_index[account_id]
+        stop_orders = engine._accounts[account]["stop_orders"]
+        rows = np.flatnonzero(self.account_rows == account)
+        columns = {name: column[rows].tolist() for name, column in self.columns.items() if name != "cash_amount"}
+
+        positions = []
+        for i, row in enumerate(rows.tolist()):
+            figi = engine._figis[row]
+            instrument_info = engine._infos[row]
+            stop_loss = stop_orders.get(figi)
+            positions.append({
+                "ticker": instrument_info.get('ticker', 'UNKNOWN'),
+                "figi": figi,
+                "instrument_type": engine._types[row],
+                "name": instrument_info.get('name', 'Unknown'),
+                "currency": instrument_info.get('currency', 'RUB'),
+                "shares": columns["quantity"][i],
+                "cost_basis": columns["avg_price"][i],
+                "cost_basis_rub": columns["avg_price_rub"][i],
+                "stop_loss": float(stop_loss) if stop_loss else None,
+                "current_price": columns["last_price"][i],
+                "current_price_rub": columns["last_price_rub"][i],
+                "total_value": columns["value_rub"][i],
+                "pnl": columns["pnl"][i],
+                "pnl_percent": columns["pnl_percent"][i],
+            })
+        return positions
+
+    def portfolio_data(self, account_id: str) -> Dict:
+        """Полные данные счета в формате TinkoffClient.get_portfolio_data"""
+        account = self.engine._accounts[self.engine._account_index[account_id]]
+        return {
+            "date": datetime.now().isoformat(),
+            "account_id": account_id,
+            "account_name": account["account_name"],
+            "currency_rates": self.currency_rates,
+            "positions": self.positions(account_id),
+            "summary": self.summary(account_id),
+        }
@@ -0,0 +1,144 @@
+"""Прием обновлений Telegram через webhook"""
+import hmac
+import json
+import logging
+import ssl
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+from .metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Заголовок с секретом, заданным в setWebhook
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+# Максимальный размер тела обновления, байт
+MAX_BODY_SIZE = 1024 * 1024
+
+# Сколько последних update_id помнить (Telegram повторяет неподтвержденные обновления)
+RECENT_UPDATES = 1000
+
+
+class WebhookServer:
+    """Локальный HTTP-сервер для обновлений Telegram.
+
+    Обновление подтверждается ответом 200 сразу после чтения, затем
+    передается в dispatch (CommandHandler._process_update) в потоке
+    запроса. Запросы без верного секрета отклоняются, повторно
+    присланные update_id пропускаются. HTTPS обычно завершает внешний
+    прокси; при заданных cert_file/key_file сервер принимает TLS сам.
+    """
+
+    def __init__(self, dispatch: Callable[[dict], None], host: str = "0.0.0.0", port: int = 8443,
+                 path: str = "/telegram", secret_token: str = "", cert_file: str = "", key_file: str = ""):
+        self.dispatch = dispatch
+        self.host = host
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self.cert_file = cert_file
+        self.key_file = key_file
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._recent = deque(maxlen=RECENT_UPDATES)
+        self._recent_ids = set()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._server is not None
+
+    @property
+    def address(self) -> str:
+        """Адрес сервера (после start порт известен и при port=0)"""
+        scheme = "https" if self.cert_file else "http"
+        host, port = self._server.server_address[:2] if self._server else (self.host, self.port)
+        return f"{scheme}://{host}:{port}{self.path}"
+
+    def _is_new(self, update_id) -> bool:
+        """Первое ли это получение обновления"""
+        if update_id is None:
+            return True
+        with self._lock:
+            if update_id in self._recent_ids:
+                return False
+            if len(self._recent) == self._recent.maxlen:
+                self._recent_ids.discard(self._recent[0])
+            self._recent.append(update_id)
+            self._recent_ids.add(update_id)
+            return True
+
+    def _handle(self, request: BaseHTTPRequestHandler) -> None:
+        if request.path.split('?')[0] != self.path:
+            request.send_error(404)
+            return
+
+        secret = request.headers.get(SECRET_HEADER, "")
+        if self.secret_token and not hmac.compare_digest(secret, self.secret_token):
+            REGISTRY.inc("webhook_rejected_total", reason="secret")
+            logger.warning(f"Webhook: запрос с неверным секретом от {request.client_address[0]}")
+            request.send_error(403)
+            return
+
+        length = int(request.headers.get("Content-Length") or 0)
+        if length <= 0 or length > MAX_BODY_SIZE:
+            REGISTRY.inc("webhook_rejected_total", reason="size")
+            request.send_error(400)
+            return
+
+        try:
+            update = json.loads(request.rfile.read(length))
+        except ValueError:
+            REGISTRY.inc("webhook_rejected_total", reason="json")
+            request.send_error(400)
+            return
+
+        # Подтверждение до обработки: Telegram не ждет выполнения команды
+        request.send_response(200)
+        request.send_header("Content-Length", "0")
+        request.end_headers()
+
+        if not isinstance(update, dict):
+            REGISTRY.inc("webhook_rejected_total", reason="json")
+            return
+        if not self._is_new(update.get('update_id')):
+            REGISTRY.inc("webhook_duplicates_total")
+            return
+
+        REGISTRY.inc("webhook_updates_total")
+        try:
+            self.dispatch(update)
+        except Exception as e:
+            logger.error(f"Webhook: ошибка обработки обновления: {e}")
+
+    def start(self) -> None:
+        if self._server:
+            return
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                server._handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        if self.cert_file:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(self.cert_file, self.key_file or None)
+            self._server.socket = context.wrap_socket(self._server.socket, server_side=True)
+        threading.Thread(target=self._server.serve_forever, daemon=True, name="webhook-http").start()
+        logger.info(f"Webhook сервер запущен: {self.address}")
+
+    def stop(self) -> None:
+        if not self._server:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._server = None
+        logger.info("Webhook сервер остановлен")